@@ -27,8 +27,28 @@ config = {
     # U263: H263,
     # I263: H263I,
     # FLV1: FLV1
+    # and with the ffmpeg encoder also:
+    # h264: H.264 / AVC,
+    # h265: H.265 / HEVC
+    # With MJPG, JPEG files that are already the size of the frames are
+    # copied into the video without decoding them, if ffmpeg is installed.
     "codec": "DIVX",
 
+    # How to encode the video:
+    # - opencv: with OpenCV's VideoWriter
+    # - ffmpeg: by piping the frames to ffmpeg, which needs to be installed
+    "encoder": "opencv",
+
+    # Quality settings for the ffmpeg encoder, None for ffmpeg's defaults:
+    # - crf: constant rate factor, lower is better, e.g. 23 for h264
+    # - preset: speed preset, e.g. "veryfast" or "slow"
+    # - bitrate: target bitrate, e.g. "4M"
+    # - encoderThreads: number of threads to encode with
+    "crf": None,
+    "preset": None,
+    "bitrate": None,
+    "encoderThreads": None,
+
     # Frames per second to record at
     "fps": 60,
 
@@ -42,14 +62,171 @@ config = {
 
     # Filter to use only every Nth file, e.g. if known to have 1 image per
     # minute, a value of 1440 should give you a picture at the same time on
-    # every day
+    # every day, as long as no image is missing. See dailyAt for that.
     "useNthFile": None,
 
+    # Leave out files that look the same as the last one used, e.g. at
+    # night or when the same image got saved again, before picking the
+    # files for the FPS and duration. Each file gets a 64 bit perceptual
+    # hash, and files less than this many bits from the last one used are
+    # left out, so 1 only drops files with identical hashes and around 5
+    # also ones with some noise. The hashes are kept in
+    # outFile + ".hashes". None to disable.
+    "dedup": None,
+
+    # How to pick the files when both FPS and duration are given:
+    # - index: keep every so many files, assuming they were taken at even
+    #   intervals
+    # - time: keep the file nearest to each of evenly spaced times between
+    #   the first and last file, so outages and changing intervals don't
+    #   change the speed of the video. The time of a file is the last
+    #   number in its filename, or if some filename has none, its modified
+    #   time.
+    "selectBy": "index",
+
+    # With selectBy time, repeat the last frame before a gap in capturing
+    # for as long as the gap lasts, instead of leaving the gap out
+    "fillGaps": False,
+
     # Only include images taken between the timestamps XX:XX:XX-YY:YY:YY
     # Will pick last number in filename and assume it's a unix timestamp,
-    # then filter based on the given time range
+    # then filter based on the given time range. Ranges like
+    # 22:00:00-04:00:00 wrap around midnight.
     "onlyBetweenTimes": None,
 
+    # Only use the image nearest to the given time of day on every day, as
+    # "HH:MM:SS", or the ones nearest to each of several times, as a list or
+    # separated by commas. Uses the timestamps in the filenames like
+    # onlyBetweenTimes, so missing images don't matter.
+    "dailyAt": None,
+
     # Parse the file timestamp as if from the given timezone, None for local
-    "timestampTimezone": "GMT"
+    "timestampTimezone": "GMT",
+
+    # Resize the frames to the given size, e.g. "1920x1080". None to use the
+    # size of the first image. Images of any other size are resized to fit.
+    "resize": None,
+
+    # Crop the given area out of every image before resizing, as "x,y,w,h"
+    "crop": None,
+
+    # How to fit images of a different aspect ratio to the frame:
+    # - letterbox: scale the whole image to fit, adding black borders
+    # - crop: scale the image to fill the frame, cutting off the edges
+    "fit": "letterbox",
+
+    # Average the files between frames into each frame instead of skipping
+    # them, for smoother motion and less flicker:
+    # - N: blend up to N files into each frame
+    # - "auto": blend all the files
+    # None to only use one file for each frame.
+    "blend": None,
+
+    # Even out the brightness changes between frames caused by the camera's
+    # auto-exposure, by scaling each frame towards the average brightness
+    # of this many files around it. The measured brightness is kept in
+    # outFile + ".deflicker", so changing this doesn't need everything to
+    # be measured again. None to disable.
+    "deflicker": None,
+
+    # What to do about files that can't be decoded, or are cut short because
+    # they were still being written:
+    # - skip: leave the frame out
+    # - repeat-previous: use the previous frame again
+    # - abort: stop with an error
+    "onBadFrame": "abort",
+
+    # Leave out files modified less than this many seconds ago, so a
+    # directory the camera is still writing to can be used. None to use all
+    # the files.
+    "ignoreRecent": None,
+
+    # Check all the frames before encoding, without decoding them if
+    # possible, for broken files and files of a different size than the
+    # rest:
+    # - report: list the invalid files and stop
+    # - skip: list the invalid files and leave them out
+    # None to not check.
+    "validate": None,
+
+    # Render a quick preview instead, for trying out the settings picking
+    # the files. The frames come from thumbnails of the images cached in
+    # outFile + ".preview", so only images not rendered before need to be
+    # decoded. Cropping and resizing are left out.
+    "preview": False,
+
+    # Size of the preview as "WxH", None for 320 pixels wide
+    "previewSize": None,
+
+    # Maximum size of the thumbnail cache in megabytes, the least recently
+    # used thumbnails make room for new ones
+    "previewCacheSize": 1024,
+
+    # Only encode the files that are not yet in outFile and append them to
+    # it. Which files have been used is recorded next to outFile, in
+    # outFile + ".manifest". Needs ffmpeg, and can't be used with duration.
+    "append": False,
+
+    # File to keep an index of the scanned image files in, e.g.
+    # "timelapse.avi.index". Later runs will then only look at new and
+    # changed files instead of scanning everything again. Directories are
+    # only listed again when files are added, removed or renamed in them,
+    # so files rewritten in place keep their old modified time and size in
+    # the index. Remove the index after changing files that way. None to
+    # disable.
+    "scanIndex": None,
+
+    # Encode in segments of this many frames, and record each finished one
+    # in outFile + ".checkpoint". An interrupted encode can then be
+    # continued with resume, without encoding the finished segments again.
+    # Needs ffmpeg. None to encode in one go.
+    "checkpointFrames": None,
+
+    # Continue from the checkpoint of an interrupted encode, if the files
+    # and settings are still the same
+    "resume": False,
+
+    # Keep running and encode new files as they arrive, instead of encoding
+    # the files found once. The frames go into a video for each period of
+    # time, named after outFile and the period, e.g.
+    # timelapse.2013-06-01-14.avi:
+    # - hourly: a video for each hour
+    # - daily: a video for each day
+    # The time of each file is taken from the timestamp in its filename, or
+    # when there is none, its modified time. The files there already are
+    # left out, unless startFile is given. None to encode once and exit.
+    "watch": None,
+
+    # How long to wait for new files before checking if the current video
+    # is done. Where inotify isn't available the directories are listed
+    # this often, and a file is only used once it hasn't changed for this
+    # long.
+    "watchInterval": 5,
+
+    # File to write the progress, an ETA and the time spent in each stage
+    # to, as a line of JSON every statsInterval seconds. "-" writes them to
+    # stdout. Each encoding process writes its own lines. None to disable.
+    "statsFile": None,
+    "statsInterval": 10,
+
+    # Number of processes to encode with. The video is split to this many
+    # chunks, which are encoded in parallel and then joined with ffmpeg.
+    "encodeWorkers": 1,
+
+    # Number of threads decoding upcoming frames while the video is being
+    # encoded, 0 to decode each frame only when it's needed. None decodes
+    # with a thread per CPU when blending, and serially otherwise.
+    "decodeWorkers": None,
+
+    # Number of processes decoding upcoming frames, for when decodeWorkers
+    # can't keep up. The frames are passed to the encoder through shared
+    # memory with room for prefetch frames, instead of copying each one
+    # between processes. Used instead of decodeWorkers, None or 0 to not
+    # use processes. With encodeWorkers, the encoding processes decode with
+    # this many threads instead.
+    "decodeProcesses": None,
+
+    # Maximum number of decoded frames to keep waiting for the encoder,
+    # None for twice the number of decodeWorkers or decodeProcesses
+    "prefetch": None
 }
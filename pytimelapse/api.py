@@ -0,0 +1,346 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+import collections
+import itertools
+import logging
+
+import numpy
+
+from core import ConfigHandler
+from core import Pytimelapse
+from filehandler import FileHandler
+from pipeline import BadFramePolicy
+from stats import Stats
+import media
+import transform
+
+
+__doc__ = """Programmatic interface to Pytimelapse
+
+E.g. to make a video of every 10th image, or of frames generated in memory:
+
+    from pytimelapse.api import render
+
+    result = render(paths, "timelapse.mp4", fps=30, useNthFile=10,
+                    codec="h264", encoder="ffmpeg")
+    print(result.frames, result.stats["stages"])
+"""
+
+
+# Settings render() takes, with the same meaning and defaults as in the
+# config file. File discovery, validation, appending, checkpoints and
+# deflickering are left to the command line tool.
+defaults = {
+    "codec": "DIVX",
+    "encoder": "opencv",
+    "crf": None,
+    "preset": None,
+    "bitrate": None,
+    "encoderThreads": None,
+    "fps": 60,
+    "duration": None,
+    "useNthFile": None,
+    "resize": None,
+    "crop": None,
+    "fit": "letterbox",
+    "blend": None,
+    "onBadFrame": "abort",
+    "statsFile": None,
+    "statsInterval": 10,
+    "decodeWorkers": None,
+    "prefetch": None
+}
+
+
+class Result(object):
+    """What render() wrote"""
+
+    def __init__(self, filename, frameSize, fps, frames, sources, skipped,
+                 bad, stats):
+        self.filename = filename
+        self.frameSize = frameSize
+        self.fps = fps
+
+        # Frames written, items read from the input and how many of them
+        # were filtered out
+        self.frames = frames
+        self.sources = sources
+        self.skipped = skipped
+
+        # (filename, problem) of the files that couldn't be used
+        self.bad = bad
+
+        # Stats.summary() of the whole render
+        self.stats = stats
+
+    @property
+    def duration(self):
+        """Length of the video in seconds"""
+        return self.frames / float(self.fps)
+
+
+class Renderer(object):
+    """Streams images through the filter, transform and encode stages
+    into a video
+
+    The images can be any iterable of image file paths or decoded BGR
+    frames as NumPy arrays, like cv2.imread() returns, or a mix of both.
+    Only the items ending up in the video are decoded, and only the ones
+    waiting to be encoded are kept in memory.
+    """
+
+    def __init__(self, **settings):
+        self.logger = logging.getLogger("pytimelapse")
+
+        for key in settings:
+            if key not in defaults:
+                raise TypeError("Unknown setting {}".format(key))
+
+        self.config = dict(defaults)
+        self.config.update(settings)
+
+        ConfigHandler().check_config(self.config, self)
+
+        self.sources = 0
+        self.skipped = 0
+
+    def error(self, message):
+        """Report an invalid setting, like argparse does for the command
+        line"""
+        raise ValueError(message)
+
+    def render(self, images, filename, count=None):
+        """Encode the images to a video file, count is the number of images
+        if they don't have a len(). Returns a Result."""
+
+        config = self.config
+
+        if count is None and hasattr(images, "__len__"):
+            count = len(images)
+
+        ranges = self.get_ranges(count)
+        fps = self.get_fps(ranges)
+
+        total = None
+        if isinstance(ranges, list):
+            total = len(ranges)
+
+        stats = Stats(
+            config.get("statsFile"),
+            config.get("statsInterval") or 10,
+            total,
+            "render"
+        )
+
+        app = Pytimelapse()
+        imageHandler = media.ImageHandler()
+        policy = BadFramePolicy(config["onBadFrame"], imageHandler)
+        checked = policy.wrap(stats.wrap("decode", imageHandler.read))
+
+        def decode(item):
+            # Frames already in memory only need to be encoded
+            if isinstance(item, numpy.ndarray):
+                return item
+
+            return checked(item)
+
+        # Whether each selected item is the last one of its frame, filled in
+        # as the decoder reads the items
+        ends = collections.deque()
+
+        self.sources = 0
+        self.skipped = 0
+
+        frames = app.read_frames(
+            imageHandler,
+            self.select(images, ranges, ends),
+            config,
+            decode,
+            stats
+        )
+        frames = policy.apply(frames)
+
+        blender = None
+        if config.get("blend"):
+            blender = transform.FrameBlender()
+            blender.add = stats.wrap("blend", blender.add)
+
+        frameSize = None
+        frameTransform = None
+        video = None
+
+        try:
+            for image in frames:
+                last = ends.popleft()
+
+                if image is not None:
+                    # The frame size isn't known before the first image
+                    if video is None:
+                        frameSize = self.get_frame_size(image)
+                        frameTransform = app.get_transform(frameSize, config)
+                        frameTransform.apply = stats.wrap(
+                            "transform", frameTransform.apply
+                        )
+
+                        video = app.get_video(
+                            dict(config, fps=fps), frameSize
+                        )
+                        video.write_image = stats.wrap(
+                            "encode", video.write_image
+                        )
+                        video.open(filename)
+
+                    image = frameTransform.apply(image)
+
+                if blender:
+                    if image is not None:
+                        blender.add(image)
+
+                    if not last:
+                        continue
+
+                    image = blender.finish()
+
+                if image is None:
+                    continue
+
+                video.write_image(image)
+                stats.tick()
+
+            # The images ran out in the middle of a frame
+            if blender:
+                image = blender.finish()
+
+                if image is not None:
+                    video.write_image(image)
+                    stats.tick()
+        finally:
+            if video:
+                video.close()
+
+            stats.close()
+
+        if video is None:
+            raise ValueError("No images to render")
+
+        self.logger.info(
+            "Rendered {frames} frames from {sources} images".format(**{
+                "frames": stats.frames,
+                "sources": self.sources
+            })
+        )
+
+        return Result(
+            filename,
+            frameSize,
+            fps,
+            stats.frames,
+            self.sources,
+            self.skipped,
+            policy.bad,
+            stats.summary(done=True)
+        )
+
+    def get_ranges(self, count):
+        """The (start, end) positions of the images going into each frame,
+        as a list if count is known and otherwise as an endless iterator"""
+
+        config = self.config
+
+        if count is not None:
+            positions = list(range(count))
+
+            if config.get("blend"):
+                groups = FileHandler().group_files(positions, config)
+            else:
+                groups = [
+                    [position]
+                    for position in FileHandler().filter_files(
+                        positions, config
+                    )
+                ]
+
+            return [(group[0], group[-1] + 1) for group in groups if group]
+
+        step = config.get("useNthFile") or 1
+
+        if step == 1 and None not in (config["fps"], config["duration"]):
+            raise ValueError(
+                "The number of images is needed for picking them for both "
+                "an FPS and a duration"
+            )
+
+        size = 1
+        if config.get("blend"):
+            blend = transform.parse_blend(config["blend"])
+
+            if blend == "auto":
+                size = step
+            else:
+                size = min(blend, step)
+
+        return (
+            (start, start + size) for start in itertools.count(0, step)
+        )
+
+    def get_fps(self, ranges):
+        """The FPS of the video"""
+
+        config = self.config
+
+        if config["fps"] is not None:
+            return config["fps"]
+
+        if not isinstance(ranges, list):
+            raise ValueError(
+                "The number of images is needed for picking an FPS for the "
+                "duration"
+            )
+
+        return len(ranges) / float(config["duration"])
+
+    def select(self, images, ranges, ends):
+        """Iterate the images going into the video, appending to ends
+        whether each one is the last of its frame"""
+
+        ranges = iter(ranges)
+        start, end = next(ranges, (None, None))
+
+        for i, image in enumerate(images):
+            while end is not None and i >= end:
+                start, end = next(ranges, (None, None))
+
+            # No more frames to fill
+            if end is None:
+                return
+
+            self.sources += 1
+
+            if i < start:
+                self.skipped += 1
+                continue
+
+            ends.append(i == end - 1)
+            yield image
+
+    def get_frame_size(self, image):
+        """Figure out the frame size for the video from the settings, or the
+        first image"""
+
+        config = self.config
+
+        if config.get("resize"):
+            return transform.parse_size(config["resize"])
+
+        if config.get("crop"):
+            return transform.parse_crop(config["crop"])[2:]
+
+        return (image.shape[1], image.shape[0])
+
+
+def render(images, filename, count=None, **settings):
+    """Encode the images, paths or NumPy frames, to a video file using the
+    settings of the config file. Returns a Result."""
+
+    return Renderer(**settings).render(images, filename, count)
@@ -0,0 +1,502 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+import argparse
+import array
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy
+
+from pytimelapse import media
+from pytimelapse import transform
+from pytimelapse.core import Pytimelapse
+from pytimelapse.filehandler import File
+from pytimelapse.filehandler import FileHandler
+from pytimelapse.filehandler import FileList
+
+
+__doc__ = """Benchmarks for Pytimelapse"""
+
+
+class DictFile(object):
+    """File record like the old File class, with a __dict__ per object"""
+
+    def __init__(self, filepath, basename, modified):
+        self.filepath = filepath
+        self.basename = basename
+        self.modified = modified
+
+
+def synthetic_files(count, seed=0):
+    """Generate shuffled (filepath, basename, modified) of count snapshots
+    taken once a minute"""
+
+    rng = random.Random(seed)
+    order = list(range(count))
+    rng.shuffle(order)
+
+    for i in order:
+        timestamp = 1380000000 + i * 60
+        basename = "snapshot-{}.jpg".format(timestamp)
+        yield "/data/camera/" + basename, basename, timestamp + rng.random()
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes"""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, OS X bytes
+    if sys.platform != "darwin":
+        peak *= 1024
+
+    return peak
+
+
+def build_objects(count, cls):
+    fileData = []
+    for filepath, basename, modified in synthetic_files(count):
+        if cls is File:
+            fileData.append(File(filepath, modified))
+        else:
+            fileData.append(cls(filepath, basename, modified))
+
+    return fileData
+
+
+def memory_objects(count, cls):
+    """Build, sort and skip through a list of file objects"""
+
+    fileHandler = FileHandler()
+
+    fileData = build_objects(count, cls)
+    built = time.time()
+
+    fileHandler.sort_objects(fileData, "modified")
+
+    # Same linear search the old start_from did
+    search = fileData[len(fileData) // 2].filepath
+    for i, file in enumerate(fileData):
+        if file.filepath == search:
+            fileData = fileData[i:]
+            break
+
+    return built
+
+
+def memory_columns(count):
+    """Build, sort and skip through a FileList"""
+
+    fileHandler = FileHandler()
+
+    paths = []
+    modified = array.array("d")
+    for filepath, basename, mtime in synthetic_files(count):
+        paths.append(filepath)
+        modified.append(mtime)
+
+    fileList = FileList(paths, modified)
+    del paths, modified
+    built = time.time()
+
+    fileList.sort("modified")
+    fileHandler.start_from(fileList, fileList.paths[len(fileList) // 2])
+
+    return built
+
+
+variants = {
+    "dict": lambda count: memory_objects(count, DictFile),
+    "slots": lambda count: memory_objects(count, File),
+    "columns": memory_columns
+}
+
+
+def run_variant(name, count, results):
+    """Run a single memory benchmark variant, in its own process"""
+
+    baseline = peak_rss()
+    started = time.time()
+
+    built = variants[name](count)
+
+    results.put({
+        "benchmark": "filelist",
+        "variant": name,
+        "count": count,
+        "buildSeconds": built - started,
+        "processSeconds": time.time() - built,
+        "peakRssBytes": peak_rss() - baseline
+    })
+
+
+def benchmark_memory(counts, names=None):
+    """Measure memory use of the file list representations, returns a list
+    of result dicts"""
+
+    results = []
+
+    for count in counts:
+        for name in names or sorted(variants):
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=run_variant,
+                args=(name, count, queue)
+            )
+            process.start()
+            result = queue.get()
+            process.join()
+
+            results.append(result)
+
+    return results
+
+
+def synthetic_images(directory, count, frameSize, extension="jpg"):
+    """Write count synthetic images of frameSize to directory, returns their
+    paths"""
+
+    width, height = frameSize
+
+    # A gradient with some noise, so the encoder has something to do
+    x = numpy.linspace(0, 255, width, dtype=numpy.float32)
+    y = numpy.linspace(0, 255, height, dtype=numpy.float32)
+    base = (x[numpy.newaxis, :] + y[:, numpy.newaxis]) / 2
+
+    rng = numpy.random.RandomState(0)
+
+    paths = []
+    for i in range(count):
+        image = numpy.empty((height, width, 3), dtype=numpy.uint8)
+        shift = (i * 255.0) / max(count, 1)
+        for channel in range(3):
+            image[:, :, channel] = (base + shift * (channel + 1)) % 256
+
+        image += rng.randint(0, 8, image.shape).astype(numpy.uint8)
+
+        path = os.path.join(
+            directory,
+            "snapshot-{}.{}".format(1380000000 + i * 60, extension)
+        )
+        cv2.imwrite(path, image)
+        paths.append(path)
+
+    return paths
+
+
+def benchmark_encode(frames, frameSize, workers, codec="DIVX",
+                     encoder="opencv"):
+    """Time encoding frames synthetic images serially and with each of the
+    given numbers of encoder processes, returns a list of result dicts"""
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        files = synthetic_images(directory, frames, frameSize)
+
+        app = Pytimelapse()
+        results = []
+        serialSeconds = None
+
+        for count in [1] + [count for count in workers if count > 1]:
+            config = {
+                "codec": codec,
+                "encoder": encoder,
+                "fps": 30.0,
+                "encodeWorkers": count
+            }
+
+            outFile = os.path.join(directory, "timelapse{}.avi".format(count))
+
+            started = time.time()
+            app.encode(media.ImageHandler(), files, frameSize, config, outFile)
+            seconds = time.time() - started
+
+            if serialSeconds is None:
+                serialSeconds = seconds
+
+            results.append({
+                "benchmark": "encode",
+                "codec": codec,
+                "encoder": encoder,
+                "bytes": os.path.getsize(outFile),
+                "frames": frames,
+                "frameSize": list(frameSize),
+                "encodeWorkers": count,
+                "seconds": seconds,
+                "framesPerSecond": frames / seconds,
+                "speedup": serialSeconds / seconds
+            })
+    finally:
+        shutil.rmtree(directory)
+
+    return results
+
+
+def stage_result(stage, count, seconds, details):
+    """Result dict of a single stage"""
+
+    result = {
+        "benchmark": "stages",
+        "stage": stage,
+        "count": count,
+        "seconds": seconds,
+        "framesPerSecond": count / seconds if seconds else None,
+        "peakRssBytes": peak_rss(),
+        "opencv": cv2.__version__
+    }
+    result.update(details)
+
+    return result
+
+
+def benchmark_stages(count, frameSize, extension="jpg", decodeWorkers=0,
+                     codec="DIVX", encoder="opencv"):
+    """Time each stage of a timelapse separately on a synthetic corpus of
+    count images, returns a list of result dicts"""
+
+    directory = tempfile.mkdtemp()
+    details = {
+        "frameSize": list(frameSize),
+        "format": extension,
+        "decodeWorkers": decodeWorkers,
+        "codec": codec,
+        "encoder": encoder
+    }
+
+    try:
+        synthetic_images(directory, count, frameSize, extension)
+
+        app = Pytimelapse()
+        fileHandler = FileHandler()
+        results = []
+
+        config = {
+            "imageFiles": [os.path.join(directory, "*." + extension)],
+            "sortFiles": "modified",
+            "onlyBetweenTimes": "06:00:00-18:00:00",
+            "timestampTimezone": "UTC",
+            "useNthFile": None,
+            "fps": 30.0,
+            "duration": None,
+            "decodeWorkers": decodeWorkers,
+            "codec": codec,
+            "encoder": encoder
+        }
+
+        # Discovery
+        started = time.time()
+        paths = []
+        modified = array.array("d")
+        for filepath, mtime in fileHandler.scan(config["imageFiles"][0], True):
+            paths.append(filepath)
+            modified.append(mtime)
+        fileList = FileList(paths, modified)
+        results.append(
+            stage_result("discovery", count, time.time() - started, details)
+        )
+
+        # Sort
+        started = time.time()
+        fileList.sort(config["sortFiles"])
+        results.append(
+            stage_result("sort", count, time.time() - started, details)
+        )
+
+        # Time of day filtering
+        started = time.time()
+        filtered = fileHandler.filter_times(fileList, config)
+        results.append(
+            stage_result("filter_times", count, time.time() - started, details)
+        )
+
+        # Frame selection, keeping every other file, if there are enough
+        # of them left
+        if len(filtered) >= 2:
+            config["duration"] = len(filtered) // 2 / config["fps"]
+            started = time.time()
+            fileHandler.filter_files(filtered.paths, config)
+            results.append(
+                stage_result(
+                    "filter_files", len(filtered), time.time() - started,
+                    details
+                )
+            )
+
+        # Decoding all the images
+        imageHandler = media.ImageHandler()
+        started = time.time()
+        for image in app.read_frames(imageHandler, fileList.paths, config):
+            pass
+        results.append(
+            stage_result("decode", count, time.time() - started, details)
+        )
+
+        # Scaling to half size, the same image over and over
+        image = imageHandler.read(fileList.paths[0])
+        outSize = (frameSize[0] // 2, frameSize[1] // 2)
+        frameTransform = transform.FrameTransform(outSize)
+
+        started = time.time()
+        for i in range(count):
+            frameTransform.apply(image)
+        results.append(
+            stage_result("transform", count, time.time() - started, details)
+        )
+
+        # Encoding, without any decoding
+        outFile = os.path.join(directory, "timelapse.avi")
+        video = app.get_video(config, frameSize)
+        video.open(outFile)
+
+        started = time.time()
+        for i in range(count):
+            video.write_image(image)
+        video.close()
+        results.append(
+            stage_result("encode", count, time.time() - started, details)
+        )
+    finally:
+        shutil.rmtree(directory)
+
+    return results
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="benchmark")
+
+    filelist = subparsers.add_parser(
+        "filelist",
+        help="Memory use of file list representations"
+    )
+
+    filelist.add_argument(
+        '--count',
+        help="Number of synthetic files, defaults to 1M and 10M",
+        type=int,
+        nargs="*",
+        default=[1000000, 10000000],
+        metavar="N"
+    )
+
+    filelist.add_argument(
+        '--variant',
+        help="File list representation to measure, defaults to all",
+        nargs="*",
+        choices=sorted(variants)
+    )
+
+    encode = subparsers.add_parser(
+        "encode",
+        help="Serial versus chunked parallel encoding"
+    )
+
+    encode.add_argument(
+        '--frames',
+        help="Number of synthetic frames, defaults to 10000",
+        type=int,
+        default=10000,
+        metavar="N"
+    )
+
+    encode.add_argument(
+        '--size',
+        help="Size of the synthetic frames, defaults to 640x480",
+        type=transform.parse_size,
+        default=(640, 480),
+        metavar="WxH"
+    )
+
+    encode.add_argument(
+        '--workers',
+        help="Numbers of encoder processes to compare against serial "
+             "encoding, defaults to the number of CPUs",
+        type=int,
+        nargs="*",
+        default=[multiprocessing.cpu_count()],
+        metavar="N"
+    )
+
+    stages = subparsers.add_parser(
+        "stages",
+        help="Throughput of each stage on a synthetic image corpus"
+    )
+
+    stages.add_argument(
+        '--count',
+        help="Number of synthetic images, defaults to 1000",
+        type=int,
+        default=1000,
+        metavar="N"
+    )
+
+    stages.add_argument(
+        '--size',
+        help="Size of the synthetic images, defaults to 1280x720",
+        type=transform.parse_size,
+        default=(1280, 720),
+        metavar="WxH"
+    )
+
+    stages.add_argument(
+        '--format',
+        help="Image format of the corpus, defaults to jpg",
+        choices=["jpg", "png"],
+        default="jpg"
+    )
+
+    stages.add_argument(
+        '--decodeWorkers',
+        help="Number of decoder threads, defaults to decoding serially",
+        type=int,
+        default=0,
+        metavar="N"
+    )
+
+    for subparser in [encode, stages]:
+        subparser.add_argument(
+            '--codec',
+            help="Codec to encode with, defaults to DIVX",
+            default="DIVX"
+        )
+
+        subparser.add_argument(
+            '--encoder',
+            help="Encoder to use, defaults to opencv",
+            choices=media.encoders,
+            default="opencv"
+        )
+
+    args = parser.parse_args(arguments)
+
+    if args.benchmark == "stages" and args.count < 1:
+        parser.error("Invalid count, must be at least 1.")
+
+    if args.benchmark == "filelist":
+        results = benchmark_memory(args.count, args.variant)
+    elif args.benchmark == "stages":
+        results = benchmark_stages(
+            args.count, args.size, args.format, args.decodeWorkers,
+            args.codec, args.encoder
+        )
+    else:
+        results = benchmark_encode(
+            args.frames, args.size, args.workers, args.codec, args.encoder
+        )
+
+    for result in results:
+        print(json.dumps(result, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+import hashlib
+import json
+import os
+
+
+__doc__ = """Progress tracking for resuming interrupted encodes"""
+
+
+# Settings that change what the frames of a video look like
+frameSettings = [
+    "codec",
+    "encoder",
+    "fps",
+    "crf",
+    "preset",
+    "bitrate",
+    "blend",
+    "deflicker",
+    "resize",
+    "crop",
+    "fit"
+]
+
+
+class Checkpoint(object):
+    """Records which segments of a video have been finished, for the files
+    and settings identified by key"""
+
+    def __init__(self, key, chunks, done=None):
+        self.key = key
+        self.chunks = [tuple(chunk) for chunk in chunks]
+        self.done = list(done or [])
+
+    @classmethod
+    def get_filename(cls, videoFile):
+        """Get the checkpoint filename for the given video file"""
+        return videoFile + ".checkpoint"
+
+    @classmethod
+    def get_key(cls, files, frameSize, config):
+        """Hash of the frame files and the settings affecting them"""
+
+        data = json.dumps(
+            [
+                files,
+                list(frameSize),
+                [config.get(setting) for setting in frameSettings]
+            ],
+            sort_keys=True
+        )
+
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def load(cls, filename):
+        """Read a checkpoint file, returns None if there is none"""
+
+        if not os.path.exists(filename):
+            return None
+
+        with open(filename) as f:
+            data = json.load(f)
+
+        return cls(data["key"], data["chunks"], data["done"])
+
+    def save(self, filename):
+        """Write the checkpoint, replacing any previous one"""
+
+        data = {
+            "key": self.key,
+            "chunks": [list(chunk) for chunk in self.chunks],
+            "done": self.done,
+            "frames": self.frames()
+        }
+
+        # Write to a temporary file first so a crash can't leave us with a
+        # checkpoint claiming more than was written
+        tempFile = filename + ".tmp"
+
+        with open(tempFile, "w") as f:
+            json.dump(data, f)
+
+        if os.name == "nt" and os.path.exists(filename):
+            os.remove(filename)
+
+        os.rename(tempFile, filename)
+
+    def matches(self, key, chunks):
+        """Check if the checkpoint is for the same frames split the same
+        way"""
+
+        return key == self.key and [tuple(c) for c in chunks] == self.chunks
+
+    def add(self, index):
+        """Record that the chunk at index has been written"""
+
+        if index not in self.done:
+            self.done.append(index)
+
+    def frames(self):
+        """Number of frames written so far"""
+
+        return sum(
+            end - start
+            for i, (start, end) in enumerate(self.chunks)
+            if i in self.done
+        )
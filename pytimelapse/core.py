@@ -3,22 +3,47 @@
 # Copyright 2013 Janne Enberg
 
 import argparse
+import collections
 import imp
 import logging
 import traceback
 import sys
 import math
+import multiprocessing
+import os
 import time
 import datetime
+from multiprocessing.pool import ThreadPool
 
 import pytimelapse
+from checkpoint import Checkpoint
+from dedup import Dedup
+from deflicker import Deflicker
 from filehandler import FileHandler
+from filehandler import selectModes
+from manifest import Manifest
+from pipeline import BadFramePolicy
+from pipeline import FrameReader
+from pipeline import SharedFrameReader
+from preview import Preview
+from preview import ThumbnailCache
+from preview import previewWidth
+from pipeline import badFramePolicies
+from scanindex import ScanIndex
+from stats import Stats
+from watch import Watch
+from watch import segmentPeriods
 import media
+import transform
 
 
 __doc__ = """Core classes of pytimelapse, main logic"""
 
 
+# What to do about invalid files found when validating
+validateModes = ["report", "skip"]
+
+
 class Launcher(object):
     """Handles initialization logic for the application"""
 
@@ -129,25 +154,96 @@ class Pytimelapse(object):
     def __init__(self):
         self.logger = logging.getLogger("pytimelapse")
 
+        # Files passed since the last one select_files used, for appending
+        self.skipped = None
+
     def run(self, config):
         """Main application logic"""
 
+        if config.get("watch"):
+            Watch(self, config).run()
+            return
+
         self.logger.debug("Scanning for files")
 
         fileHandler = FileHandler()
 
+        # Time finding and picking the files, if asked to
+        stats = self.get_stats(config, "select")
+        findFiles = fileHandler.find_files
+        selectFiles = self.select_files
+        if stats:
+            findFiles = stats.wrap("scan", findFiles)
+            selectFiles = stats.wrap("filter", selectFiles)
+
         # Find the image frames
-        files = fileHandler.find_files(config)
+        files = findFiles(config)
 
         if len(files) == 0:
             raise Exception("No image files found")
 
         self.logger.debug("Done, found {} files".format(len(files)))
 
-        files = fileHandler.filter_files(files, config)
+        imageHandler = media.ImageHandler()
+
+        manifest = None
+        if config.get("append"):
+            manifest = self.get_manifest(config)
+
+        sources = files
+
+        if manifest:
+            newFiles = manifest.new_files(sources)
+
+            if len(newFiles) == 0:
+                self.logger.info("No new files to append")
+
+                if stats:
+                    stats.close()
+
+                return
+
+            self.logger.info(
+                "Appending {} new files".format(len(newFiles))
+            )
+
+            files = selectFiles(
+                fileHandler, newFiles, config, manifest.skipped
+            )
+            frameSize = self.get_frame_size(
+                imageHandler, self.first_file(files), config
+            )
+
+            if not manifest.compatible(
+                config["codec"], config["fps"], frameSize
+            ):
+                self.logger.warning(
+                    "New frames are a different size than the video, "
+                    "encoding everything again"
+                )
+
+                manifest = None
+            else:
+                sources = newFiles
+
+        if not manifest:
+            files = selectFiles(fileHandler, sources, config)
+
+            frameSize = self.get_frame_size(
+                imageHandler, self.first_file(files), config
+            )
 
         self.logger.debug("Filtered to {} files".format(len(files)))
 
+        if stats:
+            stats.close()
+
+        if config.get("preview"):
+            config = self.get_preview_config(
+                imageHandler, self.first_file(files), config
+            )
+            frameSize = transform.parse_size(config["resize"])
+
         # And now we have to recalculate final FPS and duration
         fps, duration = self.get_fps_duration(files, config)
 
@@ -159,10 +255,6 @@ class Pytimelapse(object):
             })
         )
 
-        # Figure out the frame size for the video, picking the size of the
-        # first image
-        frameSize = media.ImageHandler().get_size(files[0])
-
         self.logger.info(
             "Frames will be {width}x{height}".format(**{
                 "width": frameSize[0],
@@ -170,29 +262,886 @@ class Pytimelapse(object):
             })
         )
 
+        imageHandler = media.ImageHandler(
+            self.get_reduction(
+                imageHandler, self.first_file(files), frameSize, config, files
+            )
+        )
+
+        if manifest:
+            segments = media.SegmentHandler()
+            segment = segments.get_name(config["outFile"], "append")
+
+            self.encode(imageHandler, files, frameSize, config, segment)
+
+            self.logger.info("Joining new frames to the video")
+
+            try:
+                segments.concat(
+                    [config["outFile"], segment],
+                    config["outFile"]
+                )
+            finally:
+                os.remove(segment)
+        else:
+            self.encode(
+                imageHandler, files, frameSize, config, config["outFile"]
+            )
+
+            if config.get("append"):
+                manifest = Manifest(config["codec"], config["fps"], frameSize)
+
+        if manifest:
+            manifest.add(sources, len(files), self.skipped)
+            manifest.save(Manifest.get_filename(config["outFile"]))
+
+    def get_stats(self, config, label, total=None):
+        """Get the stats collector if configured to write stats"""
+
+        if not config.get("statsFile"):
+            return None
+
+        return Stats(
+            config["statsFile"],
+            config.get("statsInterval") or 10,
+            total,
+            label
+        )
+
+    def select_files(self, fileHandler, files, config, skipped=None):
+        """Pick the files to use as frames, when blending each frame is a
+        list of files
+
+        With useNthFile, skipped carries on from the files left over by an
+        earlier selection, and the files left over this time are kept in
+        self.skipped.
+        """
+
+        self.skipped = None
+
+        if config.get("dedup"):
+            files = self.dedup_files(files, config)
+
+        blend = config.get("blend")
+
+        # Blended frames use all the files, so check them all
+        if blend:
+            files = self.validate_files(files, config)
+            frames = fileHandler.group_files(files, config)
+
+            self.logger.info(
+                "Blending up to {count} files into each frame".format(**{
+                    "count": max(len(group) for group in frames)
+                })
+            )
+
+            return frames
+
+        if config.get("useNthFile"):
+            self.skipped = fileHandler.count_skipped(
+                len(files), config, skipped
+            )
+
+        files = fileHandler.filter_files(files, config, skipped=skipped)
+
+        return self.validate_files(files, config)
+
+    def dedup_files(self, files, config):
+        """Leave out the files that look the same as the one before, with
+        the hashes cached next to the video"""
+
+        dedup = Dedup(config["dedup"], Dedup.get_filename(config["outFile"]))
+
+        try:
+            return dedup.filter(files)
+        finally:
+            dedup.close()
+
+    def validate_files(self, files, config):
+        """Validate the files if configured to"""
+
+        if config.get("validate"):
+            files = self.validate(files, config)
+
+            if len(files) == 0:
+                raise Exception("No valid image files found")
+
+        return files
+
+    def first_file(self, frames):
+        """The first file of the frames"""
+
+        if isinstance(frames[0], list):
+            return frames[0][0]
+
+        return frames[0]
+
+    def validate(self, files, config):
+        """Check all the files before encoding, reporting or skipping the
+        broken ones and the ones of a different size than the rest"""
+
+        self.logger.info("Validating {} files".format(len(files)))
+
+        imageHandler = media.ImageHandler()
+
+        # Sizes of files already validated on earlier runs
+        known = {}
+        index = None
+        if config.get("scanIndex"):
+            index = ScanIndex(config["scanIndex"])
+            known = index.get_sizes(files)
+
+        pool = ThreadPool(multiprocessing.cpu_count() * 2)
+
+        try:
+            results = pool.map(
+                imageHandler.check,
+                [file for file in files if file not in known],
+                chunksize=64
+            )
+        finally:
+            pool.close()
+            pool.join()
+
+        results = iter(results)
+        checked = {}
+        problems = {}
+        sizes = []
+
+        for file in files:
+            if file in known:
+                sizes.append(known[file])
+                continue
+
+            size, problem = next(results)
+            sizes.append(size)
+
+            if problem:
+                problems[file] = problem
+            else:
+                checked[file] = size
+
+        if index:
+            index.set_sizes(checked)
+            index.close()
+
+        # Whatever size most of the images are is the right one
+        counts = collections.Counter(
+            size for file, size in zip(files, sizes) if file not in problems
+        )
+
+        if counts:
+            expected = counts.most_common(1)[0][0]
+
+            for file, size in zip(files, sizes):
+                if file not in problems and size != expected:
+                    problems[file] = "is {}x{} instead of {}x{}".format(
+                        size[0], size[1], expected[0], expected[1]
+                    )
+
+        for file in files:
+            if file in problems:
+                self.logger.warning("{} {}".format(file, problems[file]))
+
+        if problems and config["validate"] == "report":
+            raise Exception(
+                "{} of {} files are invalid".format(len(problems), len(files))
+            )
+
+        if problems:
+            self.logger.info(
+                "Skipping {} invalid files".format(len(problems))
+            )
+
+        return [file for file in files if file not in problems]
+
+    def get_preview_config(self, imageHandler, firstFile, config):
+        """Get the config for rendering a preview from thumbnails, which
+        are the whole images without cropping"""
+
+        if config.get("previewSize"):
+            size = transform.parse_size(config["previewSize"])
+        else:
+            width, height = imageHandler.get_size(firstFile)
+
+            # Keep the height even, for the codecs needing it
+            height = int(round(height * previewWidth / float(width) / 2))
+            size = (previewWidth, max(2, height * 2))
+
+        self.logger.info(
+            "Rendering a preview from {}x{} thumbnails".format(*size)
+        )
+
+        return dict(
+            config,
+            resize="{}x{}".format(*size),
+            crop=None,
+            fit="letterbox"
+        )
+
+    def get_frame_size(self, imageHandler, firstFile, config):
+        """Figure out the frame size for the video"""
+
+        if config.get("resize"):
+            return transform.parse_size(config["resize"])
+
+        if config.get("crop"):
+            return transform.parse_crop(config["crop"])[2:]
+
+        # Pick the size of the first image
+        return imageHandler.get_size(firstFile)
+
+    def get_reduction(self, imageHandler, firstFile, frameSize, config,
+                      files=None):
+        """Pick how much JPEGs can be scaled down already while decoding,
+        without losing detail in frames of frameSize. files are all the
+        frames, if known."""
+
+        # Without resizing, the frames are at least as big as the images
+        if not media.reductions or not config.get("resize"):
+            return 1
+
+        # Other formats are decoded at full size, so they would need a
+        # different crop area
+        if config.get("crop") and files is not None:
+            if not all(media.is_jpeg(file) for file in self.flatten(files)):
+                self.logger.info(
+                    "Not all files are JPEGs, decoding at full size"
+                )
+                return 1
+
+        sourceSize = imageHandler.get_size(firstFile)
+
+        frameTransform = self.get_transform(frameSize, config)
+        scale = frameTransform.get_scale(frameTransform.get_size(sourceSize))
+
+        for reduction in sorted(media.reductions, reverse=True):
+            if reduction * scale <= 1:
+                self.logger.info(
+                    "Decoding JPEGs at 1/{} size".format(reduction)
+                )
+                return reduction
+
+        return 1
+
+    def get_transform(self, frameSize, config, reduction=1):
+        """Get the transform making all frames fit in frameSize, for images
+        decoded at 1/reduction size"""
+
+        crop = None
+        if config.get("crop"):
+            crop = transform.parse_crop(config["crop"])
+
+            # Crop area is given in full size pixels. Rounding down keeps it
+            # within the reduced image, which is rounded up.
+            if reduction > 1:
+                x, y, width, height = crop
+                crop = (
+                    x // reduction,
+                    y // reduction,
+                    max(1, width // reduction),
+                    max(1, height // reduction)
+                )
+
+        return transform.FrameTransform(
+            frameSize,
+            crop,
+            config.get("fit") or "letterbox"
+        )
+
+    def encode(self, imageHandler, files, frameSize, config, filename):
+        """Encode the files as frames of a new video, in parallel chunks if
+        configured to. Each frame is either a file or a list of files to
+        blend."""
+
+        workers = config.get("encodeWorkers") or 1
+
+        # Checkpointed encodes are done in fixed size segments, by as many
+        # workers as there are
+        if config.get("checkpointFrames"):
+            chunks = self.split_frames(len(files), config["checkpointFrames"])
+        else:
+            chunks = self.get_chunks(len(files), workers)
+
+        if len(chunks) > 1 and not media.SegmentHandler().available():
+            self.logger.warning(
+                "ffmpeg is needed for joining chunks, encoding serially "
+                "without checkpoints"
+            )
+            chunks = chunks[:1]
+
+        if len(chunks) == 1:
+            bad = self.encode_frames(
+                imageHandler, files, frameSize, config, filename
+            )
+            self.report_bad_frames(bad, config)
+            return
+
+        # Measure the brightness once here, so the chunks only need to look
+        # it up
+        deflicker = self.get_deflicker(config)
+        if deflicker:
+            self.logger.info("Measuring brightness for deflickering")
+
+            try:
+                deflicker.update(self.flatten(files))
+            finally:
+                deflicker.close()
+
+        checkpoint = None
+        if config.get("checkpointFrames"):
+            checkpoint = self.get_checkpoint(
+                files, frameSize, config, filename, chunks
+            )
+
+        bad = self.encode_chunks(
+            imageHandler, files, frameSize, config, filename, chunks,
+            checkpoint
+        )
+        self.report_bad_frames(bad, config)
+
+    def report_bad_frames(self, bad, config):
+        """Summarize the (filename, problem) of the bad files found while
+        encoding"""
+
+        if not bad:
+            return
+
+        for filename, problem in bad:
+            self.logger.warning("{} {}".format(filename, problem))
+
+        problems = collections.Counter(problem for filename, problem in bad)
+
+        self.logger.warning(
+            "{count} bad files, {action}: {problems}".format(**{
+                "count": len(bad),
+                "action": {
+                    "skip": "skipped",
+                    "repeat-previous": "replaced with the previous frame"
+                }[config.get("onBadFrame")],
+                "problems": ", ".join(
+                    "{} {}".format(count, problem)
+                    for problem, count in sorted(problems.items())
+                )
+            })
+        )
+
+    def get_checkpoint(self, files, frameSize, config, filename, chunks):
+        """Get the checkpoint to continue from if resuming, or a new one"""
+
+        key = Checkpoint.get_key(files, frameSize, config)
+
+        if config.get("resume"):
+            checkpoint = Checkpoint.load(Checkpoint.get_filename(filename))
+
+            if checkpoint is None:
+                self.logger.info("No checkpoint to resume from")
+            elif not checkpoint.matches(key, chunks):
+                self.logger.warning(
+                    "Files or settings have changed since the checkpoint, "
+                    "encoding everything again"
+                )
+            else:
+                self.logger.info(
+                    "Resuming after {} encoded frames".format(
+                        checkpoint.frames()
+                    )
+                )
+                return checkpoint
+
+        return Checkpoint(key, chunks)
+
+    def encode_frames(self, imageHandler, files, frameSize, config, filename,
+                      startFrame=0, context=None):
+        """Encode the files as frames of a new video, startFrame is the
+        position of the first file in the whole timelapse, and context the
+        frames (before, after) the files for deflickering. Returns the
+        (filename, problem) of the bad files."""
+
+        passthrough = self.get_passthrough(
+            imageHandler, files, frameSize, config
+        )
+
         # Start video handler
-        video = media.VideoHandler(
-            config["codec"],
-            config["fps"],
-            frameSize
+        if passthrough:
+            video = media.MjpegVideoHandler(config["fps"], frameSize)
+            decode = passthrough.load
+        else:
+            video = self.get_video(config, frameSize)
+            decode = imageHandler.read
+
+        video.open(filename)
+
+        frameTransform = self.get_transform(
+            frameSize,
+            config,
+            imageHandler.reduction
+        )
+        policy = BadFramePolicy(
+            config.get("onBadFrame") or "abort",
+            imageHandler
         )
+        deflicker = self.get_deflicker(config)
+        preview = self.get_preview(config, frameSize)
+
+        # Time the stages by wrapping the functions doing the work
+        stats = self.get_stats(
+            config,
+            "frames {}-{}".format(startFrame, startFrame + len(files)),
+            len(files)
+        )
+        if stats:
+            decode = stats.wrap("decode", decode)
+            frameTransform.apply = stats.wrap(
+                "transform", frameTransform.apply
+            )
+            video.write_image = stats.wrap("encode", video.write_image)
+
+            if deflicker:
+                deflicker.apply = stats.wrap("deflicker", deflicker.apply)
+
+        decode = policy.wrap(decode)
+
+        # Cached thumbnails are used as they are, without checking the files
+        if preview:
+            decode = preview.wrap(decode)
+
+        if config.get("decodeProcesses") and not (passthrough or preview):
+            images = self.read_shared(imageHandler, files, config, stats)
+
+            # The frames are only valid until the next one is read
+            policy.copyPrevious = True
+        else:
+            images = self.read_frames(
+                imageHandler, self.flatten(files), config, decode, stats
+            )
+        images = self.transform_images(frameTransform, policy.apply(images))
+
+        if deflicker:
+            images = self.deflicker_images(deflicker, images, files, context)
+
+        try:
+            self.write_frames(
+                video, files, images, config, startFrame, stats
+            )
+        finally:
+            if deflicker:
+                deflicker.close()
+
+            if preview:
+                preview.cache.close()
+
+            # Also on errors, so no encoder process is left behind
+            video.close()
+
+            if stats:
+                stats.close()
+
+        if preview:
+            self.logger.info(
+                "Took {hits} frames from the thumbnail cache, decoded "
+                "{misses}".format(**{
+                    "hits": preview.hits,
+                    "misses": preview.misses
+                })
+            )
 
-        video.open(config["outFile"])
+        if passthrough:
+            self.logger.debug(
+                "Passed {copied} JPEGs through, encoded {encoded}".format(**{
+                    "copied": video.copied,
+                    "encoded": video.encoded
+                })
+            )
+
+        return policy.bad
+
+    def write_frames(self, video, files, images, config, startFrame=0,
+                     stats=None):
+        """Write the frames of the files to the video, from an iterator of
+        their images"""
+
+        blender = transform.FrameBlender()
+        if stats:
+            blender.blend = stats.wrap("blend", blender.blend)
+
+        started = time.time()
 
         # Go through frames
-        for i, file in enumerate(files):
+        for i, frame in enumerate(files, startFrame):
+            if isinstance(frame, list):
+                group = (next(images) for file in frame)
+                image = blender.blend(
+                    image for image in group if image is not None
+                )
+            else:
+                image = next(images)
+
+            # Bad files get skipped
+            if image is None:
+                continue
+
             # Write
-            video.write_frame(file)
+            video.write_image(image)
+
+            if stats:
+                stats.tick()
 
             # Update user occasionally about our progress
             if i % math.floor(config["fps"]) == 0:
                 duration = i / config["fps"]
+                done = i - startFrame + 1
+                elapsed = time.time() - started
+                left = elapsed / done * (len(files) - done)
+
                 self.logger.info(
-                    "Encoded {duration}".format(**{
-                        "duration": str(datetime.timedelta(seconds=duration))
+                    "Encoded {duration}, {rate:.1f} frames per second, "
+                    "{left} left".format(**{
+                        "duration": str(datetime.timedelta(seconds=duration)),
+                        "rate": done / elapsed if elapsed else 0,
+                        "left": str(datetime.timedelta(seconds=int(left)))
                     })
                 )
 
+    def get_passthrough(self, imageHandler, files, frameSize, config):
+        """Get a JpegPassthrough if the files can be written into the video
+        without decoding them"""
+
+        if config["codec"] != "MJPG" or not files:
+            return None
+
+        # The frames must come out of the files unchanged
+        for key in ["blend", "deflicker", "crop", "preview"]:
+            if config.get(key):
+                return None
+
+        if imageHandler.reduction != 1:
+            return None
+
+        if not media.SegmentHandler().available():
+            return None
+
+        passthrough = media.JpegPassthrough(frameSize, imageHandler)
+
+        if not passthrough.start(self.first_file(files)):
+            return None
+
+        self.logger.info("Passing JPEGs through without re-encoding them")
+
+        return passthrough
+
+    def transform_images(self, frameTransform, images):
+        """Make the images fit the frame"""
+
+        for image in images:
+            # Passed through JPEGs are already the right size
+            if image is not None and not isinstance(image, bytes):
+                image = frameTransform.apply(image)
+
+            yield image
+
+    def get_video(self, config, frameSize):
+        """Get a video handler for the configured encoder"""
+
+        if config.get("encoder") == "ffmpeg":
+            return media.FfmpegVideoHandler(
+                config["codec"],
+                config["fps"],
+                frameSize,
+                crf=config.get("crf"),
+                preset=config.get("preset"),
+                bitrate=config.get("bitrate"),
+                threads=config.get("encoderThreads")
+            )
+
+        return media.VideoHandler(config["codec"], config["fps"], frameSize)
+
+    def encode_chunks(self, imageHandler, files, frameSize, config, filename,
+                      chunks, checkpoint=None):
+        """Encode each chunk of files to its own segment, in parallel
+        processes if configured to, then join them. Returns the bad files
+        found.
+
+        With a checkpoint, chunks it has as done are skipped, and each
+        finished chunk is recorded in it. The finished segments are then
+        kept if encoding fails, for resuming later.
+        """
+
+        segments = media.SegmentHandler()
+
+        # Deflickering looks at the frames around each chunk too, every
+        # frame has at least one file
+        window = config.get("deflicker") or 0
+
+        jobs = []
+        for i, (start, end) in enumerate(chunks):
+            segment = segments.get_name(filename, "part{}".format(i))
+            context = (
+                files[max(0, start - window):start],
+                files[end:end + window]
+            )
+            jobs.append((
+                imageHandler,
+                files[start:end],
+                frameSize,
+                config,
+                segment,
+                start,
+                context
+            ))
+
+        names = [job[4] for job in jobs]
+        done = set()
+        checkpointFile = None
+
+        if checkpoint:
+            checkpointFile = Checkpoint.get_filename(filename)
+            done = set(i for i in checkpoint.done if os.path.exists(names[i]))
+            checkpoint.done = sorted(done)
+
+        pending = [job for i, job in enumerate(jobs) if i not in done]
+        workers = min(config.get("encodeWorkers") or 1, len(pending))
+
+        # Pool processes can't start processes of their own, so each chunk
+        # decodes with as many threads instead
+        if workers > 1 and config.get("decodeProcesses"):
+            chunkConfig = dict(config)
+            chunkConfig["decodeWorkers"] = (
+                config.get("decodeWorkers") or config["decodeProcesses"]
+            )
+            chunkConfig["decodeProcesses"] = None
+
+            pending = [job[:3] + (chunkConfig,) + job[4:] for job in pending]
+
+        self.logger.info(
+            "Encoding {} of {} chunks of up to {} frames".format(
+                len(pending), len(jobs), chunks[0][1] - chunks[0][0]
+            )
+        )
+
+        pool = None
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            finished = pool.imap_unordered(encode_chunk, pending)
+        else:
+            finished = (encode_chunk(job) for job in pending)
+
+        bad = []
+
+        try:
+            for segment, segmentBad in finished:
+                done.add(names.index(segment))
+                bad.extend(segmentBad)
+
+                if checkpoint:
+                    checkpoint.add(names.index(segment))
+                    checkpoint.save(checkpointFile)
+
+            if pool:
+                pool.close()
+
+            self.logger.info("Joining chunks")
+
+            segments.concat(names, filename)
+            done = set()
+
+            if checkpoint:
+                os.remove(checkpointFile)
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+            # Finished segments are kept for resuming
+            for i, name in enumerate(names):
+                if os.path.exists(name) and (not checkpoint or i not in done):
+                    os.remove(name)
+
+        return bad
+
+    def get_chunks(self, frames, workers):
+        """Split the frames to at most workers contiguous (start, end)
+        chunks, each starting where a serial encode would have a keyframe"""
+
+        return self.split_frames(
+            frames,
+            int(math.ceil(float(frames) / workers))
+        )
+
+    def split_frames(self, frames, size):
+        """Split the frames to contiguous (start, end) chunks of about size
+        frames, each starting where a serial encode would have a keyframe"""
+
+        interval = media.keyframeInterval
+
+        # Round up to whole keyframe intervals
+        size = int(math.ceil(float(size) / interval)) * interval
+
+        if size == 0:
+            return [(0, frames)]
+
+        return [
+            (start, min(start + size, frames))
+            for start in range(0, frames, size)
+        ]
+
+    def get_manifest(self, config):
+        """Load the manifest of the video we are appending to, if the video
+        can be extended without encoding it again"""
+
+        manifest = Manifest.load(Manifest.get_filename(config["outFile"]))
+
+        if manifest is None or not os.path.exists(config["outFile"]):
+            self.logger.info("Nothing to append to, encoding everything")
+            return None
+
+        if not manifest.compatible(config["codec"], config["fps"]):
+            self.logger.warning(
+                "Codec or FPS changed, encoding everything again"
+            )
+            return None
+
+        if not media.SegmentHandler().available():
+            self.logger.warning(
+                "ffmpeg is needed for appending, encoding everything again"
+            )
+            return None
+
+        return manifest
+
+    def get_deflicker(self, config):
+        """Get the deflicker stage if configured, with its cache next to the
+        video"""
+
+        if not config.get("deflicker"):
+            return None
+
+        return Deflicker(
+            config["deflicker"],
+            Deflicker.get_filename(config["outFile"])
+        )
+
+    def get_preview(self, config, frameSize):
+        """Get the thumbnail cache loader if rendering a preview, with the
+        cache next to the video"""
+
+        if not config.get("preview"):
+            return None
+
+        cache = ThumbnailCache(
+            ThumbnailCache.get_filename(config["outFile"]),
+            frameSize,
+            int((config.get("previewCacheSize") or 1024) * 1024 * 1024)
+        )
+
+        return Preview(cache)
+
+    def deflicker_images(self, deflicker, images, files, context=None):
+        """Adjust the brightness of the images of the files, context has the
+        frames (before, after) the files to smooth over"""
+
+        before, after = context or ([], [])
+
+        sources = self.flatten(before + files + after)
+        skip = len(list(self.flatten(before)))
+
+        gains = deflicker.gains(sources, skip)
+
+        for image in images:
+            gain = next(gains)
+
+            if image is not None:
+                image = deflicker.apply(image, gain)
+
+            yield image
+
+    def flatten(self, frames):
+        """Iterate the files of the frames, in order"""
+
+        for frame in frames:
+            if isinstance(frame, list):
+                for file in frame:
+                    yield file
+            else:
+                yield frame
+
+    def read_frames(self, imageHandler, files, config, decode=None,
+                    stats=None):
+        """Get an iterator of decoded frames for the files, decode is used
+        instead of imageHandler.read if given. With stats, the time spent
+        waiting for the frames and the decode queue are recorded."""
+
+        decode = decode or imageHandler.read
+        workers = config.get("decodeWorkers")
+
+        # Blending decodes many files per frame, so decode them in parallel
+        # unless told not to
+        if workers is None and config.get("blend"):
+            workers = multiprocessing.cpu_count()
+
+        if not workers:
+            frames = (decode(file) for file in files)
+
+            if stats:
+                frames = stats.iterate("wait", frames)
+
+            return frames
+
+        self.logger.debug(
+            "Decoding with {workers} workers".format(**{
+                "workers": workers
+            })
+        )
+
+        reader = FrameReader(
+            decode,
+            workers,
+            config.get("prefetch")
+        )
+
+        frames = reader.read(files)
+
+        if stats:
+            stats.watch("decodeQueue", reader.depth)
+            frames = stats.iterate("wait", frames)
+
+        return frames
+
+    def read_shared(self, imageHandler, files, config, stats=None):
+        """Get an iterator of decoded frames for the files of the frames,
+        decoded by worker processes into shared memory. Broken files come
+        out as BadFrames."""
+
+        width, height = imageHandler.get_size(self.first_file(files))
+        reduction = imageHandler.reduction
+
+        # Room for frames the size of the first one, as decoded
+        shape = (-(-height // reduction), -(-width // reduction), 3)
+
+        reader = SharedFrameReader(
+            imageHandler,
+            config["decodeProcesses"],
+            shape,
+            config.get("prefetch"),
+            stats
+        )
+
+        self.logger.debug(
+            "Decoding with {workers} processes into {slots} shared frame "
+            "slots".format(**{
+                "workers": reader.workers,
+                "slots": reader.slots
+            })
+        )
+
+        frames = reader.read(self.flatten(files))
+
+        if stats:
+            stats.watch("decodeQueue", reader.depth)
+            frames = stats.iterate("wait", frames)
+
+        return frames
+
     def get_fps_duration(self, files, config):
         """Calculate FPS and total duration of resulting file"""
 
@@ -209,6 +1158,25 @@ class Pytimelapse(object):
         return fps, duration
 
 
+def encode_chunk(job):
+    """Encode a chunk of files to a segment, run in a worker process"""
+
+    imageHandler, files, frameSize, config, filename, startFrame, context = job
+
+    app = Pytimelapse()
+    bad = app.encode_frames(
+        imageHandler,
+        files,
+        frameSize,
+        config,
+        filename,
+        startFrame,
+        context
+    )
+
+    return filename, bad
+
+
 class ConfigHandler(object):
     """Handle's software configuration"""
 
@@ -270,8 +1238,44 @@ class ConfigHandler(object):
 
         parser.add_argument(
             '--codec',
-            help="Codec to encode with",
-            choices=media.codecs
+            help="Codec to encode with, h264 and h265 need the ffmpeg "
+                 "encoder",
+            choices=sorted(set(media.codecs) | set(media.ffmpegCodecs))
+        )
+
+        parser.add_argument(
+            '--encoder',
+            help="Encode with OpenCV, or by piping the frames to ffmpeg",
+            choices=media.encoders
+        )
+
+        parser.add_argument(
+            '--crf',
+            help="Constant rate factor for the ffmpeg encoder, lower is "
+                 "better quality, e.g. 23 for h264",
+            type=int,
+            metavar="N"
+        )
+
+        parser.add_argument(
+            '--preset',
+            help="Encoding speed preset for the ffmpeg encoder, e.g. "
+                 "veryfast or slow",
+            metavar="NAME"
+        )
+
+        parser.add_argument(
+            '--bitrate',
+            help="Target bitrate for the ffmpeg encoder, e.g. 4M",
+            metavar="RATE"
+        )
+
+        parser.add_argument(
+            '--encoderThreads',
+            help="Number of threads for the ffmpeg encoder, defaults to "
+                 "ffmpeg's choice",
+            type=int,
+            metavar="N"
         )
 
         parser.add_argument(
@@ -307,6 +1311,29 @@ class ConfigHandler(object):
             metavar="N"
         )
 
+        parser.add_argument(
+            '--selectBy',
+            help="Pick the files for the FPS and duration by their position, "
+                 "or nearest to evenly spaced times",
+            choices=selectModes
+        )
+
+        parser.add_argument(
+            '--fillGaps',
+            help="With selectBy time, repeat frames over gaps in capturing "
+                 "instead of leaving the gaps out",
+            action="store_true",
+            default=None
+        )
+
+        parser.add_argument(
+            '--dedup',
+            help="Leave out files whose perceptual hash is less than N bits "
+                 "from the last file used, e.g. runs of identical frames",
+            type=int,
+            metavar="N"
+        )
+
         parser.add_argument(
             '--onlyBetweenTimes',
             help="Only include images taken between the timestamps, Will pick "
@@ -315,12 +1342,192 @@ class ConfigHandler(object):
             metavar="HH:MM:SS-HH:MM:SS"
         )
 
+        parser.add_argument(
+            '--dailyAt',
+            help="Only use the image nearest to each of the given times of "
+                 "day, on every day",
+            nargs="+",
+            metavar="HH:MM:SS"
+        )
+
         parser.add_argument(
             '--timestampTimezone',
             help="Parse the file timestamp as if from the given timezone",
             metavar="TIMEZONE"
         )
 
+        parser.add_argument(
+            '--resize',
+            help="Resize the frames to the given size, defaults to the size "
+                 "of the first image",
+            metavar="WxH"
+        )
+
+        parser.add_argument(
+            '--crop',
+            help="Crop the given area out of every image before resizing",
+            metavar="x,y,w,h"
+        )
+
+        parser.add_argument(
+            '--fit',
+            help="How to fit images of a different aspect ratio, by adding "
+                 "black borders or cropping the edges",
+            choices=transform.fitModes
+        )
+
+        parser.add_argument(
+            '--blend',
+            help="Average up to N files into each frame instead of skipping "
+                 "them, or all of them with auto",
+            metavar="N|auto"
+        )
+
+        parser.add_argument(
+            '--deflicker',
+            help="Even out the brightness changes between frames, over a "
+                 "rolling window of N files",
+            type=int,
+            metavar="N"
+        )
+
+        parser.add_argument(
+            '--onBadFrame',
+            help="What to do about files that can't be decoded or are "
+                 "truncated, defaults to abort",
+            choices=badFramePolicies
+        )
+
+        parser.add_argument(
+            '--ignoreRecent',
+            help="Leave out files modified in the last N seconds, as they "
+                 "might still be being written",
+            type=float,
+            metavar="SECONDS"
+        )
+
+        parser.add_argument(
+            '--validate',
+            help="Check all the frames before encoding, and report or skip "
+                 "broken files and files of a different size",
+            choices=validateModes
+        )
+
+        parser.add_argument(
+            '--preview',
+            help="Render a quick preview from cached thumbnails of the "
+                 "images, only decoding the images not cached yet",
+            action="store_true",
+            default=None
+        )
+
+        parser.add_argument(
+            '--previewSize',
+            help="Size of the preview, defaults to 320 pixels wide",
+            metavar="WxH"
+        )
+
+        parser.add_argument(
+            '--previewCacheSize',
+            help="Maximum size of the thumbnail cache in megabytes, "
+                 "defaults to 1024",
+            type=float,
+            metavar="MB"
+        )
+
+        parser.add_argument(
+            '--append',
+            help="Only encode the files not yet in the video, and append "
+                 "them to it",
+            action="store_true",
+            default=None
+        )
+
+        parser.add_argument(
+            '--scanIndex',
+            help="Keep an index of the scanned files in the given file, so "
+                 "later runs only need to look at new files",
+            metavar="FILENAME"
+        )
+
+        parser.add_argument(
+            '--checkpointFrames',
+            help="Encode in segments of N frames, recording each finished "
+                 "one so an interrupted encode can be resumed, needs ffmpeg",
+            type=int,
+            metavar="N"
+        )
+
+        parser.add_argument(
+            '--resume',
+            help="Continue an interrupted encode from its checkpoint",
+            action="store_true",
+            default=None
+        )
+
+        parser.add_argument(
+            '--watch',
+            help="Keep running and encode new files as they arrive, into a "
+                 "video for each hour or day",
+            choices=sorted(segmentPeriods)
+        )
+
+        parser.add_argument(
+            '--watchInterval',
+            help="How long to wait for new files before checking if the "
+                 "segment is over, and when polling, how long a file must "
+                 "be unchanged to be used, defaults to 5 seconds",
+            type=float,
+            metavar="SECONDS"
+        )
+
+        parser.add_argument(
+            '--statsFile',
+            help="Write progress and timings of each stage as JSON lines to "
+                 "the given file, or - for stdout",
+            metavar="FILENAME"
+        )
+
+        parser.add_argument(
+            '--statsInterval',
+            help="How often to write the stats, defaults to every 10 seconds",
+            type=float,
+            metavar="SECONDS"
+        )
+
+        parser.add_argument(
+            '--encodeWorkers',
+            help="Split the video to N chunks, encode them in parallel and "
+                 "join them, needs ffmpeg",
+            type=int,
+            metavar="N"
+        )
+
+        parser.add_argument(
+            '--decodeWorkers',
+            help="Decode upcoming frames with N threads while encoding, "
+                 "0 to decode serially",
+            type=int,
+            metavar="N"
+        )
+
+        parser.add_argument(
+            '--decodeProcesses',
+            help="Decode upcoming frames with N processes into shared "
+                 "memory while encoding, instead of with threads",
+            type=int,
+            metavar="N"
+        )
+
+        parser.add_argument(
+            '--prefetch',
+            help="Maximum number of frames to decode ahead of the encoder, "
+                 "defaults to twice the number of decode workers or "
+                 "processes",
+            type=int,
+            metavar="N"
+        )
+
         args = parser.parse_args(arguments)
 
         return args.__dict__, parser
@@ -360,3 +1567,165 @@ class ConfigHandler(object):
 
         if config["fps"] is None and config["duration"] is None:
             parser.error("Invalid config, no FPS or duration specified .")
+
+        encoder = config.get("encoder") or "opencv"
+
+        if encoder not in media.encoders:
+            parser.error("Invalid config, unknown encoder {}.".format(encoder))
+
+        if encoder == "ffmpeg":
+            if config["codec"] not in media.ffmpegCodecs:
+                parser.error(
+                    "Invalid config, codec {} isn't supported by "
+                    "ffmpeg.".format(config["codec"])
+                )
+        else:
+            if config["codec"] not in media.codecs:
+                parser.error(
+                    "Invalid config, codec {} needs the ffmpeg "
+                    "encoder.".format(config["codec"])
+                )
+
+            for key in ["crf", "preset", "bitrate", "encoderThreads"]:
+                if config.get(key) is not None:
+                    parser.error(
+                        "Invalid config, {} needs the ffmpeg "
+                        "encoder.".format(key)
+                    )
+
+        try:
+            if config.get("blend"):
+                transform.parse_blend(config["blend"])
+
+            if config.get("resize"):
+                transform.parse_size(config["resize"])
+
+            if config.get("crop"):
+                transform.parse_crop(config["crop"])
+        except ValueError as e:
+            parser.error("Invalid config, {}.".format(e))
+
+        if config.get("fit") and config["fit"] not in transform.fitModes:
+            parser.error(
+                "Invalid config, unknown fit {}.".format(config["fit"])
+            )
+
+        if config.get("dailyAt"):
+            try:
+                FileHandler().parse_times(config["dailyAt"])
+            except ValueError as e:
+                parser.error("Invalid config, dailyAt {}.".format(e))
+
+        if config.get("preview"):
+            for key in ["append", "checkpointFrames"]:
+                if config.get(key):
+                    parser.error(
+                        "Invalid config, preview can't be used with "
+                        "{}.".format(key)
+                    )
+
+            if (config.get("encodeWorkers") or 1) > 1:
+                parser.error(
+                    "Invalid config, preview encodes with a single worker."
+                )
+
+        if config.get("previewSize"):
+            try:
+                transform.parse_size(config["previewSize"])
+            except ValueError as e:
+                parser.error("Invalid config, {}.".format(e))
+
+        previewCacheSize = config.get("previewCacheSize")
+        if previewCacheSize is not None and previewCacheSize <= 0:
+            parser.error("Invalid config, previewCacheSize must be positive.")
+
+        dedup = config.get("dedup")
+        if dedup is not None and not 1 <= dedup <= 64:
+            parser.error("Invalid config, dedup must be from 1 to 64.")
+
+        selectBy = config.get("selectBy")
+        if selectBy and selectBy not in selectModes:
+            parser.error(
+                "Invalid config, unknown selectBy {}.".format(selectBy)
+            )
+
+        if config.get("fillGaps") and selectBy != "time":
+            parser.error("Invalid config, fillGaps needs selectBy time.")
+
+        validate = config.get("validate")
+        if validate and validate not in validateModes:
+            parser.error(
+                "Invalid config, unknown validate {}.".format(validate)
+            )
+
+        if config.get("append"):
+            if config["fps"] is None:
+                parser.error("Invalid config, append needs an FPS.")
+
+            if config["duration"] is not None:
+                parser.error(
+                    "Invalid config, can't append to a video with a fixed "
+                    "duration."
+                )
+
+        onBadFrame = config.get("onBadFrame")
+        if onBadFrame and onBadFrame not in badFramePolicies:
+            parser.error(
+                "Invalid config, unknown onBadFrame {}.".format(onBadFrame)
+            )
+
+        if config.get("ignoreRecent") and config["ignoreRecent"] < 0:
+            parser.error("Invalid config, ignoreRecent can't be negative.")
+
+        if config.get("deflicker") and config["deflicker"] < 2:
+            parser.error("Invalid config, deflicker must be at least 2.")
+
+        checkpointFrames = config.get("checkpointFrames")
+        if checkpointFrames is not None and checkpointFrames < 1:
+            parser.error(
+                "Invalid config, checkpointFrames must be at least 1."
+            )
+
+        if config.get("resume") and not checkpointFrames:
+            parser.error("Invalid config, resume needs checkpointFrames.")
+
+        watch = config.get("watch")
+        if watch:
+            if watch not in segmentPeriods:
+                parser.error("Invalid config, unknown watch {}.".format(watch))
+
+            for key in ["duration", "append", "blend", "deflicker",
+                        "checkpointFrames", "dailyAt", "dedup",
+                        "preview"]:
+                if config.get(key):
+                    parser.error(
+                        "Invalid config, watch can't be used with "
+                        "{}.".format(key)
+                    )
+
+            if (config.get("encodeWorkers") or 1) > 1:
+                parser.error(
+                    "Invalid config, watch encodes with a single worker."
+                )
+
+        watchInterval = config.get("watchInterval")
+        if watchInterval is not None and watchInterval <= 0:
+            parser.error("Invalid config, watchInterval must be positive.")
+
+        statsInterval = config.get("statsInterval")
+        if statsInterval is not None and statsInterval <= 0:
+            parser.error("Invalid config, statsInterval must be positive.")
+
+        if config.get("encodeWorkers") and config["encodeWorkers"] < 1:
+            parser.error("Invalid config, encodeWorkers must be at least 1.")
+
+        if config.get("decodeWorkers") and config["decodeWorkers"] < 0:
+            parser.error("Invalid config, decodeWorkers can't be negative.")
+
+        if config.get("decodeProcesses") and config["decodeProcesses"] < 0:
+            parser.error(
+                "Invalid config, decodeProcesses can't be negative."
+            )
+
+        if config.get("prefetch") is not None and config["prefetch"] < 1:
+            parser.error("Invalid config, prefetch must be at least 1.")
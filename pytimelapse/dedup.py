@@ -0,0 +1,229 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+import logging
+import multiprocessing
+import os
+import sqlite3
+from multiprocessing.pool import ThreadPool
+
+import cv2
+import numpy
+
+import media
+
+
+__doc__ = """Dropping duplicate frames for Pytimelapse"""
+
+
+# Size of the grayscale copy the hash is calculated from
+hashSize = 32
+
+# Size of the block of lowest frequencies making up the 64 bit hash
+hashBlock = 8
+
+
+def distance(first, second):
+    """Number of bits differing between two hashes"""
+    return bin(first ^ second).count("1")
+
+
+class HashCache(object):
+    """SQLite sidecar file of the hashes of files, so they don't need to be
+    decoded again on the next run"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, timeout=60)
+        self.connection.text_factory = str
+        self.pending = []
+
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                filepath TEXT PRIMARY KEY,
+                modified REAL NOT NULL,
+                value INTEGER NOT NULL
+            )
+        """)
+
+    def close(self):
+        """Save the pending hashes and close the cache"""
+
+        self.flush()
+        self.connection.close()
+
+    def get(self, filepath, modified):
+        """Get the hash of the file, None if the file isn't known or has
+        changed since"""
+
+        row = self.connection.execute(
+            "SELECT value FROM hashes WHERE filepath = ? AND modified = ?",
+            (filepath, modified)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        # SQLite integers are signed
+        return row[0] & 0xFFFFFFFFFFFFFFFF
+
+    def set(self, filepath, modified, value):
+        """Store the hash of the file"""
+
+        if value >= 1 << 63:
+            value -= 1 << 64
+
+        self.pending.append((filepath, modified, value))
+
+        if len(self.pending) >= 500:
+            self.flush()
+
+    def flush(self):
+        """Write the stored hashes to the file"""
+
+        if not self.pending:
+            return
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO hashes (filepath, modified, value) "
+                "VALUES (?, ?, ?)",
+                self.pending
+            )
+
+        self.pending = []
+
+
+class Dedup(object):
+    """Drops frames that look the same as the one before
+
+    Each file gets a 64 bit perceptual hash from the lowest frequencies of
+    the DCT of a small grayscale copy, so noise and recompression barely
+    change it. A file is dropped if its hash is less than threshold bits
+    from the last file kept.
+    """
+
+    def __init__(self, threshold, cacheFile=None, workers=None):
+        self.logger = logging.getLogger("pytimelapse")
+        self.threshold = threshold
+        self.workers = workers or multiprocessing.cpu_count()
+
+        self.cache = None
+        if cacheFile:
+            self.cache = HashCache(cacheFile)
+
+        # Only the small copy is needed, so decode JPEGs as small as possible
+        reduction = 1
+        if media.reductions:
+            reduction = max(media.reductions)
+
+        self.imageHandler = media.ImageHandler(reduction)
+
+    @classmethod
+    def get_filename(cls, videoFile):
+        """Name of the hash cache for the video"""
+        return videoFile + ".hashes"
+
+    def close(self):
+        """Save and close the cache"""
+
+        if self.cache:
+            self.cache.close()
+
+    def hash(self, filename):
+        """Perceptual hash of the image file, None if it can't be read"""
+
+        try:
+            image = self.imageHandler.read(filename)
+        except Exception:
+            return None
+
+        if image is None:
+            return None
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(
+            gray, (hashSize, hashSize), interpolation=cv2.INTER_AREA
+        )
+
+        frequencies = cv2.dct(numpy.float32(small))[:hashBlock, :hashBlock]
+
+        # Leave out the average brightness when picking the median
+        median = numpy.median(frequencies.flatten()[1:])
+        bits = numpy.packbits(frequencies.flatten() > median)
+
+        return int(bits.view(">u8")[0])
+
+    def hashes(self, files):
+        """Get the hash of each file, from the cache if possible, hashing
+        the rest in parallel"""
+
+        hashes = [None] * len(files)
+        modified = [None] * len(files)
+        missing = []
+
+        for i, filename in enumerate(files):
+            if self.cache is None:
+                missing.append(i)
+                continue
+
+            try:
+                modified[i] = os.stat(filename).st_mtime
+            except OSError:
+                continue
+
+            hashes[i] = self.cache.get(filename, modified[i])
+
+            if hashes[i] is None:
+                missing.append(i)
+
+        if missing:
+            self.logger.info("Hashing {} files".format(len(missing)))
+
+            pool = ThreadPool(self.workers)
+
+            try:
+                results = pool.map(
+                    self.hash,
+                    [files[i] for i in missing],
+                    chunksize=64
+                )
+            finally:
+                pool.close()
+                pool.join()
+
+            for i, value in zip(missing, results):
+                hashes[i] = value
+
+                if self.cache and value is not None:
+                    self.cache.set(files[i], modified[i], value)
+
+        if self.cache:
+            self.cache.flush()
+
+        return hashes
+
+    def filter(self, files):
+        """Leave out the files too similar to the last one kept, files that
+        can't be read are kept for the decoding to deal with"""
+
+        kept = []
+        last = None
+
+        for filename, value in zip(files, self.hashes(files)):
+            if value is not None:
+                if last is not None and distance(last, value) < self.threshold:
+                    continue
+
+                last = value
+
+            kept.append(filename)
+
+        self.logger.info(
+            "Dropped {dropped} duplicate files, {kept} left".format(**{
+                "dropped": len(files) - len(kept),
+                "kept": len(kept)
+            })
+        )
+
+        return kept
@@ -0,0 +1,261 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+import collections
+import os
+import sqlite3
+
+import cv2
+import numpy
+
+import media
+
+
+__doc__ = """Brightness deflickering for Pytimelapse"""
+
+
+# Width of the downsampled copy the brightness is measured from
+statsWidth = 64
+
+# Input levels for building the lookup tables
+levels = numpy.arange(256, dtype=numpy.float32)
+
+
+def smooth(values, window):
+    """Iterate (value, average) of the values, averaged over a centered
+    window of up to window values, keeping only the window in memory. An
+    even window has one more value before than after. None values are left
+    out of the averages, and the average is None if there is nothing to
+    average."""
+
+    before = window // 2
+    after = (window - 1) // 2
+
+    history = collections.deque()
+    pending = collections.deque()
+    total = 0.0
+    count = 0
+
+    # Index of the next value to yield, and of the oldest one in history
+    current = 0
+    oldest = 0
+
+    for value in values:
+        history.append(value)
+        pending.append(value)
+
+        if value is not None:
+            total += value
+            count += 1
+
+        if len(pending) <= after:
+            continue
+
+        yield pending.popleft(), total / count if count else None
+
+        if oldest == current - before:
+            total, count = drop(history, total, count)
+            oldest += 1
+
+        current += 1
+
+    # The last values only have older ones left to average with
+    while pending:
+        yield pending.popleft(), total / count if count else None
+
+        if oldest == current - before:
+            total, count = drop(history, total, count)
+            oldest += 1
+
+        current += 1
+
+
+def drop(history, total, count):
+    """Remove the oldest value from the history, returns the new total and
+    count of the values"""
+
+    value = history.popleft()
+
+    if value is None:
+        return total, count
+
+    return total - value, count - 1
+
+
+class LuminanceCache(object):
+    """SQLite sidecar file of the measured brightness of files, so they don't
+    need to be decoded again when only the smoothing changes"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, timeout=60)
+        self.connection.text_factory = str
+        self.pending = []
+
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS luminance (
+                filepath TEXT PRIMARY KEY,
+                modified REAL NOT NULL,
+                value REAL NOT NULL
+            )
+        """)
+
+    def close(self):
+        """Save the pending values and close the cache"""
+
+        self.flush()
+        self.connection.close()
+
+    def get(self, filepath, modified):
+        """Get the brightness of the file, None if the file isn't known or has
+        changed since"""
+
+        row = self.connection.execute(
+            "SELECT value FROM luminance WHERE filepath = ? AND modified = ?",
+            (filepath, modified)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        return row[0]
+
+    def set(self, filepath, modified, value):
+        """Store the brightness of the file"""
+
+        self.pending.append((filepath, modified, value))
+
+        if len(self.pending) >= 500:
+            self.flush()
+
+    def flush(self):
+        """Write the stored values to the file"""
+
+        if not self.pending:
+            return
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO luminance (filepath, modified, value) "
+                "VALUES (?, ?, ?)",
+                self.pending
+            )
+
+        self.pending = []
+
+
+class Deflicker(object):
+    """Evens out the brightness changes between frames
+
+    The mean brightness of each file is measured from a small copy of it,
+    and every frame gets scaled towards the average brightness of the files
+    around it. Like with FrameTransform, a frame returned by apply() is only
+    valid until the next call.
+    """
+
+    def __init__(self, window, cacheFile=None):
+        self.window = window
+
+        self.cache = None
+        if cacheFile:
+            self.cache = LuminanceCache(cacheFile)
+
+        # Only the small copy is needed, so decode JPEGs as small as possible
+        reduction = 1
+        if media.reductions:
+            reduction = max(media.reductions)
+
+        self.imageHandler = media.ImageHandler(reduction)
+        self.buffer = None
+
+    @classmethod
+    def get_filename(cls, videoFile):
+        """Name of the brightness cache for the video"""
+        return videoFile + ".deflicker"
+
+    def close(self):
+        """Save and close the cache"""
+
+        if self.cache:
+            self.cache.close()
+
+    def measure(self, filename):
+        """Mean brightness of the image file, None if it can't be read"""
+
+        try:
+            image = self.imageHandler.read(filename)
+        except Exception:
+            return None
+
+        if image is None:
+            return None
+
+        height, width = image.shape[:2]
+        size = (statsWidth, max(1, height * statsWidth // width))
+
+        small = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        return float(gray.mean())
+
+    def luminance(self, filename):
+        """Brightness of the file, from the cache if possible, None if the
+        file can't be read"""
+
+        if self.cache is None:
+            return self.measure(filename)
+
+        try:
+            modified = os.stat(filename).st_mtime
+        except OSError:
+            return None
+
+        value = self.cache.get(filename, modified)
+
+        if value is None:
+            value = self.measure(filename)
+
+            # Unreadable files are tried again next time
+            if value is not None:
+                self.cache.set(filename, modified, value)
+
+        return value
+
+    def update(self, files):
+        """Measure all the files not yet in the cache"""
+
+        for filename in files:
+            self.luminance(filename)
+
+        if self.cache:
+            self.cache.flush()
+
+    def gains(self, files, skip=0):
+        """Iterate the brightness gain for each file, leaving out the first
+        skip files which are only there for the smoothing. Files that can't
+        be read get a gain of 1 and don't affect the others."""
+
+        values = (self.luminance(filename) for filename in files)
+
+        for i, (value, target) in enumerate(smooth(values, self.window)):
+            if i < skip:
+                continue
+
+            if value:
+                yield target / value
+            else:
+                yield 1.0
+
+    def apply(self, image, gain):
+        """Scale the brightness of the image by gain"""
+
+        # Not worth a pass over the image if no level would change
+        if abs(gain - 1) * 255 < 0.5:
+            return image
+
+        table = numpy.clip(levels * gain + 0.5, 0, 255).astype(numpy.uint8)
+
+        if self.buffer is None or self.buffer.shape != image.shape:
+            self.buffer = numpy.empty(image.shape, dtype=numpy.uint8)
+
+        return cv2.LUT(image, table, dst=self.buffer)
@@ -1,99 +1,422 @@
 # coding=utf-8
 #
 # Copyright 2013 Janne Enberg
+import array
+import collections
+import fnmatch
 import glob
+import logging
+import operator
 import os
 import re
+import time
 from datetime import datetime
+import numpy
 from pytz import timezone
+from scanindex import ScanIndex
+from scanindex import timestampPattern
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
 
 
 __doc__ = """File utilities for Pytimelapse"""
 
 
+secondsPerDay = 24 * 60 * 60
+
+# How filter_files picks the files for an FPS and duration:
+# - index: every so many files
+# - time: the files nearest to evenly spaced times
+selectModes = ["index", "time"]
+
+
 class FileHandler(object):
+    def __init__(self):
+        self.logger = logging.getLogger("pytimelapse")
+
     def find_files(self, config):
         """Find the files by the list of glob patterns, sort them by sortKey"""
 
-        files = []
-        for pattern in config["imageFiles"]:
-            files = files + glob.glob(pattern)
+        if config.get("scanIndex"):
+            fileList = self.find_indexed(config)
+        else:
+            # Only stat the files if we really need the modified time
+            stat = config["sortFiles"] == "modified"
 
-        # Convert to File objects
-        fileData = [File(file) for file in files]
+            paths = []
+            modified = array.array("d") if stat else None
 
-        fileData = self.sort_objects(fileData, config["sortFiles"])
+            for pattern in config["imageFiles"]:
+                for filepath, mtime in self.scan(pattern, stat):
+                    paths.append(filepath)
+                    if stat:
+                        modified.append(mtime)
+
+            fileList = FileList(paths, modified)
+            fileList.sort(config["sortFiles"])
 
         if config["startFile"]:
-            fileData = self.start_from(fileData, config["startFile"])
+            fileList = self.start_from(fileList, config["startFile"])
+
+        # Before picking by time, so a file still being written doesn't
+        # take the place of an older one
+        if config.get("ignoreRecent"):
+            fileList = self.ignore_recent(fileList, config["ignoreRecent"])
         if config["onlyBetweenTimes"]:
-            fileData = self.filter_times(fileData, config)
+            fileList = self.filter_times(fileList, config)
+        if config.get("dailyAt"):
+            fileList = self.filter_daily(fileList, config)
+
+        return fileList.paths
+
+    def scan(self, pattern, stat=False):
+        """Iterate (filepath, modified) of the files matching a glob pattern
+
+        Works like glob.iglob, but only reads the directory once and, if stat
+        is set, takes the modified time from the directory entry. Otherwise
+        modified is None.
+        """
+
+        dirname, basename = os.path.split(pattern)
+
+        for dirname in self.pattern_dirs(dirname):
+            # Plain filename, no need to list the directory
+            if not glob.has_magic(basename):
+                filename = os.path.abspath(os.path.join(dirname, basename))
+                if os.path.lexists(filename):
+                    modified = None
+                    if stat:
+                        modified = os.path.getmtime(filename)
+                    yield filename, modified
+                continue
+
+            for file in self.scan_dir(dirname, basename, stat):
+                yield file
+
+    def find_indexed(self, config):
+        """Find the files like find_files, using the scan index to skip
+        unchanged directory entries. Returns a FileList, already sorted."""
+
+        index = ScanIndex(config["scanIndex"])
+
+        try:
+            dirPatterns = self.dir_patterns(config["imageFiles"])
+
+            changed = 0
+            for path in dirPatterns:
+                changed += index.update(path)
+
+            self.logger.debug(
+                "Scan index updated with {} new files".format(changed)
+            )
+
+            rows = index.files(list(dirPatterns), config["sortFiles"])
+
+            paths = []
+            modified = array.array("d")
+            timestamps = []
+
+            for filepath, basename, mtime, timestamp in rows:
+                matchers = dirPatterns[os.path.dirname(filepath)]
+
+                if any(match(basename) for match in matchers):
+                    paths.append(filepath)
+                    modified.append(mtime)
+                    timestamps.append(timestamp)
+        finally:
+            index.close()
+
+        # Leave parsing to FileList if some filename has no timestamp, so it
+        # can complain about it if the timestamps are needed
+        if None in timestamps:
+            timestamps = None
+
+        return FileList(paths, modified, timestamps)
+
+    def dir_patterns(self, patterns):
+        """Map the directories matching the glob patterns to the name
+        matchers to use in each of them"""
+
+        dirPatterns = collections.OrderedDict()
+
+        for pattern in patterns:
+            dirname, basename = os.path.split(pattern)
+            match = self.name_matcher(basename)
+
+            for dirname in self.pattern_dirs(dirname):
+                path = os.path.abspath(dirname or os.curdir)
+                dirPatterns.setdefault(path, []).append(match)
+
+        return dirPatterns
+
+    def pattern_dirs(self, dirname):
+        """List the directories matching the directory part of a pattern"""
+
+        if not glob.has_magic(dirname):
+            return [dirname]
+
+        return [path for path in glob.iglob(dirname) if os.path.isdir(path)]
+
+    def name_matcher(self, pattern):
+        """Get a function telling if a filename matches the glob pattern"""
+
+        regex = re.compile(fnmatch.translate(os.path.normcase(pattern)))
+
+        # Like glob, skip hidden files unless explicitly asked for
+        hidden = pattern.startswith(".")
+
+        def match(name):
+            if name.startswith(".") and not hidden:
+                return False
+
+            return regex.match(os.path.normcase(name)) is not None
+
+        return match
+
+    def scan_dir(self, dirname, pattern, stat=False):
+        """Iterate (filepath, modified) of the files in a directory with
+        names matching pattern"""
+
+        match = self.name_matcher(pattern)
+
+        path = os.path.abspath(dirname or os.curdir)
+
+        try:
+            entries = scandir(path)
+        except OSError:
+            return
 
-        # Convert back to a list of absolute paths
-        files = [file.filepath for file in fileData]
+        for entry in entries:
+            name = entry.name
 
-        return files
+            if not match(name):
+                continue
+
+            modified = None
+            if stat:
+                modified = entry.stat().st_mtime
+
+            yield os.path.join(path, name), modified
 
     def sort_objects(self, objectList, sortKey):
         """Sort the given list of objects based on a property"""
 
         # Sort by whatever property is desired
-        objectList.sort(key=lambda object: object.__dict__[sortKey])
+        objectList.sort(key=operator.attrgetter(sortKey))
 
         return objectList
 
-    def start_from(self, files, search):
+    def start_from(self, fileList, search):
         """Filter file list to start from the file we wanted to skip to"""
 
         search = os.path.abspath(search)
 
-        found = False
-        temp = []
+        try:
+            start = fileList.index(search)
+        except ValueError:
+            start = len(fileList)
+
+        return fileList.take(slice(start, None))
+
+    def ignore_recent(self, fileList, seconds):
+        """Leave out the files modified in the last seconds, as they might
+        still be being written"""
+
+        cutoff = time.time() - seconds
+        fileList = fileList.take(fileList.modified_times() <= cutoff)
+
+        self.logger.debug(
+            "{} files are old enough to use".format(len(fileList))
+        )
+
+        return fileList
+
+    def filter_times(self, fileList, config):
+        """Filter by time range, the range may wrap around midnight"""
+
+        minTime, maxTime = self.parse_time_range(config["onlyBetweenTimes"])
+
+        tz = self.get_timezone(config)
+
+        # Assume the last number in the filename is a unix timestamp
+        timestamps = fileList.timestamps()
+
+        seconds = self.local_times(timestamps, tz) % secondsPerDay
+
+        # Check if it's between min and max
+        if minTime <= maxTime:
+            matches = (seconds >= minTime) & (seconds <= maxTime)
+        else:
+            matches = (seconds >= minTime) | (seconds <= maxTime)
+
+        return fileList.take(matches)
+
+    def filter_daily(self, fileList, config):
+        """Keep the file nearest to each of the dailyAt times of day, for
+        every day there are files for"""
+
+        tz = self.get_timezone(config)
+
+        local = self.local_times(fileList.timestamps(), tz)
+        days = local // secondsPerDay
+        seconds = local % secondsPerDay
+
+        picks = []
+
+        for target in self.parse_times(config["dailyAt"]):
+            distance = numpy.abs(seconds - target)
+
+            # Order by day and then by distance, the first file of each day
+            # is the nearest one
+            order = numpy.lexsort((distance, days))
+            first = numpy.unique(days[order], return_index=True)[1]
+
+            picks.append(order[first])
 
-        for file in files:
-            if file.filepath == search:
-                found = True
-            if found:
-                temp.append(file)
+        picks = numpy.unique(numpy.concatenate(picks))
+        picks = picks[numpy.argsort(local[picks], kind="mergesort")]
 
-        return temp
+        self.logger.debug(
+            "Picked {count} files for {days} days".format(**{
+                "count": len(picks),
+                "days": len(numpy.unique(days))
+            })
+        )
 
-    def filter_times(self, files, config):
-        """Filter by time range"""
+        return fileList.take(picks)
 
-        min, max = config["onlyBetweenTimes"].split("-")
-        min = min.strip()
-        max = max.strip()
+    def parse_times(self, value):
+        """Parse a list of HH:MM:SS, or them separated by commas, into
+        seconds since midnight"""
 
-        # Parse given times into datetime.time objects
-        minTime = datetime.strptime(min, "%H:%M:%S").time()
-        maxTime = datetime.strptime(max, "%H:%M:%S").time()
+        if not isinstance(value, (list, tuple)):
+            value = value.split(",")
 
-        matches = []
+        return [self.parse_time(time) for time in value]
+
+    def parse_time_range(self, timeRange):
+        """Parse HH:MM:SS-HH:MM:SS into seconds since midnight"""
+
+        min, max = timeRange.split("-")
+
+        return self.parse_time(min), self.parse_time(max)
+
+    def parse_time(self, value):
+        """Parse HH:MM:SS into seconds since midnight"""
+
+        time = datetime.strptime(value.strip(), "%H:%M:%S").time()
+
+        return time.hour * 3600 + time.minute * 60 + time.second
+
+    def get_timezone(self, config):
+        """Get the timezone to parse timestamps in, None for local time"""
 
-        tz = None
         if config["timestampTimezone"]:
-            tz = timezone(config["timestampTimezone"])
+            return timezone(config["timestampTimezone"])
+
+        return None
+
+    def local_times(self, timestamps, tz):
+        """Convert an array of unix timestamps to seconds since the epoch in
+        local time of the timezone, so that e.g. % 86400 gives the time of
+        day"""
+
+        return timestamps + self.utc_offsets(timestamps, tz)
+
+    def utc_offsets(self, timestamps, tz):
+        """Look up the UTC offset, in seconds, at each of the timestamps
+
+        Uses the transition tables of pytz timezones, so the whole array is
+        done with one binary search instead of converting every timestamp.
+        """
+
+        timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+
+        if tz is None:
+            return self.local_offsets(timestamps)
+
+        transitions = getattr(tz, "_utc_transition_times", None)
+
+        # Fixed offset, e.g. UTC
+        if transitions is None:
+            offset = tz.utcoffset(datetime.utcfromtimestamp(0))
+            offsets = numpy.empty(timestamps.shape, dtype=numpy.int64)
+            offsets.fill(self.total_seconds(offset))
+            return offsets
+
+        epoch = datetime.utcfromtimestamp(0)
+
+        times = numpy.array(
+            [self.total_seconds(time - epoch) for time in transitions],
+            dtype=numpy.int64
+        )
+
+        offsets = numpy.array(
+            [self.total_seconds(info[0]) for info in tz._transition_info],
+            dtype=numpy.int64
+        )
+
+        # Same lookup pytz does for each datetime
+        positions = numpy.searchsorted(times, timestamps, side="right") - 1
+
+        return offsets[numpy.maximum(positions, 0)]
 
-        for file in files:
+    def local_offsets(self, timestamps):
+        """Look up the UTC offset of the system local time at each of the
+        timestamps"""
 
-            # Find the last number in the filename
-            filename = re.findall(r'\d+', file.filepath)[-1]
+        # Time zone changes happen at whole quarter hours, so look up the
+        # offset only once per quarter hour that we have timestamps in
+        quarters, positions = numpy.unique(
+            timestamps // 900,
+            return_inverse=True
+        )
 
-            # Assume that's a unix timestamp, convert to datetime.time
-            fileTime = datetime.fromtimestamp(int(filename), tz).time()
+        starts = [self.local_offset(quarter * 900) for quarter in quarters]
+        ends = [self.local_offset(quarter * 900 + 899) for quarter in quarters]
 
-            # Check if it's between min and max
-            if fileTime >= minTime and fileTime <= maxTime:
-                matches.append(file)
+        offsets = numpy.array(starts, dtype=numpy.int64)[positions]
 
-        return matches
+        # If that assumption doesn't hold, look up the affected timestamps
+        # one by one
+        changing = numpy.flatnonzero(numpy.array(starts) != numpy.array(ends))
+        for quarter in changing:
+            for i in numpy.flatnonzero(positions == quarter):
+                offsets[i] = self.local_offset(timestamps[i])
 
-    def filter_files(self, files, config):
-        """Filters given fileset to a maximum FPS and duration"""
+        return offsets
+
+    def local_offset(self, timestamp):
+        """UTC offset of the system local time at the timestamp"""
+
+        timestamp = int(timestamp)
+        local = datetime.fromtimestamp(timestamp)
+
+        return self.total_seconds(local - datetime.utcfromtimestamp(timestamp))
+
+    def total_seconds(self, delta):
+        """Whole seconds in a timedelta"""
+        return delta.days * secondsPerDay + delta.seconds
+
+    def filter_files(self, files, config, times=None, skipped=None):
+        """Filters given fileset to a maximum FPS and duration, times are
+        the capture times of the files if already known
+
+        With useNthFile, skipped is the number of files passed since the
+        last one used when carrying on from an earlier selection.
+        """
 
         if config["useNthFile"]:
-            newFiles = files[::config["useNthFile"]]
+            step = config["useNthFile"]
+
+            start = 0
+            if skipped is not None:
+                start = max(0, step - 1 - skipped)
+
+            newFiles = files[start::step]
         else:
             haveFiles = len(files)
 
@@ -113,6 +436,24 @@ class FileHandler(object):
                     )
                 )
 
+            if config.get("selectBy") == "time":
+                if times is None:
+                    times = self.file_times(files)
+
+                picks = self.pick_nearest(
+                    times, int(needFiles), config.get("fillGaps")
+                )
+
+                self.logger.info(
+                    "Picked {count} files nearest to evenly spaced times, "
+                    "{unique} different ones".format(**{
+                        "count": len(picks),
+                        "unique": len(numpy.unique(picks))
+                    })
+                )
+
+                return [files[i] for i in picks.tolist()]
+
             # Calculate ratio of how many files we need to keep
             keepRatio = float(needFiles) / float(haveFiles)
 
@@ -166,9 +507,241 @@ class FileHandler(object):
 
         return newFiles
 
+    def count_skipped(self, count, config, skipped=None):
+        """Number of files passed since the last one used, after
+        filter_files went through count more files with useNthFile"""
+
+        step = config["useNthFile"]
+
+        # The first file is always used when there's nothing before it
+        if skipped is None:
+            skipped = step - 1
+
+        return (min(skipped, step - 1) + count) % step
+
+    def group_files(self, files, config):
+        """Group the files to blend together into each frame
+
+        The frames are picked like filter_files does, and each one gets up
+        to config["blend"] files starting from it. With "auto" a frame gets
+        all the files up to the next one.
+        """
+
+        times = None
+        if config.get("selectBy") == "time":
+            times = self.file_times(files)
+
+        picks = self.filter_files(list(range(len(files))), config, times)
+
+        blend = config["blend"]
+        if blend != "auto":
+            blend = int(blend)
+
+        groups = []
+        for i, start in enumerate(picks):
+            if i + 1 < len(picks):
+                end = picks[i + 1]
+            else:
+                end = len(files)
+
+            # Repeated frames get the same files again
+            if end <= start:
+                end = start + 1
+
+            if blend != "auto":
+                end = min(end, start + blend)
+
+            groups.append(files[start:end])
+
+        return groups
+
+    def file_times(self, files):
+        """Capture time of each file, from the timestamps in the filenames,
+        or if some filename has none, from the modified times"""
+
+        fileList = FileList(files)
+
+        try:
+            return fileList.timestamps().astype(numpy.float64)
+        except ValueError:
+            return fileList.modified_times()
+
+    def pick_nearest(self, times, count, fill=False):
+        """Pick the files nearest to count evenly spaced times between the
+        first and last one, so gaps in capturing don't change the speed of
+        the video. Without fill, files picked for more than one time are
+        only used once, leaving the gaps out. Returns the indexes of the
+        picked files in time order."""
+
+        times = numpy.asarray(times, dtype=numpy.float64)
+
+        if count < 1 or len(times) == 0:
+            return numpy.zeros(0, dtype=numpy.intp)
+
+        order = numpy.argsort(times, kind="mergesort")
+        sortedTimes = times[order]
+
+        ideal = numpy.linspace(sortedTimes[0], sortedTimes[-1], count)
+
+        # Binary search for the files on both sides of each ideal time
+        after = numpy.searchsorted(sortedTimes, ideal)
+        after = numpy.minimum(after, len(sortedTimes) - 1)
+        before = numpy.maximum(after - 1, 0)
+
+        nearest = numpy.where(
+            ideal - sortedTimes[before] <= sortedTimes[after] - ideal,
+            before,
+            after
+        )
+
+        if not fill:
+            nearest = numpy.unique(nearest)
+
+        return order[nearest]
+
 
 class File(object):
-    def __init__(self, filename):
+    """A single file, for when the files are handled one by one"""
+
+    __slots__ = ("filepath", "basename", "_modified")
+
+    def __init__(self, filename, modified=None):
         self.filepath = os.path.abspath(filename)
         self.basename = os.path.basename(filename)
-        self.modified = os.path.getmtime(filename)
+        self._modified = modified
+
+    @property
+    def modified(self):
+        """Modified time of the file, only looked up when needed"""
+
+        if self._modified is None:
+            self._modified = os.path.getmtime(self.filepath)
+
+        return self._modified
+
+
+class FileList(object):
+    """A compact list of files, stored as columns
+
+    Paths are kept in a plain list, modified times and the timestamps parsed
+    from the filenames in NumPy arrays, so millions of files don't need an
+    object each.
+    """
+
+    __slots__ = ("paths", "modified", "_timestamps")
+
+    def __init__(self, paths=None, modified=None, timestamps=None):
+        self.paths = list(paths or [])
+
+        if modified is not None:
+            modified = numpy.asarray(modified, dtype=numpy.float64)
+
+        if timestamps is not None:
+            timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+
+        self.modified = modified
+        self._timestamps = timestamps
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def index(self, path):
+        """Position of the given path, raises ValueError if not found"""
+        return self.paths.index(path)
+
+    def basenames(self):
+        """List the filenames without the path"""
+        return [os.path.basename(path) for path in self.paths]
+
+    def modified_times(self):
+        """Get the modified times, looking them up if not known yet"""
+
+        if self.modified is None:
+            self.modified = numpy.fromiter(
+                (os.path.getmtime(path) for path in self.paths),
+                dtype=numpy.float64,
+                count=len(self.paths)
+            )
+
+        return self.modified
+
+    def timestamps(self):
+        """Get the last number in each filename, parsed as an integer"""
+
+        if self._timestamps is None:
+            timestamps = numpy.empty(len(self.paths), dtype=numpy.int64)
+
+            search = timestampPattern.search
+
+            for i, path in enumerate(self.paths):
+                match = search(os.path.basename(path))
+
+                if match is None:
+                    raise ValueError(
+                        "No timestamp in filename {}".format(path)
+                    )
+
+                timestamps[i] = int(match.group(1))
+
+            self._timestamps = timestamps
+
+        return self._timestamps
+
+    def sort(self, sortKey):
+        """Sort the files in place by "filepath", "basename" or "modified"
+        time, keeping the original order of equal keys"""
+
+        # No other columns to keep in sync, just sort the paths
+        onlyPaths = self.modified is None and self._timestamps is None
+
+        if sortKey == "filepath" and onlyPaths:
+            self.paths.sort()
+            return
+
+        if sortKey == "modified":
+            order = numpy.argsort(self.modified_times(), kind="mergesort")
+        else:
+            if sortKey == "filepath":
+                keys = self.paths
+            elif sortKey == "basename":
+                keys = self.basenames()
+            else:
+                raise ValueError("Invalid sort key {}".format(sortKey))
+
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            order = numpy.array(order, dtype=numpy.intp)
+
+        sortedList = self.take(order)
+
+        self.paths = sortedList.paths
+        self.modified = sortedList.modified
+        self._timestamps = sortedList._timestamps
+
+    def take(self, selection):
+        """Get a new FileList of the selected files
+
+        selection can be a slice, a boolean mask or an array of indexes.
+        """
+
+        if isinstance(selection, slice):
+            paths = self.paths[selection]
+        else:
+            selection = numpy.asarray(selection)
+
+            if selection.dtype == bool:
+                selection = numpy.flatnonzero(selection)
+
+            paths = [self.paths[i] for i in selection.tolist()]
+
+        modified = self.modified
+        if modified is not None:
+            modified = modified[selection]
+
+        timestamps = self._timestamps
+        if timestamps is not None:
+            timestamps = timestamps[selection]
+
+        return FileList(paths, modified, timestamps)
@@ -0,0 +1,99 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+import json
+import os
+
+
+__doc__ = """Bookkeeping of the source files used for a video"""
+
+
+class Manifest(object):
+    """Records which source files went into a video, so it can be extended
+    with only the new files later"""
+
+    def __init__(self, codec, fps, frameSize, files=None, frames=0,
+                 skipped=None):
+        self.codec = codec
+        self.fps = fps
+        self.frameSize = tuple(frameSize)
+        self.files = list(files or [])
+        self.frames = frames
+
+        # Files passed since the last one used, to carry on with useNthFile
+        self.skipped = skipped
+
+    @classmethod
+    def get_filename(cls, videoFile):
+        """Get the manifest filename for the given video file"""
+        return videoFile + ".manifest"
+
+    @classmethod
+    def load(cls, filename):
+        """Read a manifest file, returns None if there is none"""
+
+        if not os.path.exists(filename):
+            return None
+
+        with open(filename) as f:
+            data = json.load(f)
+
+        return cls(
+            data["codec"],
+            data["fps"],
+            data["frameSize"],
+            data["files"],
+            data["frames"],
+            data.get("skipped")
+        )
+
+    def save(self, filename):
+        """Write the manifest, replacing any previous one"""
+
+        data = {
+            "codec": self.codec,
+            "fps": self.fps,
+            "frameSize": list(self.frameSize),
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "files": self.files
+        }
+
+        # Write to a temporary file first so a crash can't leave us with a
+        # manifest that doesn't match the video
+        tempFile = filename + ".tmp"
+
+        with open(tempFile, "w") as f:
+            json.dump(data, f)
+
+        if os.name == "nt" and os.path.exists(filename):
+            os.remove(filename)
+
+        os.rename(tempFile, filename)
+
+    def compatible(self, codec, fps, frameSize=None):
+        """Check if frames with the given settings can be appended to the
+        video without re-encoding it"""
+
+        if codec != self.codec or fps != self.fps:
+            return False
+
+        if frameSize is not None and tuple(frameSize) != self.frameSize:
+            return False
+
+        return True
+
+    def new_files(self, files):
+        """Filter the files to the ones not yet used for the video"""
+
+        known = set(self.files)
+
+        return [file for file in files if file not in known]
+
+    def add(self, files, frames, skipped=None):
+        """Record that the files were processed, resulting in frames, with
+        skipped files left over after the last one used"""
+
+        self.files.extend(files)
+        self.frames += frames
+        self.skipped = skipped
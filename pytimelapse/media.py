@@ -1,7 +1,14 @@
 # coding=utf-8
 #
 # Copyright 2013 Janne Enberg
+import io
+import os
+import struct
+import subprocess
+import tempfile
+
 import cv2
+import numpy
 
 
 # List of supported codec names for OpenCV
@@ -16,9 +23,58 @@ codecs = {
     "FLV1": "FLV1"
 }
 
+# Encoders of ffmpeg for the supported codec names, with the ffmpeg encoder
+ffmpegCodecs = {
+    "h264": "libx264",
+    "h265": "libx265",
+    "PIM1": "mpeg1video",
+    "MJPG": "mjpeg",
+    "MP42": "msmpeg4v2",
+    "DIV3": "msmpeg4",
+    "DIVX": "mpeg4",
+    "U263": "h263",
+    "I263": "h263p",
+    "FLV1": "flv"
+}
+
+# Encoders that default to a pixel format most players can't handle
+yuv420Encoders = ["libx264", "libx265"]
+
+# Ways to encode the video
+encoders = ["opencv", "ffmpeg"]
+
+# Flags to decode JPEGs at 1/N size, supported by OpenCV 3.2 and newer
+reductions = {}
+for reduction in [2, 4, 8]:
+    flag = getattr(cv2, "IMREAD_REDUCED_COLOR_{}".format(reduction), None)
+    if flag is not None:
+        reductions[reduction] = flag
+
+# Filename extensions of JPEGs, other formats can't be decoded scaled down
+jpegExtensions = [".jpg", ".jpeg", ".jpe"]
+
+# JPEG start of frame markers, which hold the image size
+jpegSofMarkers = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+# JPEG markers without a length and data
+jpegStandaloneMarkers = set([0x01, 0xD8] + list(range(0xD0, 0xD8)))
+
+pngSignature = b"\x89PNG\r\n\x1a\n"
+
+# How far from the end of a file to look for the end of image marker
+tailSize = 1024
+
+# OpenCV's ffmpeg based writer starts a new group of pictures, with a
+# keyframe, every this many frames
+keyframeInterval = 12
+
 
 class VideoHandler(object):
-    """Some abstraction for OpenCV VideoWriter"""
+    """Some abstraction for OpenCV VideoWriter
+
+    Encoders all have the same interface, open() a file, write_image() the
+    frames to it and close() it.
+    """
 
     def __init__(self, codec, fps, frameSize):
         self.fourcc = self.codec2fourcc(codec)
@@ -34,10 +90,19 @@ class VideoHandler(object):
             self.frameSize
         )
 
+    def close(self):
+        """Finish writing the video file"""
+        self.videoWriter.release()
+
     def write_frame(self, filename):
         """Write the given file as a frame in the video"""
 
-        self.videoWriter.write(cv2.imread(filename))
+        self.write_image(cv2.imread(filename))
+
+    def write_image(self, image):
+        """Write an already decoded image as a frame in the video"""
+
+        self.videoWriter.write(image)
 
     def codec2fourcc(self, codec):
         """Convert codecs dict keys to OpenCV FOURCC codes"""
@@ -45,19 +110,568 @@ class VideoHandler(object):
         # Convert "DIVX" -> ['D', 'I', 'V', 'X']
         args = list(codec)
 
+        # OpenCV 3 dropped the cv2.cv module
+        if hasattr(cv2, "VideoWriter_fourcc"):
+            return cv2.VideoWriter_fourcc(*args)
+
         return cv2.cv.CV_FOURCC(*args)
 
 
+class FfmpegVideoHandler(VideoHandler):
+    """Encodes the video with ffmpeg, streaming the raw frames to it through
+    a pipe"""
+
+    def __init__(self, codec, fps, frameSize, crf=None, preset=None,
+                 bitrate=None, threads=None, ffmpeg="ffmpeg"):
+        if codec not in ffmpegCodecs:
+            raise ValueError("Codec {} is not supported by ffmpeg".format(
+                codec
+            ))
+
+        self.encoder = ffmpegCodecs[codec]
+        self.fps = fps
+        self.frameSize = frameSize
+        self.crf = crf
+        self.preset = preset
+        self.bitrate = bitrate
+        self.threads = threads
+        self.ffmpeg = ffmpeg
+
+        self.process = None
+        self.command = None
+
+    def get_command(self, filename):
+        """Build the ffmpeg command line for writing filename"""
+
+        width, height = self.frameSize
+
+        command = [
+            self.ffmpeg,
+            "-y",
+            "-loglevel", "error",
+            "-f", "rawvideo",
+            "-pix_fmt", "bgr24",
+            "-s", "{}x{}".format(width, height),
+            "-r", str(self.fps),
+            "-i", "-",
+            "-an",
+            "-c:v", self.encoder
+        ]
+
+        if self.encoder in yuv420Encoders:
+            command += ["-pix_fmt", "yuv420p"]
+
+        if self.crf is not None:
+            command += ["-crf", str(self.crf)]
+
+        if self.preset:
+            command += ["-preset", self.preset]
+
+        if self.bitrate:
+            command += ["-b:v", str(self.bitrate)]
+
+        if self.threads:
+            command += ["-threads", str(self.threads)]
+
+        return command + [filename]
+
+    def open(self, filename):
+        """Start ffmpeg writing to filename"""
+
+        self.command = self.get_command(filename)
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE)
+
+    def close(self):
+        """Let ffmpeg finish writing the video file"""
+
+        self.process.stdin.close()
+        returnCode = self.process.wait()
+
+        if returnCode != 0:
+            raise subprocess.CalledProcessError(returnCode, self.command)
+
+    def write_image(self, image):
+        """Write an already decoded image as a frame in the video"""
+
+        self.check_size(image)
+
+        # Frames are usually contiguous already, and then get written
+        # straight from their memory
+        self.process.stdin.write(numpy.ascontiguousarray(image).data)
+
+    def check_size(self, image):
+        """Make sure the image is the size of the video"""
+
+        height, width = image.shape[:2]
+        if (width, height) != tuple(self.frameSize):
+            raise ValueError(
+                "Frame is {}x{} instead of {}x{}".format(
+                    width, height, self.frameSize[0], self.frameSize[1]
+                )
+            )
+
+
+class MjpegVideoHandler(FfmpegVideoHandler):
+    """Writes JPEGs into a motion-jpeg video as they are, using ffmpeg to
+    mux them. Decoded images get encoded as JPEGs first."""
+
+    def __init__(self, fps, frameSize, quality=95, ffmpeg="ffmpeg"):
+        FfmpegVideoHandler.__init__(
+            self, "MJPG", fps, frameSize, ffmpeg=ffmpeg
+        )
+
+        self.quality = quality
+        self.copied = 0
+        self.encoded = 0
+
+    def get_command(self, filename):
+        """Build the ffmpeg command line for writing filename"""
+
+        return [
+            self.ffmpeg,
+            "-y",
+            "-loglevel", "error",
+            "-f", "mjpeg",
+            "-framerate", str(self.fps),
+            "-i", "-",
+            "-an",
+            "-c:v", "copy",
+            filename
+        ]
+
+    def write_image(self, image):
+        """Write a decoded image, or the data of a JPEG file of the right
+        size, as a frame in the video"""
+
+        if isinstance(image, bytes):
+            self.process.stdin.write(image)
+            self.copied += 1
+            return
+
+        self.check_size(image)
+
+        ok, data = cv2.imencode(
+            ".jpg",
+            image,
+            [int(cv2.IMWRITE_JPEG_QUALITY), self.quality]
+        )
+
+        if not ok:
+            raise ValueError("Failed to encode frame as JPEG")
+
+        self.process.stdin.write(data.tobytes())
+        self.encoded += 1
+
+
+class SegmentHandler(object):
+    """Joins video files encoded with the same settings using ffmpeg,
+    without re-encoding them"""
+
+    def __init__(self, ffmpeg="ffmpeg"):
+        self.ffmpeg = ffmpeg
+
+    def available(self):
+        """Check if ffmpeg can be run"""
+
+        try:
+            with open(os.devnull, "w") as devnull:
+                subprocess.check_call(
+                    [self.ffmpeg, "-version"],
+                    stdout=devnull,
+                    stderr=devnull
+                )
+        except (OSError, subprocess.CalledProcessError):
+            return False
+
+        return True
+
+    def get_name(self, filename, label):
+        """Get a name for a segment file next to filename, keeping the
+        extension so ffmpeg knows which container to use"""
+
+        root, extension = os.path.splitext(filename)
+
+        return "{root}.{label}{extension}".format(**{
+            "root": root,
+            "label": label,
+            "extension": extension
+        })
+
+    def concat(self, segments, filename):
+        """Join the segments into filename, which may be one of the
+        segments"""
+
+        listFile, listName = tempfile.mkstemp(suffix=".txt")
+        tempName = self.get_name(filename, "joining")
+
+        try:
+            with os.fdopen(listFile, "w") as f:
+                for segment in segments:
+                    path = os.path.abspath(segment).replace("'", "'\\''")
+                    f.write("file '{}'\n".format(path))
+
+            subprocess.check_call([
+                self.ffmpeg,
+                "-y",
+                "-loglevel", "error",
+                "-f", "concat",
+                "-safe", "0",
+                "-i", listName,
+                "-c", "copy",
+                tempName
+            ])
+
+            if os.name == "nt" and os.path.exists(filename):
+                os.remove(filename)
+
+            os.rename(tempName, filename)
+        finally:
+            os.remove(listName)
+
+            if os.path.exists(tempName):
+                os.remove(tempName)
+
+
+def is_jpeg(filename):
+    """Check if the file is named like a JPEG"""
+    return os.path.splitext(filename)[1].lower() in jpegExtensions
+
+
 class ImageHandler(object):
     """Some abstraction for OpenCV images"""
 
-    def open(self, filename):
-        """Open an image with OpenCV"""
-        return cv2.cv.LoadImage(filename)
+    def __init__(self, reduction=1):
+        if reduction != 1 and reduction not in reductions:
+            raise ValueError(
+                "Can't decode images at 1/{} size".format(reduction)
+            )
+
+        # JPEGs are decoded at 1/reduction size
+        self.reduction = reduction
+
+    def read(self, filename):
+        """Decode an image file into a BGR array for the video writer"""
+
+        # Let libjpeg skip the detail we would throw away anyway
+        if self.reduction != 1 and is_jpeg(filename):
+            return cv2.imread(filename, reductions[self.reduction])
+
+        return cv2.imread(filename)
 
     def get_size(self, filename):
         """Get the width and height of the image file"""
 
-        image = self.open(filename)
+        size = self.probe(filename)
+
+        if size is None:
+            image = cv2.imread(filename)
+
+            if image is None:
+                raise IOError("Can't read image {}".format(filename))
+
+            size = (image.shape[1], image.shape[0])
+
+        return size
+
+    def check(self, filename):
+        """Check that the file looks like a complete image, without decoding
+        it if possible
+
+        Returns the size of the image and a description of what is wrong
+        with it, or None if nothing is.
+        """
+
+        try:
+            size = self.probe(filename)
+
+            if size is None:
+                image = cv2.imread(filename)
+
+                if image is None:
+                    return None, "can't be decoded"
+
+                return (image.shape[1], image.shape[0]), None
+
+            if not self.is_complete(filename):
+                return size, "is truncated"
+        except (IOError, OSError) as e:
+            return None, "can't be read: {}".format(e)
+
+        return size, None
+
+    def probe(self, filename):
+        """Read the width and height from a JPEG or PNG header
+
+        Returns None for other formats and files we can't make sense of.
+        """
+
+        with open(filename, "rb") as f:
+            head = f.read(8)
+
+            if head.startswith(b"\xff\xd8"):
+                f.seek(2)
+                return self.probe_jpeg(f)
+
+            if head == pngSignature:
+                return self.probe_png(f)
+
+        return None
+
+    def probe_png(self, f):
+        """Read the size from the IHDR chunk, which comes first"""
+
+        chunk = f.read(16)
+
+        if len(chunk) < 16 or chunk[4:8] != b"IHDR":
+            return None
+
+        return struct.unpack(">II", chunk[8:16])
+
+    def probe_jpeg(self, f):
+        """Read the size from the JPEG frame header"""
+
+        header = self.jpeg_header(f)
+
+        if header is None:
+            return None
+
+        width, height, orientation, frame = header
+
+        # OpenCV rotates images according to EXIF, so will we
+        if orientation >= 5:
+            return height, width
+
+        return width, height
+
+    def jpeg_header(self, f):
+        """Skip through the JPEG segments until the start of frame, returns
+        (width, height, EXIF orientation, frame header)"""
+
+        orientation = 1
+
+        while True:
+            if f.read(1) != b"\xff":
+                return None
+
+            # Markers may be padded with any number of 0xFF
+            marker = f.read(1)
+            while marker == b"\xff":
+                marker = f.read(1)
+
+            if not marker:
+                return None
+
+            code = ord(marker)
+
+            if code in jpegStandaloneMarkers:
+                continue
+
+            # End of image or start of scan before we saw the frame header
+            if code in (0xD9, 0xDA):
+                return None
+
+            data = f.read(2)
+            if len(data) < 2:
+                return None
+
+            length = struct.unpack(">H", data)[0]
+            if length < 2:
+                return None
+
+            if code in jpegSofMarkers:
+                data = f.read(length - 2)
+                if len(data) < 5:
+                    return None
+
+                height, width = struct.unpack(">HH", data[1:5])
+
+                return width, height, orientation, marker + data
+
+            if code == 0xE1:
+                data = f.read(length - 2)
+                orientation = self.exif_orientation(data) or orientation
+            else:
+                f.seek(length - 2, 1)
+
+    def exif_orientation(self, data):
+        """Find the orientation tag in an APP1 Exif segment"""
+
+        if not data.startswith(b"Exif\x00\x00"):
+            return None
+
+        tiff = data[6:]
+
+        if tiff[:2] == b"II":
+            order = "<"
+        elif tiff[:2] == b"MM":
+            order = ">"
+        else:
+            return None
+
+        try:
+            offset = struct.unpack(order + "I", tiff[4:8])[0]
+            entries = struct.unpack(order + "H", tiff[offset:offset + 2])[0]
+
+            for i in range(entries):
+                start = offset + 2 + i * 12
+                tag = struct.unpack(order + "H", tiff[start:start + 2])[0]
+
+                if tag == 0x0112:
+                    return struct.unpack(
+                        order + "H",
+                        tiff[start + 8:start + 10]
+                    )[0]
+        except struct.error:
+            return None
+
+        return None
+
+    def is_complete(self, filename):
+        """Check that a JPEG or PNG file has its end marker, so it was not
+        cut short e.g. while still being written"""
+
+        with open(filename, "rb") as f:
+            head = f.read(8)
+
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - tailSize))
+            tail = f.read()
+
+            # The end marker is usually right at the end, only files with
+            # more data after it need to be looked through
+            if head.startswith(b"\xff\xd8"):
+                return b"\xff\xd9" in tail or self.find_jpeg_end(f)
+
+            if head == pngSignature:
+                return b"IEND" in tail or self.find_png_end(f)
+
+        return True
+
+    def find_jpeg_end(self, f):
+        """Look for the end of image marker after the start of scan"""
+
+        f.seek(2)
+
+        if self.jpeg_header(f) is None:
+            return False
+
+        # Skip the rest of the segments before the image data
+        while True:
+            if f.read(1) != b"\xff":
+                return False
+
+            marker = f.read(1)
+            while marker == b"\xff":
+                marker = f.read(1)
+
+            if not marker or marker == b"\xd9":
+                return False
+
+            if marker == b"\xda":
+                break
+
+            if ord(marker) in jpegStandaloneMarkers:
+                continue
+
+            data = f.read(2)
+            if len(data) < 2:
+                return False
+
+            f.seek(struct.unpack(">H", data)[0] - 2, 1)
+
+        # A 0xFF in the image data is always followed by 0x00 or a restart
+        # marker, so the first end of image marker is the real one
+        previous = b""
+
+        while True:
+            data = f.read(1024 * 1024)
+
+            if not data:
+                return False
+
+            if b"\xff\xd9" in previous + data:
+                return True
+
+            previous = data[-1:]
+
+    def find_png_end(self, f):
+        """Go through the chunks looking for the end chunk"""
+
+        f.seek(len(pngSignature))
+
+        while True:
+            header = f.read(8)
+
+            if len(header) < 8:
+                return False
+
+            length, kind = struct.unpack(">I4s", header)
+
+            if kind == b"IEND":
+                return True
+
+            # Data and CRC
+            f.seek(length + 4, 1)
+
+
+class JpegPassthrough(object):
+    """Loads JPEG files to be written into a motion-jpeg video without
+    decoding them
+
+    Only files laid out exactly like the first one, and of the frame size,
+    are passed through. Others are decoded to be encoded again.
+    """
+
+    def __init__(self, frameSize, imageHandler):
+        self.frameSize = tuple(frameSize)
+        self.imageHandler = imageHandler
+        self.format = None
+
+    def get_format(self, data):
+        """The size and frame header of the JPEG data, None if it can't be
+        passed through"""
+
+        if not data.startswith(b"\xff\xd8"):
+            return None
+
+        f = io.BytesIO(data)
+        f.seek(2)
+        header = self.imageHandler.jpeg_header(f)
+
+        # Players wouldn't rotate the frames like OpenCV does
+        if header is None or header[2] != 1:
+            return None
+
+        width, height, orientation, frame = header
+
+        if (width, height) != self.frameSize:
+            return None
+
+        return frame
+
+    def start(self, filename):
+        """Use the layout of filename for the passed through files, returns
+        False if the file itself can't be passed through"""
+
+        if not is_jpeg(filename):
+            return False
+
+        with open(filename, "rb") as f:
+            self.format = self.get_format(f.read())
+
+        return self.format is not None
+
+    def load(self, filename):
+        """Get the data of the file if it can be passed through, otherwise
+        the decoded image"""
+
+        with open(filename, "rb") as f:
+            data = f.read()
+
+        frame = self.get_format(data)
+
+        if frame is not None and frame == self.format:
+            return data
 
-        return (image.width, image.height)
+        return self.imageHandler.read(filename)
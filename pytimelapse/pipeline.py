@@ -0,0 +1,436 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+import collections
+import ctypes
+import multiprocessing
+import signal
+import threading
+import time
+import Queue
+from multiprocessing.sharedctypes import RawArray
+
+import numpy
+
+
+__doc__ = """Frame decoding pipeline for Pytimelapse"""
+
+
+# What to do about files that can't be decoded
+badFramePolicies = ["skip", "repeat-previous", "abort"]
+
+
+class FrameReader(object):
+    """Decodes upcoming frames with a pool of worker threads
+
+    OpenCV releases the GIL while decoding, so plain threads are enough to
+    keep several cores busy. Frames are handed back in the original order and
+    at most "prefetch" of them are decoded ahead of the consumer.
+    """
+
+    def __init__(self, decode, workers, prefetch=None):
+        if workers < 1:
+            raise ValueError("Need at least one decoder worker")
+
+        if prefetch is None:
+            prefetch = workers * 2
+
+        if prefetch < 1:
+            raise ValueError("Need to prefetch at least one frame")
+
+        self.decode = decode
+        self.workers = workers
+        self.prefetch = prefetch
+
+        # Frames being decoded or waiting for the consumer
+        self.pending = None
+
+    def read(self, files):
+        """Yield the decoded frame of each of the given files, in order"""
+
+        tasks = Queue.Queue()
+        stopped = threading.Event()
+
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work,
+                args=(tasks, stopped)
+            )
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        pending = self.pending = collections.deque()
+        files = iter(files)
+
+        try:
+            # Fill up the queue
+            for file in files:
+                pending.append(self._submit(tasks, file))
+                if len(pending) == self.prefetch:
+                    break
+
+            while pending:
+                yield pending.popleft().get()
+
+                # Replace the frame the consumer is done with
+                for file in files:
+                    pending.append(self._submit(tasks, file))
+                    break
+        finally:
+            stopped.set()
+            for thread in threads:
+                tasks.put(None)
+
+    def depth(self):
+        """Number of frames queued for the consumer, and how many of them are
+        already decoded"""
+
+        pending = list(self.pending or [])
+
+        return {
+            "queued": len(pending),
+            "ready": sum(1 for slot in pending if slot.ready.is_set())
+        }
+
+    def _submit(self, tasks, file):
+        """Queue a file for decoding, returns the slot it will be stored in"""
+
+        slot = _Slot()
+        tasks.put((slot, file))
+
+        return slot
+
+    def _work(self, tasks, stopped):
+        """Worker thread main loop"""
+
+        while True:
+            task = tasks.get()
+
+            if task is None:
+                return
+
+            slot, file = task
+
+            # Consumer went away, just drain the queue
+            if stopped.is_set():
+                continue
+
+            try:
+                slot.set(self.decode(file))
+            except Exception as e:
+                slot.fail(e)
+
+
+class _Slot(object):
+    """Placeholder for a frame that is being decoded"""
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.result = None
+        self.error = None
+
+    def set(self, result):
+        self.result = result
+        self.ready.set()
+
+    def fail(self, error):
+        self.error = error
+        self.ready.set()
+
+    def get(self):
+        """Wait for the result, re-raising any error from the worker"""
+
+        # Wait in short steps, so Ctrl+C still works on Python 2
+        while not self.ready.wait(0.1):
+            pass
+
+        if self.error is not None:
+            raise self.error
+
+        result = self.result
+        self.result = None
+
+        return result
+
+
+class SharedFrameReader(object):
+    """Decodes upcoming frames in worker processes, for when threads can't
+    keep up
+
+    The frames are passed back through a ring of "slots" shared memory
+    slots, each big enough for a frame of frameShape. A worker decodes a
+    file and copies it into the slot for it, and only the slot number gets
+    sent back, so memory use stays at slots frames however many there are.
+    Frames bigger than a slot are sent back whole.
+
+    Like the ones from FrameReader, the frames come in the original order,
+    but each one is only valid until the next one is read, as its slot then
+    gets reused. The workers check the files like a BadFramePolicy does,
+    and return a BadFrame for the broken ones.
+    """
+
+    def __init__(self, imageHandler, workers, frameShape, slots=None,
+                 stats=None):
+        if workers < 1:
+            raise ValueError("Need at least one decoder worker")
+
+        if slots is None:
+            slots = workers * 2
+
+        if slots < 1:
+            raise ValueError("Need at least one frame slot")
+
+        self.imageHandler = imageHandler
+        self.workers = workers
+        self.slots = slots
+        self.stats = stats
+
+        self.frameBytes = int(numpy.prod(frameShape))
+        self.buffer = RawArray(ctypes.c_uint8, slots * self.frameBytes)
+        self.frames = numpy.frombuffer(self.buffer, dtype=numpy.uint8)
+        self.frames = self.frames.reshape(slots, self.frameBytes)
+
+        # (index, file) of the frames being decoded or waiting for the
+        # consumer, and the results that have arrived
+        self.pending = None
+        self.done = None
+
+    def read(self, files):
+        """Yield the decoded frame of each of the given files, in order"""
+
+        tasks = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+
+        processes = []
+        for i in range(self.workers):
+            process = multiprocessing.Process(
+                target=_decode_frames,
+                args=(
+                    tasks,
+                    results,
+                    self.buffer,
+                    self.frameBytes,
+                    self.imageHandler
+                )
+            )
+            process.daemon = True
+            process.start()
+            processes.append(process)
+
+        pending = self.pending = collections.deque()
+        done = self.done = {}
+        files = enumerate(files)
+
+        try:
+            # Fill up the ring
+            for index, file in files:
+                tasks.put((index, index % self.slots, file))
+                pending.append((index, file))
+                if len(pending) == self.slots:
+                    break
+
+            while pending:
+                index, file = pending.popleft()
+
+                while index not in done:
+                    result = self._receive(results)
+                    if result is not None:
+                        done[result[0]] = result
+
+                yield self._unpack(file, done.pop(index))
+
+                # The slot of the frame the consumer is done with is free
+                for index, file in files:
+                    tasks.put((index, index % self.slots, file))
+                    pending.append((index, file))
+                    break
+        finally:
+            for process in processes:
+                tasks.put(None)
+
+            for process in processes:
+                process.join(1)
+
+                if process.is_alive():
+                    process.terminate()
+
+    def depth(self):
+        """Number of frames queued for the consumer, and how many of them are
+        already decoded"""
+
+        return {
+            "queued": len(self.pending or []),
+            "ready": len(self.done or {})
+        }
+
+    def _receive(self, results):
+        """Wait for a result from the workers, None if there was none yet"""
+
+        # Wait in short steps, so Ctrl+C still works on Python 2
+        try:
+            return results.get(timeout=0.1)
+        except Queue.Empty:
+            return None
+
+    def _unpack(self, file, result):
+        """Turn a result from a worker into a frame"""
+
+        index, kind, value, seconds = result
+
+        if self.stats:
+            self.stats.add("decode", seconds)
+
+        if kind == "slot":
+            slot, shape = value
+            size = int(numpy.prod(shape))
+            return self.frames[slot, :size].reshape(shape)
+
+        if kind == "bad":
+            return BadFrame(file, value)
+
+        if kind == "error":
+            raise IOError("Decoding {} failed: {}".format(file, value))
+
+        return value
+
+
+def _decode_frames(tasks, results, buffer, frameBytes, imageHandler):
+    """SharedFrameReader worker process main loop"""
+
+    # The consumer deals with Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    frames = numpy.frombuffer(buffer, dtype=numpy.uint8)
+    decode = BadFramePolicy("skip", imageHandler).wrap(imageHandler.read)
+
+    while True:
+        task = tasks.get()
+
+        if task is None:
+            return
+
+        index, slot, file = task
+        started = time.time()
+
+        try:
+            image = decode(file)
+            seconds = time.time() - started
+
+            if isinstance(image, BadFrame):
+                result = (index, "bad", image.problem, seconds)
+            elif image.nbytes > frameBytes:
+                result = (index, "image", image, seconds)
+            else:
+                start = slot * frameBytes
+                frame = frames[start:start + image.nbytes]
+                frame.reshape(image.shape)[...] = image
+                result = (index, "slot", (slot, image.shape), seconds)
+        except Exception as e:
+            result = (index, "error", str(e), time.time() - started)
+
+        results.put(result)
+
+
+class BadFrame(object):
+    """Stands in for the frame of a file that couldn't be decoded"""
+
+    __slots__ = ("filename", "problem")
+
+    def __init__(self, filename, problem):
+        self.filename = filename
+        self.problem = problem
+
+
+class BadFramePolicy(object):
+    """Deals with files that can't be decoded, or are cut short because the
+    camera is still writing them
+
+    The files are checked by the decoder, so with a FrameReader the checks
+    run in the worker threads. The policy then gets applied in order:
+    - skip: leave the frame out
+    - repeat-previous: use the previous good frame again, or skip if there
+      is none
+    - abort: raise an IOError
+    """
+
+    def __init__(self, policy, imageHandler):
+        if policy not in badFramePolicies:
+            raise ValueError("Invalid bad frame policy {}".format(policy))
+
+        self.policy = policy
+        self.imageHandler = imageHandler
+
+        # (filename, problem) of the bad files seen
+        self.bad = []
+
+        # Last good image, for repeating
+        self.previous = None
+
+        # Set when the decoder reuses its buffers, so the image to repeat
+        # needs to be copied
+        self.copyPrevious = False
+        self.buffer = None
+
+    def wrap(self, decode):
+        """Wrap a decode function to return a BadFrame instead of failing"""
+
+        def checked(filename):
+            try:
+                image = decode(filename)
+            except Exception as e:
+                return BadFrame(filename, "can't be read: {}".format(e))
+
+            if image is None:
+                return BadFrame(filename, "can't be decoded")
+
+            try:
+                complete = self.imageHandler.is_complete(filename)
+            except (IOError, OSError) as e:
+                return BadFrame(filename, "can't be read: {}".format(e))
+
+            if not complete:
+                return BadFrame(filename, "is truncated")
+
+            return image
+
+        return checked
+
+    def apply(self, images):
+        """Iterate the images with the bad ones dealt with, None for the
+        frames to leave out"""
+
+        for image in images:
+            yield self.handle(image)
+
+    def handle(self, image):
+        """Deal with one image from the wrapped decode, returns the frame to
+        use for it or None to leave it out"""
+
+        if not isinstance(image, BadFrame):
+            if self.copyPrevious and self.policy == "repeat-previous":
+                self.keep(image)
+            else:
+                self.previous = image
+
+            return image
+
+        self.bad.append((image.filename, image.problem))
+
+        if self.policy == "abort":
+            raise IOError("{} {}".format(image.filename, image.problem))
+
+        if self.policy == "repeat-previous":
+            return self.previous
+
+        return None
+
+    def keep(self, image):
+        """Copy the image to repeat"""
+
+        if self.buffer is None or self.buffer.shape != image.shape:
+            self.buffer = numpy.empty_like(image)
+
+        self.buffer[...] = image
+        self.previous = self.buffer
@@ -0,0 +1,234 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+import os
+import sqlite3
+import threading
+
+import numpy
+from numpy.lib.format import open_memmap
+
+from pipeline import BadFrame
+import transform
+
+
+__doc__ = """Cached thumbnails for quick preview renders of Pytimelapse"""
+
+
+# Width of the previews when not given, the height follows the images
+previewWidth = 320
+
+
+class ThumbnailCache(object):
+    """Thumbnails of image files, all of the same size, in one memory mapped
+    NumPy file
+
+    The file has a fixed number of slots, as many as fit in maxBytes, and a
+    SQLite index next to it tells which file is in which slot. When all the
+    slots are taken, the least recently used thumbnail is replaced.
+    Thumbnails returned by get() and put() are views of the file, so only
+    valid until replaced.
+    """
+
+    def __init__(self, filename, size, maxBytes):
+        self.filename = filename
+        self.size = size
+
+        width, height = size
+        shape = (max(1, maxBytes // (width * height * 3)), height, width, 3)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            self.get_index_filename(filename),
+            timeout=60,
+            check_same_thread=False
+        )
+        self.connection.text_factory = str
+
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                filepath TEXT PRIMARY KEY,
+                modified REAL NOT NULL,
+                slot INTEGER NOT NULL,
+                used INTEGER NOT NULL
+            )
+        """)
+        self.connection.execute("""
+            CREATE INDEX IF NOT EXISTS thumbnails_used ON thumbnails (used)
+        """)
+
+        self.thumbnails = None
+        if os.path.exists(filename):
+            self.thumbnails = open_memmap(filename, mode="r+")
+
+            # Thumbnail size or cache size changed, start over
+            if self.thumbnails.shape != shape:
+                self.thumbnails = None
+
+        if self.thumbnails is None:
+            self.thumbnails = open_memmap(
+                filename, mode="w+", dtype=numpy.uint8, shape=shape
+            )
+
+            with self.connection:
+                self.connection.execute("DELETE FROM thumbnails")
+
+        self.capacity = shape[0]
+
+        used = set()
+        self.clock = 0
+
+        for slot, lastUsed in self.connection.execute(
+            "SELECT slot, used FROM thumbnails"
+        ):
+            used.add(slot)
+            self.clock = max(self.clock, lastUsed)
+
+        self.free = sorted(set(range(self.capacity)) - used, reverse=True)
+
+        # Use times not yet written to the index
+        self.touched = {}
+
+    @classmethod
+    def get_filename(cls, videoFile):
+        """Name of the thumbnail cache for the video"""
+        return videoFile + ".preview"
+
+    @classmethod
+    def get_index_filename(cls, filename):
+        """Name of the index of the thumbnail cache"""
+        return filename + ".index"
+
+    def close(self):
+        """Save the index and the thumbnails"""
+
+        with self.lock:
+            self.flush()
+            self.thumbnails.flush()
+            self.connection.close()
+
+    def get(self, filepath, modified):
+        """Get the thumbnail of the file, None if the file isn't cached or
+        has changed since"""
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT slot FROM thumbnails "
+                "WHERE filepath = ? AND modified = ?",
+                (filepath, modified)
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            self.clock += 1
+            self.touched[filepath] = self.clock
+
+            if len(self.touched) >= 500:
+                self.flush()
+
+            return self.thumbnails[row[0]]
+
+    def put(self, filepath, modified, thumbnail):
+        """Store the thumbnail of the file, returns the stored copy"""
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT slot FROM thumbnails WHERE filepath = ?",
+                (filepath,)
+            ).fetchone()
+
+            if row is not None:
+                slot = row[0]
+            elif self.free:
+                slot = self.free.pop()
+            else:
+                slot = self.evict()
+
+            self.clock += 1
+            self.touched.pop(filepath, None)
+
+            self.thumbnails[slot] = thumbnail
+            self.connection.execute(
+                "INSERT OR REPLACE INTO thumbnails "
+                "(filepath, modified, slot, used) VALUES (?, ?, ?, ?)",
+                (filepath, modified, slot, self.clock)
+            )
+
+            return self.thumbnails[slot]
+
+    def evict(self):
+        """Remove the least recently used thumbnail, returns its slot"""
+
+        # The use times have to be up to date to find it
+        self.flush()
+
+        filepath, slot = self.connection.execute(
+            "SELECT filepath, slot FROM thumbnails ORDER BY used LIMIT 1"
+        ).fetchone()
+
+        self.connection.execute(
+            "DELETE FROM thumbnails WHERE filepath = ?",
+            (filepath,)
+        )
+
+        return slot
+
+    def flush(self):
+        """Write the use times and new thumbnails to the index"""
+
+        if self.touched:
+            self.connection.executemany(
+                "UPDATE thumbnails SET used = ? WHERE filepath = ?",
+                [(used, filepath) for filepath, used in self.touched.items()]
+            )
+            self.touched = {}
+
+        self.connection.commit()
+
+
+class Preview(object):
+    """Loads frames from a ThumbnailCache, only decoding the files that
+    aren't in it yet
+
+    The frames are copies, as frames decoded ahead can wait longer than
+    their slots stay in the cache.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+        # Files found in the cache, and not
+        self.hits = 0
+        self.misses = 0
+
+    def wrap(self, decode):
+        """Wrap a decode function to go through the cache"""
+
+        def load(filename):
+            try:
+                modified = os.stat(filename).st_mtime
+            except OSError as e:
+                return BadFrame(filename, "can't be read: {}".format(e))
+
+            thumbnail = self.cache.get(filename, modified)
+
+            if thumbnail is not None:
+                self.hits += 1
+                return thumbnail.copy()
+
+            self.misses += 1
+            image = decode(filename)
+
+            # Let the caller deal with the files that can't be decoded
+            if not isinstance(image, numpy.ndarray):
+                return image
+
+            # A transform per file, as the decoding can run in many threads
+            thumbnail = transform.FrameTransform(self.cache.size).apply(image)
+
+            self.cache.put(filename, modified, thumbnail)
+
+            return thumbnail
+
+        return load
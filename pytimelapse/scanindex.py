@@ -0,0 +1,262 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+import os
+import re
+import sqlite3
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+
+__doc__ = """Persistent index of scanned image directories for Pytimelapse"""
+
+
+# Directories modified less than this many seconds before the scan started
+# might still change within the file system's timestamp resolution
+mtimeSlack = 2
+
+# The last number in a filename
+timestampPattern = re.compile(r'(\d+)\D*$')
+
+
+class ScanIndex(object):
+    """SQLite backed index of the files in the image directories
+
+    A directory is only listed again if its modified time has changed, and
+    only the entries that are new, or whose modified time or size has
+    changed, get written to the index. The sort orders are kept up to date
+    by the database indexes, so nothing is sorted from scratch.
+
+    Writing to a file doesn't change the modified time of its directory, so
+    files rewritten in place are only noticed once something is added,
+    removed or renamed in the directory.
+    """
+
+    sortColumns = {
+        "filepath": "filepath",
+        "basename": "basename, filepath",
+        "modified": "modified, filepath"
+    }
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+
+        # Paths are compared and returned exactly like the file system gave
+        # them to us
+        self.connection.text_factory = str
+
+        self.create_tables()
+
+    def close(self):
+        """Close the index database"""
+        self.connection.close()
+
+    def create_tables(self):
+        """Create the index tables unless they already exist"""
+
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS directories (
+                path TEXT PRIMARY KEY,
+                modified REAL
+            );
+
+            CREATE TABLE IF NOT EXISTS files (
+                filepath TEXT PRIMARY KEY,
+                directory TEXT NOT NULL,
+                basename TEXT NOT NULL,
+                modified REAL NOT NULL,
+                size INTEGER NOT NULL,
+                inode INTEGER,
+                timestamp INTEGER,
+                width INTEGER,
+                height INTEGER
+            );
+
+            CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+            CREATE INDEX IF NOT EXISTS files_basename
+                ON files (basename, filepath);
+            CREATE INDEX IF NOT EXISTS files_modified
+                ON files (modified, filepath);
+
+            CREATE TEMP TABLE IF NOT EXISTS selected (
+                path TEXT PRIMARY KEY
+            );
+        """)
+
+    def update(self, dirname):
+        """Bring the index up to date with the directory
+
+        Returns the number of new or changed files.
+        """
+
+        scanStarted = time.time()
+        path = os.path.abspath(dirname or os.curdir)
+
+        try:
+            modified = os.stat(path).st_mtime
+        except OSError:
+            self.forget(path)
+            return 0
+
+        row = self.connection.execute(
+            "SELECT modified FROM directories WHERE path = ?",
+            (path,)
+        ).fetchone()
+
+        # Nothing has been added, removed or renamed since last time
+        if row and row[0] == modified:
+            return 0
+
+        known = dict(
+            (name, (inode, modified, size))
+            for name, inode, modified, size in self.connection.execute(
+                "SELECT basename, inode, modified, size FROM files "
+                "WHERE directory = ?",
+                (path,)
+            )
+        )
+
+        changed = []
+        seen = set()
+
+        for entry in scandir(path):
+            if entry.is_dir():
+                continue
+
+            name = entry.name
+            inode = entry.inode()
+            stat = entry.stat()
+
+            seen.add(name)
+
+            # Files written in place keep their inode, so compare the stat
+            # as well, a changed file also needs its size probed again
+            if known.get(name) == (inode, stat.st_mtime, stat.st_size):
+                continue
+
+            changed.append((
+                os.path.join(path, name),
+                path,
+                name,
+                stat.st_mtime,
+                stat.st_size,
+                inode,
+                self.parse_timestamp(name)
+            ))
+
+        removed = [
+            (os.path.join(path, name),) for name in known if name not in seen
+        ]
+
+        # The directory might still be changing, so make sure it gets
+        # listed again next time
+        if modified > scanStarted - mtimeSlack:
+            modified = None
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files (filepath, directory, "
+                "basename, modified, size, inode, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                changed
+            )
+
+            self.connection.executemany(
+                "DELETE FROM files WHERE filepath = ?",
+                removed
+            )
+
+            self.connection.execute(
+                "INSERT OR REPLACE INTO directories (path, modified) "
+                "VALUES (?, ?)",
+                (path, modified)
+            )
+
+        return len(changed)
+
+    def forget(self, path):
+        """Remove a directory and its files from the index"""
+
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM files WHERE directory = ?",
+                (path,)
+            )
+            self.connection.execute(
+                "DELETE FROM directories WHERE path = ?",
+                (path,)
+            )
+
+    def files(self, directories, sortKey):
+        """Iterate (filepath, basename, modified, timestamp) of the files in
+        the given directories, sorted by sortKey"""
+
+        order = self.sortColumns[sortKey]
+        directories = [(os.path.abspath(path),) for path in directories]
+
+        with self.connection:
+            self.connection.execute("DELETE FROM selected")
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO selected (path) VALUES (?)",
+                directories
+            )
+
+        cursor = self.connection.execute(
+            "SELECT filepath, basename, modified, timestamp FROM files "
+            "WHERE directory IN (SELECT path FROM selected) "
+            "ORDER BY " + order
+        )
+
+        for row in cursor:
+            yield row
+
+    def get_sizes(self, filepaths):
+        """Get the known image sizes of the files, as a dict of filepath to
+        (width, height)"""
+
+        sizes = {}
+
+        # Stay well within SQLite's limit of query parameters
+        for start in range(0, len(filepaths), 500):
+            batch = filepaths[start:start + 500]
+
+            rows = self.connection.execute(
+                "SELECT filepath, width, height FROM files "
+                "WHERE width IS NOT NULL AND filepath IN ({})".format(
+                    ", ".join("?" * len(batch))
+                ),
+                batch
+            )
+
+            for filepath, width, height in rows:
+                sizes[filepath] = (width, height)
+
+        return sizes
+
+    def set_sizes(self, sizes):
+        """Store image sizes, given as a dict of filepath to
+        (width, height)"""
+
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE files SET width = ?, height = ? WHERE filepath = ?",
+                [
+                    (width, height, filepath)
+                    for filepath, (width, height) in sizes.items()
+                ]
+            )
+
+    def parse_timestamp(self, name):
+        """Pick the last number in the filename, if any"""
+
+        match = timestampPattern.search(name)
+
+        if match is None:
+            return None
+
+        return int(match.group(1))
@@ -0,0 +1,186 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+
+__doc__ = """Instrumentation of the encoding stages for Pytimelapse"""
+
+
+class StageStats(object):
+    """Call count, total time and a histogram of call times of a stage
+
+    The histogram has power of two buckets of microseconds.
+    """
+
+    __slots__ = ("count", "seconds", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.buckets = {}
+
+    def add(self, seconds):
+        """Record a call that took seconds"""
+
+        self.count += 1
+        self.seconds += seconds
+
+        bucket = math.frexp(seconds * 1000000)[1]
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def as_dict(self):
+        """Summary of the stage for the stats output"""
+
+        return {
+            "count": self.count,
+            "seconds": self.seconds,
+            "mean": self.seconds / self.count if self.count else None,
+            "histogram": dict(
+                (str(2 ** bucket), count)
+                for bucket, count in sorted(self.buckets.items())
+            )
+        }
+
+
+class Stats(object):
+    """Collects per stage timings and progress, and writes them out as JSON
+    lines every interval seconds
+
+    Stages are timed by wrapping the functions and iterators doing the work,
+    so nothing needs to be done in the frame loop when stats are off. With
+    no filename nothing is written, and the stats are only collected for
+    summary().
+    """
+
+    def __init__(self, filename, interval=10, total=None, label=None):
+        self.filename = filename
+        self.interval = interval
+        self.total = total
+        self.label = label
+
+        self.stages = {}
+        self.gauges = {}
+        self.frames = 0
+        self.lock = threading.Lock()
+
+        self.started = time.time()
+        self.nextEmit = self.started + interval
+
+        if filename is None:
+            self.output = None
+        elif filename == "-":
+            self.output = sys.stdout
+        else:
+            self.output = open(filename, "a")
+
+    def close(self):
+        """Write out the final stats"""
+
+        if self.output is None:
+            return
+
+        self.emit(done=True)
+
+        if self.output is not sys.stdout:
+            self.output.close()
+
+    def add(self, stage, seconds):
+        """Record time spent in a stage"""
+
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+
+            stats.add(seconds)
+
+    def watch(self, name, gauge):
+        """Sample gauge() every time stats are written, e.g. a queue depth"""
+        self.gauges[name] = gauge
+
+    def wrap(self, stage, function):
+        """Time every call of function as the stage"""
+
+        def timed(*args, **kwargs):
+            started = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(stage, time.time() - started)
+
+        return timed
+
+    def iterate(self, stage, iterator):
+        """Time waiting for each item of the iterator as the stage"""
+
+        iterator = iter(iterator)
+
+        while True:
+            started = time.time()
+
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+
+            self.add(stage, time.time() - started)
+            yield item
+
+    def tick(self):
+        """Count a written frame, writing out stats when it's time"""
+
+        self.frames += 1
+
+        if self.output is not None and time.time() >= self.nextEmit:
+            self.emit()
+
+    def get_eta(self, elapsed):
+        """Estimated seconds left, None if not known"""
+
+        if not self.total or not self.frames:
+            return None
+
+        return elapsed / self.frames * max(0, self.total - self.frames)
+
+    def summary(self, done=False):
+        """The current stats as a dict"""
+
+        now = time.time()
+        elapsed = now - self.started
+
+        with self.lock:
+            stages = dict(
+                (stage, stats.as_dict())
+                for stage, stats in self.stages.items()
+            )
+
+        return {
+            "time": now,
+            "pid": os.getpid(),
+            "label": self.label,
+            "elapsed": elapsed,
+            "frames": self.frames,
+            "total": self.total,
+            "fps": self.frames / elapsed if elapsed else None,
+            "eta": self.get_eta(elapsed),
+            "done": done,
+            "stages": stages,
+            "gauges": dict(
+                (name, gauge()) for name, gauge in self.gauges.items()
+            )
+        }
+
+    def emit(self, done=False):
+        """Write the current stats as a line of JSON"""
+
+        data = self.summary(done)
+        self.nextEmit = data["time"] + self.interval
+
+        self.output.write(json.dumps(data, sort_keys=True) + "\n")
+        self.output.flush()
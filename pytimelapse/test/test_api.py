@@ -0,0 +1,118 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy
+
+from pytimelapse.api import Renderer
+from pytimelapse.api import render
+
+
+class TestRender(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.outFile = os.path.join(self.tempDir, "out.avi")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_render_arrays(self):
+        images = [
+            numpy.zeros((48, 64, 3), dtype=numpy.uint8) + i * 20
+            for i in range(10)
+        ]
+
+        result = render(images, self.outFile, codec="MJPG", fps=10,
+                        useNthFile=2)
+
+        self.assertEqual(5, result.frames)
+        self.assertEqual(9, result.sources)
+        self.assertEqual(4, result.skipped)
+        self.assertEqual((64, 48), result.frameSize)
+        self.assertEqual(0.5, result.duration)
+        self.assertEqual(5, result.stats["frames"])
+        self.assertTrue(result.stats["done"])
+
+        frames = self.read_video()
+
+        self.assertEqual(5, len(frames))
+        self.assertTrue(abs(int(frames[1].mean()) - 40) <= 2)
+
+    def test_render_stream(self):
+        def images():
+            for i in range(9):
+                if i % 2:
+                    yield self.create("{}.png".format(i), i * 20)
+                else:
+                    yield numpy.zeros((48, 64, 3), numpy.uint8) + i * 20
+
+        result = render(images(), self.outFile, codec="MJPG", fps=10,
+                        useNthFile=3, blend=2, resize="32x24")
+
+        self.assertEqual(3, result.frames)
+        self.assertEqual((32, 24), result.frameSize)
+        self.assertTrue("decode" in result.stats["stages"])
+        self.assertTrue("blend" in result.stats["stages"])
+
+        frames = self.read_video()
+
+        self.assertEqual(3, len(frames))
+        self.assertEqual((24, 32, 3), frames[0].shape)
+        self.assertTrue(abs(int(frames[1].mean()) - 70) <= 2)
+
+    def test_bad_frames(self):
+        broken = os.path.join(self.tempDir, "broken.jpg")
+        with open(broken, "wb") as f:
+            f.write(b"not an image")
+
+        images = [self.create("1.png", 0), broken, self.create("2.png", 0)]
+
+        result = render(images, self.outFile, codec="MJPG", fps=10,
+                        onBadFrame="skip")
+
+        self.assertEqual(2, result.frames)
+        self.assertEqual(broken, result.bad[0][0])
+
+        self.assertRaises(
+            IOError, render, images, self.outFile, codec="MJPG", fps=10
+        )
+
+    def test_settings(self):
+        self.assertRaises(TypeError, Renderer, deflicker=5)
+        self.assertRaises(ValueError, Renderer, codec="h264")
+        self.assertRaises(ValueError, Renderer, blend="half")
+
+        # A stream of unknown length can't be filtered to a duration
+        renderer = Renderer(fps=10, duration=5)
+        self.assertRaises(
+            ValueError, renderer.render, iter([]), self.outFile
+        )
+
+        ranges = renderer.get_ranges(100)
+        self.assertEqual(50, len(ranges))
+        self.assertEqual((0, 1), ranges[0])
+
+        self.assertRaises(ValueError, render, [], self.outFile)
+
+    def create(self, name, value):
+        filename = os.path.join(self.tempDir, name)
+        cv2.imwrite(filename, numpy.zeros((48, 64, 3), numpy.uint8) + value)
+        return filename
+
+    def read_video(self):
+        capture = cv2.VideoCapture(self.outFile)
+        frames = []
+
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames.append(frame)
+
+        return frames
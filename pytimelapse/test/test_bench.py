@@ -0,0 +1,32 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+
+from unittest import TestCase
+
+from pytimelapse import bench
+
+
+class TestBench(TestCase):
+    def test_stages(self):
+        # The first files are before the time of day filter lets any through
+        results = bench.benchmark_stages(5, (64, 48), codec="MJPG")
+
+        self.assertEqual(
+            ["discovery", "sort", "filter_times", "decode", "transform",
+             "encode"],
+            [result["stage"] for result in results]
+        )
+        self.assertEqual(5, results[-1]["count"])
+
+        results = bench.benchmark_stages(60, (64, 48), codec="MJPG")
+
+        self.assertTrue(
+            "filter_files" in [result["stage"] for result in results]
+        )
+
+    def test_count(self):
+        self.assertRaises(
+            SystemExit,
+            bench.main, ["stages", "--count", "0", "--size", "64x48"]
+        )
@@ -0,0 +1,58 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pytimelapse.checkpoint import Checkpoint
+
+
+class TestCheckpoint(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_save_load(self):
+        filename = Checkpoint.get_filename(
+            os.path.join(self.tempDir, "timelapse.avi")
+        )
+
+        self.assertEqual(None, Checkpoint.load(filename))
+
+        chunks = [(0, 12), (12, 24), (24, 30)]
+        checkpoint = Checkpoint("key", chunks)
+        checkpoint.add(2)
+        checkpoint.add(0)
+        checkpoint.save(filename)
+
+        loaded = Checkpoint.load(filename)
+
+        self.assertEqual([2, 0], loaded.done)
+        self.assertEqual(18, loaded.frames())
+        self.assertTrue(loaded.matches("key", chunks))
+        self.assertFalse(loaded.matches("key", chunks[:2]))
+        self.assertFalse(loaded.matches("other", chunks))
+
+    def test_get_key(self):
+        config = {"codec": "DIVX", "fps": 30.0}
+        files = ["1.jpg", "2.jpg"]
+
+        key = Checkpoint.get_key(files, (640, 480), config)
+
+        self.assertEqual(key, Checkpoint.get_key(files, (640, 480), config))
+        self.assertNotEqual(key, Checkpoint.get_key(files, (320, 240), config))
+        self.assertNotEqual(key, Checkpoint.get_key(files[:1], (640, 480),
+                                                    config))
+
+        config["crf"] = 20
+        self.assertNotEqual(key, Checkpoint.get_key(files, (640, 480), config))
+
+        # Settings that don't change the frames don't matter
+        config["verbosity"] = 2
+        config["crf"] = None
+        self.assertEqual(key, Checkpoint.get_key(files, (640, 480), config))
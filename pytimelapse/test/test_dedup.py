@@ -0,0 +1,92 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy
+
+from pytimelapse import dedup
+from pytimelapse.dedup import Dedup
+from pytimelapse.dedup import HashCache
+
+
+class TestDedup(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_filter(self):
+        first = self.scene(1)
+        noisy = numpy.clip(
+            first + numpy.random.RandomState(0).randint(-3, 4, first.shape),
+            0, 255
+        ).astype(numpy.uint8)
+
+        files = [
+            self.create("1.png", first),
+            self.create("2.png", first),
+            self.create("3.png", noisy),
+            self.create("4.png", self.scene(2)),
+            self.create("5.png", self.scene(2)),
+            self.create("6.png", self.scene(3)),
+            os.path.join(self.tempDir, "missing.png")
+        ]
+
+        cacheFile = os.path.join(self.tempDir, "cache")
+        stage = Dedup(5, cacheFile)
+
+        self.assertEqual(
+            [files[i] for i in (0, 3, 5, 6)],
+            stage.filter(files)
+        )
+
+        stage.close()
+
+        # The hashes come from the cache the second time
+        stage = Dedup(5, cacheFile)
+        stage.hash = None
+
+        self.assertEqual(
+            [files[i] for i in (0, 3, 5)],
+            stage.filter(files[:6])
+        )
+
+        stage.close()
+
+        # Only identical hashes
+        stage = Dedup(1)
+
+        self.assertEqual(files[:1], stage.filter(files[:2]))
+
+    def test_cache(self):
+        cache = HashCache(os.path.join(self.tempDir, "cache"))
+        cache.set("1.jpg", 100.0, 0xFFFFFFFFFFFFFFFF)
+        cache.close()
+
+        cache = HashCache(os.path.join(self.tempDir, "cache"))
+
+        self.assertEqual(0xFFFFFFFFFFFFFFFF, cache.get("1.jpg", 100.0))
+        self.assertEqual(None, cache.get("1.jpg", 200.0))
+
+        cache.close()
+
+    def test_distance(self):
+        self.assertEqual(0, dedup.distance(5, 5))
+        self.assertEqual(2, dedup.distance(0b1100, 0b0101))
+
+    def scene(self, seed):
+        random = numpy.random.RandomState(seed)
+        small = random.randint(0, 256, (6, 8, 3)).astype(numpy.uint8)
+        return cv2.resize(small, (64, 48), interpolation=cv2.INTER_LINEAR)
+
+    def create(self, name, image):
+        filename = os.path.join(self.tempDir, name)
+        cv2.imwrite(filename, image)
+        return filename
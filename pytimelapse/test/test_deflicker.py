@@ -0,0 +1,131 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy
+
+from pytimelapse import deflicker
+from pytimelapse.deflicker import Deflicker
+from pytimelapse.deflicker import LuminanceCache
+
+
+class TestDeflicker(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_smooth(self):
+        values = [1, 2, 3, 4, 5, 6]
+
+        for window in [1, 2, 3, 4, 5, 10]:
+            before = window // 2
+            after = window - 1 - before
+            expected = [
+                numpy.mean(values[max(0, i - before):i + after + 1])
+                for i in range(len(values))
+            ]
+
+            result = list(deflicker.smooth(iter(values), window))
+
+            self.assertEqual(values, [value for value, average in result])
+            self.assertEqual(expected, [average for value, average in result])
+
+        # Missing values are left out of the averages
+        result = list(deflicker.smooth(iter([1, None, 3, None, None]), 3))
+
+        self.assertEqual(
+            [(1, 1.0), (None, 2.0), (3, 3.0), (None, 3.0), (None, None)],
+            result
+        )
+
+    def test_cache(self):
+        cache = LuminanceCache(os.path.join(self.tempDir, "cache"))
+        cache.set("1.jpg", 100.0, 50.5)
+        cache.close()
+
+        cache = LuminanceCache(os.path.join(self.tempDir, "cache"))
+
+        self.assertEqual(50.5, cache.get("1.jpg", 100.0))
+        self.assertEqual(None, cache.get("1.jpg", 200.0))
+        self.assertEqual(None, cache.get("2.jpg", 100.0))
+
+        cache.close()
+
+    def test_gains(self):
+        files = [
+            self.create("{}.png".format(i), value)
+            for i, value in enumerate([100, 100, 200, 100, 100])
+        ]
+
+        cacheFile = os.path.join(self.tempDir, "cache")
+        stage = Deflicker(3, cacheFile)
+
+        gains = list(stage.gains(files))
+
+        self.assertEqual(5, len(gains))
+        self.assertAlmostEqual(200.0 / 3 / 100, gains[2])
+        self.assertAlmostEqual(400.0 / 3 / 100, gains[1])
+
+        # Skipped files still affect the rest
+        self.assertEqual(gains[2:], list(stage.gains(files, 2)))
+
+        stage.close()
+
+        # Measured values come from the cache after the first time
+        stage = Deflicker(5, cacheFile)
+        stage.measure = None
+
+        self.assertAlmostEqual(4.0 / 3, list(stage.gains(files))[0])
+
+        stage.close()
+
+    def test_unreadable(self):
+        files = [
+            self.create("{}.png".format(i), value)
+            for i, value in enumerate([100, 100, 200, 100])
+        ]
+
+        broken = os.path.join(self.tempDir, "broken.jpg")
+        with open(broken, "wb") as f:
+            f.write(b"not an image")
+
+        cacheFile = os.path.join(self.tempDir, "cache")
+        stage = Deflicker(3, cacheFile)
+
+        self.assertEqual(None, stage.measure(broken))
+
+        gains = list(stage.gains(files[:2] + [broken] + files[2:]))
+
+        # Averaged over the readable files around them
+        self.assertEqual([1.0, 1.0, 1.0, 0.75, 1.5], gains)
+
+        stage.close()
+
+        # Nothing was cached for it
+        cache = LuminanceCache(cacheFile)
+        self.assertEqual(
+            None, cache.get(broken, os.stat(broken).st_mtime)
+        )
+        cache.close()
+
+    def test_apply(self):
+        stage = Deflicker(3)
+
+        image = numpy.zeros((4, 4, 3), dtype=numpy.uint8) + 100
+
+        self.assertTrue(stage.apply(image, 1.0) is image)
+        self.assertEqual(150, stage.apply(image, 1.5).min())
+        self.assertEqual(255, stage.apply(image, 3).max())
+
+    def create(self, name, value):
+        filename = os.path.join(self.tempDir, name)
+        cv2.imwrite(filename, numpy.zeros((30, 40, 3), numpy.uint8) + value)
+        return filename
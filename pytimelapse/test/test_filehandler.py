@@ -3,12 +3,17 @@
 # Copyright 2013 Janne Enberg
 
 import os
+import time
+from datetime import datetime
+import numpy
 from mock import Mock
 from unittest import TestCase
 from logging import Logger
+from pytz import timezone
 
 from pytimelapse.filehandler import FileHandler
 from pytimelapse.filehandler import File
+from pytimelapse.filehandler import FileList
 
 
 class TestFileHandler(TestCase):
@@ -79,6 +84,37 @@ class TestFileHandler(TestCase):
         files = fileHandler.find_files(config)
         self.assertEqual(expected, files)
 
+    def test_scan(self):
+        fileHandler = FileHandler()
+
+        absPath = os.path.join(
+            os.path.abspath(os.path.dirname(__file__)),
+            "files"
+        )
+
+        self.touch(os.path.join(absPath, "2.txt"), 2)
+        self.touch(os.path.join(absPath, "3.txt"), 1)
+
+        files = fileHandler.scan(os.path.join(absPath, "[23].txt"), stat=True)
+
+        self.assertEqual(
+            [
+                (os.path.join(absPath, "2.txt"), 2),
+                (os.path.join(absPath, "3.txt"), 1)
+            ],
+            sorted(files)
+        )
+
+        files = list(fileHandler.scan(os.path.join(absPath, "*.txt")))
+
+        self.assertEqual(3, len(files))
+        self.assertEqual([None] * 3, [modified for path, modified in files])
+
+        pattern = os.path.join(os.path.dirname(absPath), "f*", "1.txt")
+        files = list(fileHandler.scan(pattern))
+
+        self.assertEqual([(os.path.join(absPath, "1.txt"), None)], files)
+
     def test_sort_files(self):
         fileHandler = FileHandler()
 
@@ -116,6 +152,66 @@ class TestFileHandler(TestCase):
         sortedFiles = fileHandler.sort_objects(unsorted, sortKey="modified")
         self.assertEqual(files, sortedFiles)
 
+    def test_sort_file_list(self):
+        absPath = os.path.join(
+            os.path.abspath(os.path.dirname(__file__)),
+            "files"
+        )
+
+        filenames = [
+            os.path.join(absPath, "1.txt"),
+            os.path.join(absPath, "2.txt"),
+            os.path.join(absPath, "3.txt")
+        ]
+
+        self.touch(filenames[2], 1)
+        self.touch(filenames[1], 2)
+        self.touch(filenames[0], 3)
+
+        fileList = FileList([filenames[1], filenames[2], filenames[0]])
+
+        fileList.sort("filepath")
+        self.assertEqual(filenames, fileList.paths)
+
+        fileList.sort("modified")
+        self.assertEqual(filenames[::-1], fileList.paths)
+        self.assertEqual([1, 2, 3], fileList.modified.tolist())
+
+        fileList.sort("basename")
+        self.assertEqual(filenames, fileList.paths)
+        self.assertEqual([3, 2, 1], fileList.modified.tolist())
+
+        # Equal keys keep their order
+        fileList = FileList(["b/1.jpg", "a/1.jpg", "c/0.jpg"], [2, 2, 1])
+
+        fileList.sort("basename")
+        self.assertEqual(["c/0.jpg", "b/1.jpg", "a/1.jpg"], fileList.paths)
+
+        fileList.sort("modified")
+        self.assertEqual(["c/0.jpg", "b/1.jpg", "a/1.jpg"], fileList.paths)
+
+    def test_file_list_take(self):
+        fileList = FileList(
+            ["1000.jpg", "2000.jpg", "3000.jpg"],
+            [3, 2, 1]
+        )
+
+        self.assertEqual([1000, 2000, 3000], fileList.timestamps().tolist())
+
+        selected = fileList.take([False, True, True])
+        self.assertEqual(["2000.jpg", "3000.jpg"], selected.paths)
+        self.assertEqual([2, 1], selected.modified.tolist())
+        self.assertEqual([2000, 3000], selected.timestamps().tolist())
+
+        selected = fileList.take([2, 0])
+        self.assertEqual(["3000.jpg", "1000.jpg"], selected.paths)
+        self.assertEqual([1, 3], selected.modified.tolist())
+
+        selected = fileList.take(slice(1, None))
+        self.assertEqual(["2000.jpg", "3000.jpg"], selected.paths)
+
+        self.assertRaises(ValueError, FileList(["a.jpg"]).timestamps)
+
     def test_start_from(self):
         fileHandler = FileHandler()
 
@@ -124,16 +220,21 @@ class TestFileHandler(TestCase):
             "files"
         )
 
-        files = [
-            File(os.path.join(absPath, "1.txt")),
-            File(os.path.join(absPath, "2.txt")),
-            File(os.path.join(absPath, "3.txt"))
-        ]
+        files = FileList([
+            os.path.join(absPath, "1.txt"),
+            os.path.join(absPath, "2.txt"),
+            os.path.join(absPath, "3.txt")
+        ])
+
+        expected = files.paths[1:]
+
+        filtered = fileHandler.start_from(files, files.paths[1])
 
-        filtered = fileHandler.start_from(files, files[1].filepath)
-        del files[0]
+        self.assertEqual(expected, filtered.paths)
 
-        self.assertEqual(files, filtered)
+        filtered = fileHandler.start_from(files, "missing.txt")
+
+        self.assertEqual([], filtered.paths)
 
     def test_filter_times(self):
         fileHandler = FileHandler()
@@ -153,11 +254,7 @@ class TestFileHandler(TestCase):
         self.touch(filenames[1], 2)
         self.touch(filenames[0], 3)
 
-        files = [
-            File(filenames[0]),
-            File(filenames[1]),
-            File(filenames[2])
-        ]
+        files = FileList(filenames)
 
         config = {
             "onlyBetweenTimes": "00:00:02-00:00:02",
@@ -165,11 +262,157 @@ class TestFileHandler(TestCase):
         }
 
         expected = [
-            files[1]
+            filenames[1]
         ]
 
         filtered = fileHandler.filter_times(files, config)
-        self.assertEqual(expected, filtered)
+        self.assertEqual(expected, filtered.paths)
+
+    def test_filter_times_wrap(self):
+        fileHandler = FileHandler()
+
+        # 2013-10-01 00:00:00 UTC, then every hour
+        start = 1380585600
+        filenames = [
+            "cam-{}.jpg".format(start + hour * 3600) for hour in range(24)
+        ]
+
+        config = {
+            "onlyBetweenTimes": "22:00:00-02:00:00",
+            "timestampTimezone": "UTC"
+        }
+
+        expected = [filenames[i] for i in (0, 1, 2, 22, 23)]
+
+        filtered = fileHandler.filter_times(FileList(filenames), config)
+        self.assertEqual(expected, filtered.paths)
+
+    def test_filter_daily(self):
+        fileHandler = FileHandler()
+        fileHandler.logger = Mock(Logger)
+
+        # 2013-06-01 00:00:00 in Helsinki
+        midnight = 1370034000
+
+        def at(day, hour, minute):
+            timestamp = midnight + day * 86400 + hour * 3600 + minute * 60
+            return "cam-{}.jpg".format(timestamp)
+
+        filenames = [
+            at(0, 11, 50), at(0, 12, 5), at(0, 17, 0),
+            at(1, 11, 58), at(1, 13, 0),
+            at(2, 18, 0)
+        ]
+
+        config = {
+            "dailyAt": "12:00:00",
+            "timestampTimezone": "Europe/Helsinki"
+        }
+
+        filtered = fileHandler.filter_daily(FileList(filenames), config)
+        self.assertEqual(
+            [filenames[i] for i in (1, 3, 5)],
+            filtered.paths
+        )
+
+        # A file nearest to both times is only used once
+        config["dailyAt"] = ["17:30:00", "12:00:00"]
+
+        filtered = fileHandler.filter_daily(FileList(filenames), config)
+        self.assertEqual(
+            [filenames[i] for i in (1, 2, 3, 4, 5)],
+            filtered.paths
+        )
+
+        self.assertEqual(
+            [43200, 63000],
+            fileHandler.parse_times("12:00:00,17:30:00")
+        )
+        self.assertRaises(ValueError, fileHandler.parse_times, "12:00")
+
+    def test_find_files_daily_recent(self):
+        fileHandler = FileHandler()
+        fileHandler.logger = Mock(Logger)
+
+        # 2013-06-01 11:50 and 12:05 in Helsinki, the latter still being
+        # written
+        now = time.time()
+        fileHandler.scan = Mock(return_value=[
+            ("cam-1370076600.jpg", now - 600),
+            ("cam-1370077500.jpg", now)
+        ])
+
+        config = {
+            "imageFiles": ["*.jpg"],
+            "sortFiles": "modified",
+            "startFile": None,
+            "onlyBetweenTimes": None,
+            "dailyAt": "12:00:00",
+            "timestampTimezone": "Europe/Helsinki",
+            "ignoreRecent": 60
+        }
+
+        self.assertEqual(
+            ["cam-1370076600.jpg"],
+            fileHandler.find_files(config)
+        )
+
+    def test_ignore_recent(self):
+        fileHandler = FileHandler()
+        fileHandler.logger = Mock(Logger)
+
+        now = time.time()
+        fileList = FileList(
+            ["1.jpg", "2.jpg", "3.jpg"],
+            [now - 600, now - 60, now]
+        )
+
+        self.assertEqual(
+            ["1.jpg", "2.jpg"],
+            fileHandler.ignore_recent(fileList, 30).paths
+        )
+        self.assertEqual(
+            ["1.jpg"],
+            fileHandler.ignore_recent(fileList, 300).paths
+        )
+
+    def test_local_times(self):
+        fileHandler = FileHandler()
+
+        # Every 7 minutes through 2013, including both DST changes
+        timestamps = numpy.arange(1356998400, 1388534400, 7 * 60)
+
+        for name in ["Europe/Helsinki", "America/New_York", "GMT"]:
+            tz = timezone(name)
+            expected = [
+                self.seconds_of_day(datetime.fromtimestamp(timestamp, tz))
+                for timestamp in timestamps.tolist()
+            ]
+
+            seconds = fileHandler.local_times(timestamps, tz) % 86400
+
+            self.assertEqual(expected, seconds.tolist())
+
+        # Same for system local time
+        originalTz = os.environ.get("TZ")
+        os.environ["TZ"] = "Australia/Adelaide"
+        time.tzset()
+
+        try:
+            expected = [
+                self.seconds_of_day(datetime.fromtimestamp(timestamp))
+                for timestamp in timestamps.tolist()
+            ]
+
+            seconds = fileHandler.local_times(timestamps, None) % 86400
+
+            self.assertEqual(expected, seconds.tolist())
+        finally:
+            if originalTz is None:
+                del os.environ["TZ"]
+            else:
+                os.environ["TZ"] = originalTz
+            time.tzset()
 
     def test_filter_files(self):
         fileHandler = FileHandler()
@@ -200,6 +443,82 @@ class TestFileHandler(TestCase):
         filtered = fileHandler.filter_files(files, config)
         self.assertEqual(expected, filtered)
 
+    def test_group_files(self):
+        fileHandler = FileHandler()
+        fileHandler.logger = Mock(Logger)
+
+        files = ["{}.jpg".format(i) for i in range(10)]
+
+        config = {
+            "useNthFile": None,
+            "fps": 2,
+            "duration": 2,
+            "blend": "auto"
+        }
+
+        groups = fileHandler.group_files(files, config)
+
+        self.assertEqual(files, [file for group in groups for file in group])
+        self.assertEqual([2, 2, 3, 3], [len(group) for group in groups])
+
+        config["blend"] = "2"
+
+        groups = fileHandler.group_files(files, config)
+
+        self.assertEqual(
+            [["0.jpg", "1.jpg"], ["2.jpg", "3.jpg"], ["4.jpg", "5.jpg"],
+             ["7.jpg", "8.jpg"]],
+            groups
+        )
+
+    def test_filter_files_by_time(self):
+        fileHandler = FileHandler()
+        fileHandler.logger = Mock(Logger)
+
+        # Taken every 10 seconds, with nothing between 30 and 100
+        files = [
+            "img_{}.jpg".format(1370000000 + offset)
+            for offset in [0, 10, 20, 30, 100, 110, 120]
+        ]
+
+        config = {
+            "useNthFile": None,
+            "fps": 7,
+            "duration": 1,
+            "selectBy": "time"
+        }
+
+        self.assertEqual(
+            [files[i] for i in [0, 2, 3, 4, 6]],
+            fileHandler.filter_files(files, config)
+        )
+
+        config["fillGaps"] = True
+
+        self.assertEqual(
+            [files[i] for i in [0, 2, 3, 3, 4, 4, 6]],
+            fileHandler.filter_files(files, config)
+        )
+
+        config["blend"] = "auto"
+
+        self.assertEqual(
+            [[0, 1], [2], [3], [3], [4], [4, 5], [6]],
+            [
+                [files.index(file) for file in group]
+                for group in fileHandler.group_files(files, config)
+            ]
+        )
+
+        # Out of order times come out in time order
+        self.assertEqual(
+            [1, 2, 0],
+            fileHandler.pick_nearest([30, 0, 10], 3).tolist()
+        )
+
+    def seconds_of_day(self, value):
+        return value.hour * 3600 + value.minute * 60 + value.second
+
     def touch(self, filename, timestamp=None):
         with file(filename, 'a'):
             os.utime(filename, (timestamp, timestamp))
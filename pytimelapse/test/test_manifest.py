@@ -0,0 +1,60 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pytimelapse.manifest import Manifest
+
+
+class TestManifest(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_save_load(self):
+        filename = Manifest.get_filename(
+            os.path.join(self.tempDir, "timelapse.avi")
+        )
+
+        self.assertEqual(None, Manifest.load(filename))
+
+        manifest = Manifest("DIVX", 30.0, (640, 480))
+        manifest.add(["1.jpg", "2.jpg", "3.jpg"], 2, 1)
+        manifest.save(filename)
+
+        loaded = Manifest.load(filename)
+
+        self.assertEqual("DIVX", loaded.codec)
+        self.assertEqual(30.0, loaded.fps)
+        self.assertEqual((640, 480), loaded.frameSize)
+        self.assertEqual(["1.jpg", "2.jpg", "3.jpg"], loaded.files)
+        self.assertEqual(2, loaded.frames)
+        self.assertEqual(1, loaded.skipped)
+
+    def test_new_files(self):
+        manifest = Manifest("DIVX", 30.0, (640, 480), ["1.jpg", "2.jpg"], 2)
+
+        self.assertEqual(
+            ["3.jpg", "4.jpg"],
+            manifest.new_files(["1.jpg", "2.jpg", "3.jpg", "4.jpg"])
+        )
+
+        manifest.add(["3.jpg"], 1)
+
+        self.assertEqual(["4.jpg"], manifest.new_files(["3.jpg", "4.jpg"]))
+        self.assertEqual(3, manifest.frames)
+
+    def test_compatible(self):
+        manifest = Manifest("DIVX", 30.0, (640, 480))
+
+        self.assertTrue(manifest.compatible("DIVX", 30.0))
+        self.assertTrue(manifest.compatible("DIVX", 30.0, (640, 480)))
+        self.assertFalse(manifest.compatible("DIVX", 30.0, (1280, 720)))
+        self.assertFalse(manifest.compatible("MJPG", 30.0))
+        self.assertFalse(manifest.compatible("DIVX", 60.0))
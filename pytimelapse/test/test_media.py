@@ -0,0 +1,260 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+
+import os
+import shutil
+import struct
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy
+
+from pytimelapse import media
+from pytimelapse.media import ImageHandler
+
+
+class TestImageHandler(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_read_reduced(self):
+        image = numpy.zeros((48, 64, 3), dtype=numpy.uint8)
+
+        jpeg = os.path.join(self.tempDir, "1.jpg")
+        png = os.path.join(self.tempDir, "1.png")
+        cv2.imwrite(jpeg, image)
+        cv2.imwrite(png, image)
+
+        self.assertEqual((48, 64, 3), ImageHandler().read(jpeg).shape)
+
+        if 4 not in media.reductions:
+            return
+
+        imageHandler = ImageHandler(4)
+
+        self.assertEqual((12, 16, 3), imageHandler.read(jpeg).shape)
+        self.assertEqual((48, 64, 3), imageHandler.read(png).shape)
+
+    def test_invalid_reduction(self):
+        self.assertRaises(ValueError, ImageHandler, 3)
+
+    def test_probe(self):
+        image = numpy.zeros((48, 64, 3), dtype=numpy.uint8)
+
+        jpeg = os.path.join(self.tempDir, "1.jpg")
+        png = os.path.join(self.tempDir, "1.png")
+        bmp = os.path.join(self.tempDir, "1.bmp")
+        cv2.imwrite(jpeg, image)
+        cv2.imwrite(png, image)
+        cv2.imwrite(bmp, image)
+
+        imageHandler = ImageHandler()
+
+        self.assertEqual((64, 48), imageHandler.probe(jpeg))
+        self.assertEqual((64, 48), imageHandler.probe(png))
+        self.assertEqual(None, imageHandler.probe(bmp))
+
+        self.assertEqual((64, 48), imageHandler.get_size(bmp))
+
+    def test_probe_exif_orientation(self):
+        image = numpy.zeros((48, 64, 3), dtype=numpy.uint8)
+
+        jpeg = os.path.join(self.tempDir, "1.jpg")
+        cv2.imwrite(jpeg, image)
+
+        # Add an Exif segment saying the image is rotated 90 degrees
+        tiff = b"MM\x00\x2a" + struct.pack(">I", 8)
+        tiff += struct.pack(">H", 1)
+        tiff += struct.pack(">HHIHH", 0x0112, 3, 1, 6, 0)
+        tiff += struct.pack(">I", 0)
+        app1 = b"Exif\x00\x00" + tiff
+
+        with open(jpeg, "rb") as f:
+            data = f.read()
+
+        with open(jpeg, "wb") as f:
+            f.write(data[:2])
+            f.write(b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1)
+            f.write(data[2:])
+
+        decoded = cv2.imread(jpeg)
+        expected = (decoded.shape[1], decoded.shape[0])
+
+        self.assertEqual(expected, ImageHandler().probe(jpeg))
+
+    def test_check(self):
+        image = numpy.zeros((48, 64, 3), dtype=numpy.uint8)
+
+        jpeg = os.path.join(self.tempDir, "1.jpg")
+        cv2.imwrite(jpeg, image)
+
+        imageHandler = ImageHandler()
+
+        self.assertEqual(((64, 48), None), imageHandler.check(jpeg))
+
+        with open(jpeg, "rb") as f:
+            data = f.read()
+
+        truncated = os.path.join(self.tempDir, "2.jpg")
+        with open(truncated, "wb") as f:
+            f.write(data[:len(data) // 2])
+
+        self.assertEqual(
+            ((64, 48), "is truncated"),
+            imageHandler.check(truncated)
+        )
+
+        # Data after the end marker, like the video of a motion photo
+        trailer = os.path.join(self.tempDir, "5.jpg")
+        with open(trailer, "wb") as f:
+            f.write(data + b"\xff\xd8" + b"\x00" * 4096)
+
+        self.assertEqual(((64, 48), None), imageHandler.check(trailer))
+
+        with open(truncated, "wb") as f:
+            f.write(data[:len(data) - 10] + b"\x00" * 4096)
+
+        self.assertEqual(
+            ((64, 48), "is truncated"),
+            imageHandler.check(truncated)
+        )
+
+        png = os.path.join(self.tempDir, "6.png")
+        cv2.imwrite(png, image)
+
+        with open(png, "ab") as f:
+            f.write(b"\x00" * 4096)
+
+        self.assertTrue(imageHandler.is_complete(png))
+
+        with open(png, "rb") as f:
+            data = f.read()
+
+        with open(png, "wb") as f:
+            f.write(data[:len(data) - 4096 - 12] + b"\x00" * 4096)
+
+        self.assertFalse(imageHandler.is_complete(png))
+
+        broken = os.path.join(self.tempDir, "3.jpg")
+        with open(broken, "wb") as f:
+            f.write(b"not an image")
+
+        self.assertEqual(None, imageHandler.check(broken)[0])
+
+        missing = os.path.join(self.tempDir, "4.jpg")
+        self.assertEqual(None, imageHandler.check(missing)[0])
+
+
+class TestVideoHandler(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_codec2fourcc(self):
+        video = media.VideoHandler("MJPG", 10, (64, 48))
+
+        self.assertEqual(0x47504A4D, video.fourcc)
+
+    def test_ffmpeg_command(self):
+        video = media.FfmpegVideoHandler(
+            "h264", 30.0, (64, 48), crf=20, preset="fast", threads=2
+        )
+
+        command = video.get_command("out.mp4")
+
+        self.assertEqual("out.mp4", command[-1])
+        self.assertEqual("64x48", command[command.index("-s") + 1])
+        self.assertEqual("libx264", command[command.index("-c:v") + 1])
+        self.assertEqual("20", command[command.index("-crf") + 1])
+        self.assertEqual("fast", command[command.index("-preset") + 1])
+        self.assertEqual("2", command[command.index("-threads") + 1])
+        self.assertTrue("-b:v" not in command)
+
+        self.assertRaises(
+            ValueError, media.FfmpegVideoHandler, "XVID", 30.0, (64, 48)
+        )
+
+    def test_ffmpeg_encode(self):
+        if not media.SegmentHandler().available():
+            return
+
+        filename = os.path.join(self.tempDir, "out.avi")
+
+        video = media.FfmpegVideoHandler("MJPG", 10, (64, 48))
+        video.open(filename)
+
+        for value in range(5):
+            image = numpy.zeros((48, 64, 3), dtype=numpy.uint8) + value * 50
+            video.write_image(image)
+
+        self.assertRaises(
+            ValueError,
+            video.write_image,
+            numpy.zeros((10, 10, 3), dtype=numpy.uint8)
+        )
+
+        video.close()
+
+        capture = cv2.VideoCapture(filename)
+        frames = 0
+        while capture.read()[0]:
+            frames += 1
+
+        self.assertEqual(5, frames)
+
+    def test_mjpeg_passthrough(self):
+        if not media.SegmentHandler().available():
+            return
+
+        imageHandler = ImageHandler()
+        passthrough = media.JpegPassthrough((64, 48), imageHandler)
+
+        files = []
+        for i, shape in enumerate([(48, 64, 3), (48, 64, 3), (48, 64),
+                                   (24, 32, 3)]):
+            filename = os.path.join(self.tempDir, "{}.jpg".format(i))
+            cv2.imwrite(filename, numpy.zeros(shape, numpy.uint8) + i * 50)
+            files.append(filename)
+
+        self.assertTrue(passthrough.start(files[0]))
+
+        loaded = [passthrough.load(filename) for filename in files]
+
+        with open(files[1], "rb") as f:
+            self.assertEqual(f.read(), loaded[1])
+
+        # Grayscale and smaller files get decoded
+        self.assertEqual((48, 64, 3), loaded[2].shape)
+        self.assertEqual((24, 32, 3), loaded[3].shape)
+
+        self.assertFalse(passthrough.start(files[3]))
+
+        filename = os.path.join(self.tempDir, "out.avi")
+
+        video = media.MjpegVideoHandler(10, (64, 48))
+        video.open(filename)
+        video.write_image(loaded[0])
+        video.write_image(loaded[1])
+        video.write_image(loaded[2])
+        video.close()
+
+        self.assertEqual(2, video.copied)
+        self.assertEqual(1, video.encoded)
+
+        capture = cv2.VideoCapture(filename)
+        frames = []
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames.append(frame)
+
+        self.assertEqual(3, len(frames))
+        self.assertTrue((frames[1] == cv2.imread(files[1])).all())
@@ -0,0 +1,197 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from mock import Mock
+from unittest import TestCase
+
+import cv2
+import numpy
+
+from pytimelapse.media import ImageHandler
+from pytimelapse.pipeline import BadFrame
+from pytimelapse.pipeline import BadFramePolicy
+from pytimelapse.pipeline import FrameReader
+from pytimelapse.pipeline import SharedFrameReader
+
+
+class TestFrameReader(TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_read_order(self):
+        def decode(file):
+            time.sleep(random.random() / 1000)
+            return file * 2
+
+        files = range(200)
+        expected = [file * 2 for file in files]
+
+        reader = FrameReader(decode, workers=4, prefetch=8)
+
+        self.assertEqual(expected, list(reader.read(files)))
+
+    def test_read_prefetch(self):
+        lock = threading.Lock()
+        state = {"decoded": 0, "maxAhead": 0}
+        consumed = [0]
+
+        def decode(file):
+            with lock:
+                state["decoded"] += 1
+                ahead = state["decoded"] - consumed[0]
+                state["maxAhead"] = max(state["maxAhead"], ahead)
+            return file
+
+        reader = FrameReader(decode, workers=3, prefetch=5)
+
+        for frame in reader.read(range(50)):
+            time.sleep(0.001)
+            with lock:
+                consumed[0] += 1
+
+        self.assertTrue(state["maxAhead"] <= 5)
+
+    def test_read_error(self):
+        def decode(file):
+            if file == 3:
+                raise IOError("Broken file")
+            return file
+
+        reader = FrameReader(decode, workers=2)
+        frames = reader.read(range(10))
+
+        self.assertEqual([0, 1, 2], [next(frames) for i in range(3)])
+        self.assertRaises(IOError, next, frames)
+
+    def test_invalid_workers(self):
+        self.assertRaises(ValueError, FrameReader, None, 0)
+        self.assertRaises(ValueError, FrameReader, None, 1, 0)
+
+
+class TestSharedFrameReader(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_read(self):
+        files = [self.create(i, (48, 64, 3)) for i in range(6)]
+
+        # Smaller and bigger frames than the slots
+        files[2] = self.create(2, (24, 32, 3))
+        files[4] = self.create(4, (96, 128, 3))
+
+        files.insert(3, os.path.join(self.tempDir, "missing.png"))
+
+        reader = SharedFrameReader(ImageHandler(), 2, (48, 64, 3), slots=2)
+
+        results = []
+        for image in reader.read(files):
+            if isinstance(image, BadFrame):
+                results.append(image.filename)
+            else:
+                results.append((image.shape, int(image.mean())))
+
+        self.assertEqual(
+            [
+                ((48, 64, 3), 0),
+                ((48, 64, 3), 10),
+                ((24, 32, 3), 20),
+                files[3],
+                ((48, 64, 3), 30),
+                ((96, 128, 3), 40),
+                ((48, 64, 3), 50)
+            ],
+            results
+        )
+
+        # The frame to repeat has to outlive its slot
+        policy = BadFramePolicy("repeat-previous", ImageHandler())
+        policy.copyPrevious = True
+
+        images = [
+            int(image.mean())
+            for image in policy.apply(reader.read(files[:4] + files[:1]))
+        ]
+
+        self.assertEqual([0, 10, 20, 20, 0], images)
+
+    def test_invalid(self):
+        self.assertRaises(
+            ValueError, SharedFrameReader, ImageHandler(), 0, (1, 1, 3)
+        )
+        self.assertRaises(
+            ValueError, SharedFrameReader, ImageHandler(), 1, (1, 1, 3), 0
+        )
+
+    def create(self, value, shape):
+        filename = os.path.join(self.tempDir, "{}.png".format(value))
+        cv2.imwrite(filename, numpy.zeros(shape, numpy.uint8) + value * 10)
+        return filename
+
+
+class TestBadFramePolicy(TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_policies(self):
+        imageHandler = Mock(ImageHandler)
+        imageHandler.is_complete = Mock(
+            side_effect=lambda filename: filename != "truncated"
+        )
+
+        def decode(filename):
+            if filename == "broken":
+                return None
+            if filename == "missing":
+                raise IOError("No such file")
+            return filename.upper()
+
+        files = ["a", "broken", "b", "truncated", "missing", "c"]
+
+        expected = {
+            "skip": ["A", None, "B", None, None, "C"],
+            "repeat-previous": ["A", "A", "B", "B", "B", "C"]
+        }
+
+        for name in expected:
+            policy = BadFramePolicy(name, imageHandler)
+            reader = FrameReader(policy.wrap(decode), workers=2)
+
+            images = list(policy.apply(reader.read(files)))
+
+            self.assertEqual(expected[name], images)
+            self.assertEqual(
+                ["broken", "truncated", "missing"],
+                [filename for filename, problem in policy.bad]
+            )
+
+        policy = BadFramePolicy("abort", imageHandler)
+        images = policy.apply(policy.wrap(decode)(file) for file in files)
+
+        self.assertEqual("A", next(images))
+        self.assertRaises(IOError, next, images)
+
+        # Nothing to repeat yet
+        policy = BadFramePolicy("repeat-previous", imageHandler)
+        images = policy.apply(
+            policy.wrap(decode)(file) for file in ["broken", "a"]
+        )
+
+        self.assertEqual([None, "A"], list(images))
+
+        self.assertRaises(ValueError, BadFramePolicy, "retry", imageHandler)
@@ -0,0 +1,178 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+
+import os
+import shutil
+import tempfile
+from logging import Logger
+from mock import Mock
+from unittest import TestCase
+
+import cv2
+import numpy
+
+from pytimelapse import media
+from pytimelapse.core import Pytimelapse
+from pytimelapse.pipeline import BadFrame
+from pytimelapse.preview import Preview
+from pytimelapse.preview import ThumbnailCache
+
+
+class TestThumbnailCache(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempDir, "cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_lru(self):
+        # Room for two thumbnails
+        cache = ThumbnailCache(self.filename, (8, 6), 2 * 8 * 6 * 3)
+
+        cache.put("a", 1.0, self.thumbnail(10))
+        cache.put("b", 1.0, self.thumbnail(20))
+
+        self.assertEqual(10, cache.get("a", 1.0).min())
+        self.assertEqual(None, cache.get("a", 2.0))
+
+        # b is the least recently used one
+        cache.put("c", 1.0, self.thumbnail(30))
+
+        self.assertEqual(None, cache.get("b", 1.0))
+        self.assertEqual(30, cache.get("c", 1.0).min())
+
+        cache.close()
+
+        cache = ThumbnailCache(self.filename, (8, 6), 2 * 8 * 6 * 3)
+
+        self.assertEqual(10, cache.get("a", 1.0).min())
+        self.assertEqual(30, cache.get("c", 1.0).min())
+
+        # A changed file replaces its old thumbnail
+        cache.put("c", 2.0, self.thumbnail(40))
+        self.assertEqual(40, cache.get("c", 2.0).min())
+        self.assertEqual(10, cache.get("a", 1.0).min())
+
+        cache.close()
+
+        # A different size starts over
+        cache = ThumbnailCache(self.filename, (4, 3), 2 * 8 * 6 * 3)
+
+        self.assertEqual(8, cache.capacity)
+        self.assertEqual(None, cache.get("a", 1.0))
+
+        cache.close()
+
+    def test_preview(self):
+        cache = ThumbnailCache(self.filename, (8, 6), 1024)
+        preview = Preview(cache)
+
+        image = os.path.join(self.tempDir, "1.png")
+        cv2.imwrite(image, numpy.zeros((48, 64, 3), numpy.uint8) + 50)
+
+        decode = Mock(side_effect=cv2.imread)
+        load = preview.wrap(decode)
+
+        self.assertEqual((6, 8, 3), load(image).shape)
+        self.assertEqual(50, load(image).min())
+
+        self.assertEqual(1, decode.call_count)
+        self.assertEqual((1, 1), (preview.hits, preview.misses))
+
+        # Failures are left for the caller
+        load = preview.wrap(lambda filename: None)
+        self.assertEqual(None, load(self.filename))
+
+        os.remove(image)
+
+        frame = load(image)
+        self.assertTrue(isinstance(frame, BadFrame))
+        self.assertTrue(frame.problem.startswith("can't be read"))
+
+        cache.close()
+
+        # Frames outlive their slots in the cache
+        cache = ThumbnailCache(self.filename, (8, 6), 8 * 6 * 3)
+        load = Preview(cache).wrap(cv2.imread)
+
+        images = []
+        for value in [10, 20, 30]:
+            image = os.path.join(self.tempDir, "{}.png".format(value))
+            cv2.imwrite(image, numpy.zeros((48, 64, 3), numpy.uint8) + value)
+            images.append(load(image))
+            images.append(load(image))
+
+        self.assertEqual(
+            [10, 10, 20, 20, 30, 30],
+            [frame.min() for frame in images]
+        )
+
+        cache.close()
+
+    def test_render(self):
+        files = []
+        for i in range(4):
+            filename = os.path.join(self.tempDir, "{}.png".format(i))
+            cv2.imwrite(filename, numpy.zeros((96, 128, 3), numpy.uint8) + i)
+            files.append(filename)
+
+        app = Pytimelapse()
+        app.logger = Mock(Logger)
+
+        config = app.get_preview_config(
+            media.ImageHandler(),
+            files[0],
+            {"codec": "MJPG", "fps": 10.0, "preview": True,
+             "outFile": os.path.join(self.tempDir, "out.avi")}
+        )
+
+        self.assertEqual("320x240", config["resize"])
+
+        imageHandler = media.ImageHandler()
+        imageHandler.read = Mock(side_effect=imageHandler.read)
+
+        for run in range(2):
+            app.encode_frames(
+                imageHandler, files, (320, 240), config, config["outFile"]
+            )
+
+        # Only the first render decoded the images
+        self.assertEqual(4, imageHandler.read.call_count)
+
+        capture = cv2.VideoCapture(config["outFile"])
+        ok, frame = capture.read()
+
+        self.assertTrue(ok)
+        self.assertEqual((240, 320, 3), frame.shape)
+
+    def test_render_removed(self):
+        files = []
+        for i in range(3):
+            filename = os.path.join(self.tempDir, "{}.png".format(i))
+            cv2.imwrite(filename, numpy.zeros((96, 128, 3), numpy.uint8) + i)
+            files.append(filename)
+
+        app = Pytimelapse()
+        app.logger = Mock(Logger)
+
+        config = app.get_preview_config(
+            media.ImageHandler(),
+            files[0],
+            {"codec": "MJPG", "fps": 10.0, "preview": True,
+             "onBadFrame": "skip",
+             "outFile": os.path.join(self.tempDir, "out.avi")}
+        )
+
+        # Gone after the files were found
+        os.remove(files[1])
+
+        bad = app.encode_frames(
+            media.ImageHandler(), files, (320, 240), config, config["outFile"]
+        )
+
+        self.assertEqual([files[1]], [filename for filename, problem in bad])
+
+    def thumbnail(self, value):
+        return numpy.zeros((6, 8, 3), numpy.uint8) + value
@@ -0,0 +1,400 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+
+import os
+import shutil
+import tempfile
+from logging import Logger
+from mock import Mock
+from unittest import TestCase
+
+import cv2
+import numpy
+
+from pytimelapse import media
+from pytimelapse.checkpoint import Checkpoint
+from pytimelapse.core import Pytimelapse
+from pytimelapse.filehandler import FileHandler
+
+
+class TestPytimelapse(TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_get_chunks(self):
+        app = Pytimelapse()
+        interval = media.keyframeInterval
+
+        self.assertEqual([(0, 100)], app.get_chunks(100, 1))
+        self.assertEqual([(0, 0)], app.get_chunks(0, 4))
+
+        chunks = app.get_chunks(10000, 4)
+
+        self.assertEqual(4, len(chunks))
+        self.assertEqual(0, chunks[0][0])
+        self.assertEqual(10000, chunks[-1][1])
+
+        for (start, end), (nextStart, nextEnd) in zip(chunks, chunks[1:]):
+            self.assertEqual(end, nextStart)
+            self.assertEqual(0, nextStart % interval)
+
+        # Too few frames to split up to keyframe intervals
+        self.assertEqual([(0, interval), (interval, 15)],
+                         app.get_chunks(15, 4))
+
+    def test_get_reduction(self):
+        app = Pytimelapse()
+
+        imageHandler = Mock(media.ImageHandler)
+        imageHandler.get_size = Mock(return_value=(4000, 3000))
+
+        # Letterboxed to 960x720
+        config = {"resize": "1280x720"}
+        self.assertEqual(
+            4,
+            app.get_reduction(imageHandler, "1.jpg", (1280, 720), config)
+        )
+
+        config = {"resize": "500x375"}
+        self.assertEqual(
+            8,
+            app.get_reduction(imageHandler, "1.jpg", (500, 375), config)
+        )
+
+        # Cropping the edges needs more of the height
+        config = {"resize": "1000x375", "fit": "crop"}
+        self.assertEqual(
+            4,
+            app.get_reduction(imageHandler, "1.jpg", (1000, 375), config)
+        )
+
+        config = {"resize": "500x375", "crop": "0,0,2000,1500"}
+        self.assertEqual(
+            4,
+            app.get_reduction(imageHandler, "1.jpg", (500, 375), config)
+        )
+
+        config = {"resize": "3000x2250"}
+        self.assertEqual(
+            1,
+            app.get_reduction(imageHandler, "1.jpg", (3000, 2250), config)
+        )
+
+        self.assertEqual(1, app.get_reduction(imageHandler, "1.jpg", None, {}))
+
+    def test_get_transform_reduced(self):
+        app = Pytimelapse()
+
+        config = {"crop": "100,50,2000,1500"}
+        frameTransform = app.get_transform((500, 375), config, 4)
+
+        self.assertEqual((25, 12, 500, 375), frameTransform.crop)
+
+        config = {"crop": "0,0,2,3"}
+        frameTransform = app.get_transform((500, 375), config, 4)
+
+        self.assertEqual((0, 0, 1, 1), frameTransform.crop)
+
+    def test_encode_crop_reduced(self):
+        if 4 not in media.reductions:
+            return
+
+        tempDir = tempfile.mkdtemp()
+
+        try:
+            filename = os.path.join(tempDir, "1.jpg")
+            image = numpy.zeros((600, 800, 3), dtype=numpy.uint8) + 100
+            cv2.imwrite(filename, image)
+
+            app = Pytimelapse()
+            app.logger = Mock(Logger)
+
+            outFile = os.path.join(tempDir, "out.avi")
+            config = {
+                "codec": "MJPG",
+                "fps": 10.0,
+                "crop": "0,0,800,600",
+                "resize": "200x150"
+            }
+
+            self.assertEqual(
+                4,
+                app.get_reduction(
+                    media.ImageHandler(), filename, (200, 150), config
+                )
+            )
+
+            app.encode_frames(
+                media.ImageHandler(4), [filename], (200, 150), config,
+                outFile
+            )
+
+            ok, frame = cv2.VideoCapture(outFile).read()
+
+            self.assertTrue(ok)
+            self.assertEqual((150, 200, 3), frame.shape)
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_encode_crop_mixed(self):
+        if 4 not in media.reductions:
+            return
+
+        tempDir = tempfile.mkdtemp()
+
+        try:
+            # Dark left half, light right half
+            image = numpy.zeros((600, 800, 3), dtype=numpy.uint8) + 40
+            image[:, 400:] = 200
+
+            files = []
+            for name in ["1.jpg", "2.png", "3.jpg"]:
+                filename = os.path.join(tempDir, name)
+                cv2.imwrite(filename, image)
+                files.append(filename)
+
+            app = Pytimelapse()
+            app.logger = Mock(Logger)
+
+            outFile = os.path.join(tempDir, "out.avi")
+            config = {
+                "codec": "MJPG",
+                "fps": 10.0,
+                "crop": "400,0,400,600",
+                "resize": "100x150"
+            }
+
+            reduction = app.get_reduction(
+                media.ImageHandler(), files[0], (100, 150), config, files
+            )
+
+            self.assertEqual(1, reduction)
+
+            app.encode_frames(
+                media.ImageHandler(reduction), files, (100, 150), config,
+                outFile
+            )
+
+            capture = cv2.VideoCapture(outFile)
+            frames = []
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                frames.append(frame)
+
+            self.assertEqual(3, len(frames))
+
+            for frame in frames:
+                self.assertTrue(frame.min() > 150)
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_select_files_append(self):
+        app = Pytimelapse()
+        app.logger = Mock(Logger)
+
+        files = ["{}.jpg".format(i) for i in range(40)]
+        config = {"useNthFile": 3}
+
+        selected = app.select_files(FileHandler(), files[:31], config)
+
+        self.assertEqual(files[30], selected[-1])
+        self.assertEqual(0, app.skipped)
+
+        # Appended files carry on where the first ones left off
+        selected = app.select_files(
+            FileHandler(), files[31:], config, app.skipped
+        )
+
+        self.assertEqual([files[33], files[36], files[39]], selected)
+        self.assertEqual(0, app.skipped)
+
+        selected = app.select_files(FileHandler(), files[:5], config)
+        selected += app.select_files(
+            FileHandler(), files[5:7], config, app.skipped
+        )
+        selected += app.select_files(
+            FileHandler(), files[7:], config, app.skipped
+        )
+
+        self.assertEqual(files[::3], selected)
+
+    def test_validate(self):
+        tempDir = tempfile.mkdtemp()
+
+        try:
+            files = []
+            for i, size in enumerate([(64, 48), (64, 48), (32, 48), (64, 48)]):
+                filename = os.path.join(tempDir, "{}.jpg".format(i))
+                image = numpy.zeros((size[1], size[0], 3), dtype=numpy.uint8)
+                cv2.imwrite(filename, image)
+                files.append(filename)
+
+            with open(files[3], "r+b") as f:
+                f.truncate(100)
+
+            app = Pytimelapse()
+            app.logger = Mock(Logger)
+
+            config = {"validate": "skip"}
+            self.assertEqual(files[:2], app.validate(files, config))
+
+            config = {"validate": "report"}
+            self.assertRaises(Exception, app.validate, files, config)
+
+            self.assertEqual(files[:2], app.validate(files[:2], config))
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_resume(self):
+        if not media.SegmentHandler().available():
+            return
+
+        tempDir = tempfile.mkdtemp()
+
+        try:
+            files = []
+            for i in range(40):
+                filename = os.path.join(tempDir, "{}.jpg".format(i))
+                image = numpy.zeros((48, 64, 3), dtype=numpy.uint8) + i
+                cv2.imwrite(filename, image)
+                files.append(filename)
+
+            outFile = os.path.join(tempDir, "out.avi")
+            checkpointFile = Checkpoint.get_filename(outFile)
+
+            app = Pytimelapse()
+            app.logger = Mock(Logger)
+
+            config = {
+                "codec": "DIVX",
+                "fps": 10.0,
+                "checkpointFrames": 12
+            }
+
+            # Fail in the third segment
+            os.rename(files[30], files[30] + ".moved")
+
+            self.assertRaises(
+                Exception,
+                app.encode, media.ImageHandler(), files, (64, 48), config,
+                outFile
+            )
+
+            checkpoint = Checkpoint.load(checkpointFile)
+            self.assertEqual([0, 1], checkpoint.done)
+            self.assertEqual(24, checkpoint.frames())
+
+            os.rename(files[30] + ".moved", files[30])
+
+            config["resume"] = True
+            app.encode(media.ImageHandler(), files, (64, 48), config, outFile)
+
+            # Only the unfinished segments were encoded again
+            app.logger.info.assert_any_call(
+                "Encoding 2 of 4 chunks of up to 12 frames"
+            )
+
+            self.assertFalse(os.path.exists(checkpointFile))
+            # Segments are gone too
+            names = [os.path.basename(filename) for filename in files]
+            self.assertEqual(
+                sorted(names + ["out.avi"]),
+                sorted(os.listdir(tempDir))
+            )
+
+            capture = cv2.VideoCapture(outFile)
+            frames = 0
+            while capture.read()[0]:
+                frames += 1
+
+            self.assertEqual(40, frames)
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_encode_workers_decode_processes(self):
+        if not media.SegmentHandler().available():
+            return
+
+        tempDir = tempfile.mkdtemp()
+
+        try:
+            files = []
+            for i in range(30):
+                filename = os.path.join(tempDir, "{}.jpg".format(i))
+                image = numpy.zeros((48, 64, 3), dtype=numpy.uint8) + i
+                cv2.imwrite(filename, image)
+                files.append(filename)
+
+            app = Pytimelapse()
+            app.logger = Mock(Logger)
+
+            outFile = os.path.join(tempDir, "out.avi")
+            config = {
+                "codec": "MJPG",
+                "fps": 10.0,
+                "encodeWorkers": 2,
+                "decodeProcesses": 2
+            }
+
+            # Resized, so the frames can't be passed through undecoded
+            app.encode(media.ImageHandler(), files, (32, 24), config, outFile)
+
+            capture = cv2.VideoCapture(outFile)
+            frames = 0
+            while capture.read()[0]:
+                frames += 1
+
+            self.assertEqual(30, frames)
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_bad_frames(self):
+        tempDir = tempfile.mkdtemp()
+
+        try:
+            files = []
+            for i in range(6):
+                filename = os.path.join(tempDir, "{}.jpg".format(i))
+                image = numpy.zeros((48, 64, 3), dtype=numpy.uint8) + i * 40
+                cv2.imwrite(filename, image)
+                files.append(filename)
+
+            # Still being written
+            with open(files[2], "r+b") as f:
+                f.truncate(200)
+
+            app = Pytimelapse()
+            app.logger = Mock(Logger)
+
+            outFile = os.path.join(tempDir, "out.avi")
+
+            for policy, expected in [("skip", 5), ("repeat-previous", 6)]:
+                config = {"codec": "MJPG", "fps": 10.0, "onBadFrame": policy}
+
+                bad = app.encode_frames(
+                    media.ImageHandler(), files, (64, 48), config, outFile
+                )
+
+                self.assertEqual([(files[2], "is truncated")], bad)
+
+                capture = cv2.VideoCapture(outFile)
+                frames = 0
+                while capture.read()[0]:
+                    frames += 1
+
+                self.assertEqual(expected, frames)
+
+            config = {"codec": "MJPG", "fps": 10.0}
+            self.assertRaises(
+                IOError,
+                app.encode_frames,
+                media.ImageHandler(), files, (64, 48), config, outFile
+            )
+        finally:
+            shutil.rmtree(tempDir)
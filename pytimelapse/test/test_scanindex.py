@@ -0,0 +1,147 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pytimelapse.filehandler import FileHandler
+from pytimelapse.scanindex import ScanIndex
+
+
+class TestScanIndex(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.imageDir = os.path.join(self.tempDir, "images")
+        os.mkdir(self.imageDir)
+
+        self.index = ScanIndex(os.path.join(self.tempDir, "index"))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tempDir)
+
+    def test_update(self):
+        self.create("cam-1000.jpg", 3)
+        self.create("cam-2000.jpg", 2)
+        self.create("cam-3000.jpg", 1)
+
+        self.assertEqual(3, self.index.update(self.imageDir))
+        self.assertEqual(0, self.index.update(self.imageDir))
+
+        self.create("cam-4000.jpg", 4)
+        os.remove(os.path.join(self.imageDir, "cam-1000.jpg"))
+
+        self.assertEqual(1, self.index.update(self.imageDir))
+
+        rows = list(self.index.files([self.imageDir], "filepath"))
+
+        self.assertEqual(
+            ["cam-2000.jpg", "cam-3000.jpg", "cam-4000.jpg"],
+            [row[1] for row in rows]
+        )
+
+        timestamps = [
+            row[0] for row in self.index.connection.execute(
+                "SELECT timestamp FROM files ORDER BY timestamp"
+            )
+        ]
+
+        self.assertEqual([2000, 3000, 4000], timestamps)
+
+    def test_update_changed(self):
+        self.create("1.jpg", 100)
+
+        self.index.update(self.imageDir)
+
+        path = os.path.join(self.imageDir, "1.jpg")
+        self.index.set_sizes({path: (640, 480)})
+
+        # Rewritten in place, and the directory listed again for a new file
+        self.create("1.jpg", 5000)
+        self.create("2.jpg", 200)
+
+        self.assertEqual(2, self.index.update(self.imageDir))
+
+        rows = list(self.index.files([self.imageDir], "filepath"))
+
+        self.assertEqual(5000, rows[0][2])
+        self.assertEqual({}, self.index.get_sizes([path]))
+
+    def test_files_sorted(self):
+        self.create("a.jpg", 3)
+        self.create("b.jpg", 1)
+        self.create("c.jpg", 2)
+
+        self.index.update(self.imageDir)
+
+        rows = list(self.index.files([self.imageDir], "modified"))
+
+        self.assertEqual(
+            ["b.jpg", "c.jpg", "a.jpg"],
+            [row[1] for row in rows]
+        )
+        self.assertEqual([1, 2, 3], [row[2] for row in rows])
+
+    def test_sizes(self):
+        self.create("1.jpg", 1)
+        self.create("2.jpg", 2)
+
+        self.index.update(self.imageDir)
+
+        paths = [
+            os.path.join(self.imageDir, "1.jpg"),
+            os.path.join(self.imageDir, "2.jpg")
+        ]
+
+        self.assertEqual({}, self.index.get_sizes(paths))
+
+        self.index.set_sizes({paths[0]: (640, 480)})
+
+        self.assertEqual(
+            {paths[0]: (640, 480)},
+            self.index.get_sizes(paths)
+        )
+
+    def test_find_files(self):
+        self.create("1.jpg", 3)
+        self.create("2.jpg", 2)
+        self.create("3.png", 1)
+        self.create(".4.jpg", 0)
+
+        config = {
+            "imageFiles": [
+                os.path.join(self.imageDir, "*.jpg"),
+                os.path.join(self.imageDir, "3.png")
+            ],
+            "sortFiles": "modified",
+            "startFile": None,
+            "onlyBetweenTimes": None,
+            "scanIndex": os.path.join(self.tempDir, "index")
+        }
+
+        expected = [
+            os.path.join(self.imageDir, "3.png"),
+            os.path.join(self.imageDir, "2.jpg"),
+            os.path.join(self.imageDir, "1.jpg")
+        ]
+
+        fileHandler = FileHandler()
+
+        self.assertEqual(expected, fileHandler.find_files(config))
+
+        # Second run comes from the index
+        self.assertEqual(expected, fileHandler.find_files(config))
+
+        del config["scanIndex"]
+        self.assertEqual(expected, fileHandler.find_files(config))
+
+    def create(self, name, timestamp):
+        filename = os.path.join(self.imageDir, name)
+
+        with open(filename, "w") as f:
+            f.write(name)
+
+        os.utime(filename, (timestamp, timestamp))
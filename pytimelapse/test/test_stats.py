@@ -0,0 +1,76 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pytimelapse.stats import StageStats
+from pytimelapse.stats import Stats
+
+
+class TestStats(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_stage_stats(self):
+        stage = StageStats()
+        stage.add(0.0015)
+        stage.add(0.0017)
+        stage.add(0.1)
+
+        summary = stage.as_dict()
+
+        self.assertEqual(3, summary["count"])
+        self.assertAlmostEqual(0.1032, summary["seconds"])
+        self.assertEqual({"2048": 2, "131072": 1}, summary["histogram"])
+
+    def test_emit(self):
+        filename = os.path.join(self.tempDir, "stats")
+        stats = Stats(filename, interval=3600, total=4, label="test")
+
+        double = stats.wrap("double", lambda value: value * 2)
+        values = stats.iterate("wait", iter([1, 2, 3]))
+
+        for value in values:
+            double(value)
+            stats.tick()
+
+        stats.watch("queue", lambda: 7)
+        stats.close()
+
+        with open(filename) as f:
+            lines = [json.loads(line) for line in f]
+
+        # Only the final line, as the interval never passed
+        self.assertEqual(1, len(lines))
+
+        data = lines[0]
+
+        self.assertTrue(data["done"])
+        self.assertEqual("test", data["label"])
+        self.assertEqual(3, data["frames"])
+        self.assertEqual(4, data["total"])
+        self.assertEqual(3, data["stages"]["double"]["count"])
+        self.assertEqual(3, data["stages"]["wait"]["count"])
+        self.assertEqual(7, data["gauges"]["queue"])
+        self.assertTrue(data["eta"] >= 0)
+
+    def test_summary(self):
+        stats = Stats(None, interval=0)
+
+        stats.add("encode", 0.5)
+        stats.tick()
+        stats.close()
+
+        data = stats.summary(done=True)
+
+        self.assertEqual(1, data["frames"])
+        self.assertEqual(0.5, data["stages"]["encode"]["seconds"])
+        self.assertEqual([], os.listdir(self.tempDir))
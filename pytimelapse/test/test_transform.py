@@ -0,0 +1,116 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+
+import numpy
+from unittest import TestCase
+
+from pytimelapse import transform
+from pytimelapse.transform import FrameBlender
+from pytimelapse.transform import FrameTransform
+
+
+class TestFrameTransform(TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_parse(self):
+        self.assertEqual((1920, 1080), transform.parse_size("1920x1080"))
+        self.assertEqual((10, 20, 30, 40), transform.parse_crop("10,20,30,40"))
+
+        self.assertRaises(ValueError, transform.parse_size, "1920")
+        self.assertRaises(ValueError, transform.parse_size, "0x10")
+        self.assertRaises(ValueError, transform.parse_crop, "1,2,3")
+
+    def test_same_size(self):
+        frameTransform = FrameTransform((40, 30))
+        image = self.image(40, 30)
+
+        self.assertTrue(frameTransform.apply(image) is image)
+
+    def test_crop(self):
+        frameTransform = FrameTransform((20, 10), crop=(5, 10, 20, 10))
+        image = self.image(40, 30)
+
+        result = frameTransform.apply(image)
+
+        self.assertEqual((10, 20, 3), result.shape)
+        self.assertTrue(numpy.array_equal(image[10:20, 5:25], result))
+
+        self.assertRaises(ValueError, frameTransform.apply, self.image(20, 10))
+
+    def test_letterbox(self):
+        frameTransform = FrameTransform((40, 30))
+
+        # Wider than the frame, gets borders on top and bottom
+        result = frameTransform.apply(self.image(80, 30, 255))
+
+        self.assertEqual((30, 40, 3), result.shape)
+        self.assertEqual(0, result[:7].max())
+        self.assertEqual(0, result[-7:].max())
+        self.assertEqual(255, result[8:22].min())
+
+        # The same buffer gets reused
+        buffer = result
+        result = frameTransform.apply(self.image(80, 30, 128))
+
+        self.assertTrue(result is buffer)
+        self.assertEqual(128, result[8:22].min())
+
+        # Taller than the frame, the old picture gets cleared
+        result = frameTransform.apply(self.image(20, 30, 255))
+
+        self.assertEqual(0, result[:, :10].max())
+        self.assertEqual(0, result[:, -10:].max())
+        self.assertEqual(255, result[:, 10:30].min())
+
+    def test_fit_crop(self):
+        frameTransform = FrameTransform((40, 30), fit="crop")
+
+        image = self.image(80, 30)
+        image[:, 20:60] = 255
+
+        result = frameTransform.apply(image)
+
+        self.assertEqual((30, 40, 3), result.shape)
+        self.assertEqual(255, result.min())
+
+    def test_invalid_fit(self):
+        self.assertRaises(ValueError, FrameTransform, (40, 30), None, "zoom")
+
+    def test_blend(self):
+        blender = FrameBlender()
+
+        frames = [self.image(4, 2, value) for value in (10, 20, 255)]
+        result = blender.blend(iter(frames))
+
+        self.assertEqual(numpy.uint8, result.dtype)
+        self.assertEqual(95, result.min())
+        self.assertEqual(95, result.max())
+
+        # Single frames are passed as they are
+        self.assertTrue(blender.blend([frames[0]]) is frames[0])
+
+        # The first frame is copied before the next one is read, so frames
+        # can be reused buffers
+        buffer = self.image(4, 2)
+
+        def reused():
+            for value in (0, 3):
+                buffer.fill(value)
+                yield buffer
+
+        self.assertEqual(2, blender.blend(reused()).min())
+
+    def test_parse_blend(self):
+        self.assertEqual("auto", transform.parse_blend("auto"))
+        self.assertEqual(20, transform.parse_blend("20"))
+
+        self.assertRaises(ValueError, transform.parse_blend, "0")
+        self.assertRaises(ValueError, transform.parse_blend, "many")
+
+    def image(self, width, height, value=0):
+        return numpy.zeros((height, width, 3), dtype=numpy.uint8) + value
@@ -0,0 +1,175 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+import cv2
+import numpy
+
+from pytimelapse.core import Pytimelapse
+from pytimelapse.filehandler import FileHandler
+from pytimelapse.watch import InotifyWatcher
+from pytimelapse.watch import PollingWatcher
+from pytimelapse.watch import Watch
+
+
+class TestWatchers(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.dirPatterns = FileHandler().dir_patterns(
+            [os.path.join(self.tempDir, "*.png")]
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_polling(self):
+        watcher = PollingWatcher(self.dirPatterns, "filepath", 5)
+
+        old = time.time() - 60
+        self.create("1.png", old)
+        self.create("2.png", old)
+        self.create("2.txt", old)
+
+        self.assertEqual(["1.png", "2.png"], self.names(watcher.poll()))
+        self.assertEqual([], watcher.poll())
+
+        # Files still being written hold back the ones after them
+        self.create("3.png")
+        self.create("4.png", old)
+
+        self.assertEqual([], watcher.poll())
+
+        os.utime(os.path.join(self.tempDir, "3.png"), (old, old))
+
+        self.assertEqual(["3.png", "4.png"], self.names(watcher.poll()))
+
+        # Files before the last one taken are not new
+        self.create("0.png", old)
+
+        self.assertEqual([], watcher.poll())
+
+    def test_inotify(self):
+        try:
+            watcher = InotifyWatcher(self.dirPatterns, "filepath", 1)
+        except (AttributeError, OSError):
+            return
+
+        try:
+            self.create("1.png")
+            self.create("1.txt")
+
+            self.assertEqual(["1.png"], self.names(watcher.wait(1)))
+            self.assertEqual([], watcher.wait(0))
+        finally:
+            watcher.close()
+
+    def create(self, name, modified=None):
+        filename = os.path.join(self.tempDir, name)
+
+        with open(filename, "wb") as f:
+            f.write(b"image")
+
+        if modified is not None:
+            os.utime(filename, (modified, modified))
+
+        return filename
+
+    def names(self, files):
+        return [os.path.basename(filename) for filename in files]
+
+
+class TestWatch(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_segments(self):
+        # 2013-06-01 14:00 UTC
+        start = 1370095200
+
+        files = [
+            self.create("img_{}.png".format(start + offset))
+            for offset in [0, 1800, 3600, 3700, 1900]
+        ]
+
+        watch = Watch(Pytimelapse(), self.get_config())
+        watch.process([files[:3], files[3:]])
+        watch.close_segment()
+
+        # A file arriving late for an earlier hour gets its own segment
+        self.assertEqual(
+            [
+                ("out.2013-06-01-14.1.avi", 1),
+                ("out.2013-06-01-14.avi", 2),
+                ("out.2013-06-01-15.avi", 2)
+            ],
+            self.segments()
+        )
+
+    def test_idle(self):
+        watch = Watch(Pytimelapse(), self.get_config())
+        watch.process([[self.create("img_1370095200.png")]])
+
+        self.assertTrue(watch.video is not None)
+
+        # The hour is long over
+        watch.process([[]])
+
+        self.assertTrue(watch.video is None)
+        self.assertEqual([("out.2013-06-01-14.avi", 1)], self.segments())
+
+    def test_select(self):
+        config = self.get_config()
+        config["useNthFile"] = 2
+        config["onlyBetweenTimes"] = "14:00:00-14:59:59"
+
+        watch = Watch(Pytimelapse(), config)
+
+        files = ["img_{}.png".format(1370095200 + i * 900) for i in range(6)]
+
+        self.assertEqual(
+            [files[0], files[2]],
+            watch.select(files[:3]) + watch.select(files[3:])
+        )
+
+    def get_config(self):
+        return {
+            "watch": "hourly",
+            "watchInterval": 1,
+            "outFile": os.path.join(self.tempDir, "out.avi"),
+            "codec": "MJPG",
+            "fps": 10.0,
+            "onBadFrame": "abort",
+            "timestampTimezone": "UTC",
+            "onlyBetweenTimes": None,
+            "useNthFile": None
+        }
+
+    def create(self, name):
+        filename = os.path.join(self.tempDir, name)
+        cv2.imwrite(filename, numpy.zeros((48, 64, 3), numpy.uint8))
+        return filename
+
+    def segments(self):
+        segments = []
+
+        for name in sorted(os.listdir(self.tempDir)):
+            if not name.endswith(".avi"):
+                continue
+
+            capture = cv2.VideoCapture(os.path.join(self.tempDir, name))
+            frames = 0
+            while capture.read()[0]:
+                frames += 1
+
+            segments.append((name, frames))
+
+        return segments
@@ -0,0 +1,273 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+import cv2
+import numpy
+
+
+__doc__ = """Frame transformations for Pytimelapse"""
+
+
+# Ways to fit frames of a different aspect ratio to the output size
+fitModes = ["letterbox", "crop"]
+
+
+def parse_size(value):
+    """Parse WIDTHxHEIGHT into a (width, height) tuple"""
+
+    try:
+        width, height = [int(part) for part in value.lower().split("x")]
+    except ValueError:
+        raise ValueError("Invalid size {}, expected WxH".format(value))
+
+    if width < 1 or height < 1:
+        raise ValueError("Invalid size {}, must be positive".format(value))
+
+    return width, height
+
+
+def parse_crop(value):
+    """Parse X,Y,WIDTH,HEIGHT into a tuple"""
+
+    try:
+        x, y, width, height = [int(part) for part in value.split(",")]
+    except ValueError:
+        raise ValueError("Invalid crop {}, expected x,y,w,h".format(value))
+
+    if x < 0 or y < 0 or width < 1 or height < 1:
+        raise ValueError("Invalid crop {}, must be positive".format(value))
+
+    return x, y, width, height
+
+
+class FrameTransform(object):
+    """Crops and resizes frames to the size of the video
+
+    Resized frames are written into a buffer that is reused for every frame,
+    so a frame returned by apply() is only valid until the next call.
+    """
+
+    def __init__(self, frameSize, crop=None, fit="letterbox"):
+        if fit not in fitModes:
+            raise ValueError("Invalid fit mode {}".format(fit))
+
+        self.frameSize = tuple(frameSize)
+        self.crop = crop
+        self.fit = fit
+
+        self.buffer = None
+        self.layout = None
+
+    def get_size(self, sourceSize):
+        """Size of a source frame after cropping"""
+
+        if self.crop:
+            return self.crop[2], self.crop[3]
+
+        return tuple(sourceSize)
+
+    def get_scale(self, sourceSize):
+        """How much a cropped frame of sourceSize gets scaled to fit in the
+        frame"""
+
+        width, height = sourceSize
+        outWidth, outHeight = self.frameSize
+
+        scales = (float(outWidth) / width, float(outHeight) / height)
+
+        if self.fit == "crop":
+            return max(scales)
+
+        return min(scales)
+
+    def apply(self, image):
+        """Crop and resize the image to the frame size"""
+
+        if self.crop:
+            image = self.apply_crop(image)
+
+        height, width = image.shape[:2]
+
+        if (width, height) == self.frameSize:
+            return image
+
+        if self.buffer is None:
+            outWidth, outHeight = self.frameSize
+            self.buffer = numpy.zeros(
+                (outHeight, outWidth) + image.shape[2:],
+                dtype=image.dtype
+            )
+
+        if self.fit == "crop":
+            return self.resize_crop(image)
+
+        return self.resize_letterbox(image)
+
+    def apply_crop(self, image):
+        """Cut out the crop area, as a view of the image"""
+
+        x, y, width, height = self.crop
+        imageHeight, imageWidth = image.shape[:2]
+
+        if x + width > imageWidth or y + height > imageHeight:
+            raise ValueError(
+                "Crop area {} doesn't fit in a {}x{} frame".format(
+                    self.crop, imageWidth, imageHeight
+                )
+            )
+
+        return image[y:y + height, x:x + width]
+
+    def resize_crop(self, image):
+        """Scale the image to cover the whole frame, cutting off the edges
+        that don't fit"""
+
+        height, width = image.shape[:2]
+        outWidth, outHeight = self.frameSize
+
+        scale = self.get_scale((width, height))
+
+        # Part of the source that ends up in the frame, centered
+        cutWidth = min(width, int(round(outWidth / scale)))
+        cutHeight = min(height, int(round(outHeight / scale)))
+        x = (width - cutWidth) // 2
+        y = (height - cutHeight) // 2
+
+        return self.resize(
+            image[y:y + cutHeight, x:x + cutWidth],
+            self.buffer
+        )
+
+    def resize_letterbox(self, image):
+        """Scale the whole image to fit in the frame, padding it with black
+        borders"""
+
+        height, width = image.shape[:2]
+        outWidth, outHeight = self.frameSize
+
+        scale = self.get_scale((width, height))
+
+        fitWidth = min(outWidth, int(round(width * scale)))
+        fitHeight = min(outHeight, int(round(height * scale)))
+        x = (outWidth - fitWidth) // 2
+        y = (outHeight - fitHeight) // 2
+
+        # The borders stay black as long as the picture stays in place
+        layout = (x, y, fitWidth, fitHeight)
+        if layout != self.layout:
+            self.buffer.fill(0)
+            self.layout = layout
+
+        self.resize(image, self.buffer[y:y + fitHeight, x:x + fitWidth])
+
+        return self.buffer
+
+    def resize(self, image, target):
+        """Resize the image into the target array"""
+
+        height, width = image.shape[:2]
+        targetHeight, targetWidth = target.shape[:2]
+
+        # Area averaging looks best when shrinking, but is slow and blocky
+        # when enlarging
+        if targetWidth < width and targetHeight < height:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_LINEAR
+
+        cv2.resize(
+            image,
+            (targetWidth, targetHeight),
+            dst=target,
+            interpolation=interpolation
+        )
+
+        return target
+
+
+def parse_blend(value):
+    """Parse the blend setting, a number of files per frame or auto"""
+
+    if value == "auto":
+        return value
+
+    try:
+        count = int(value)
+    except ValueError:
+        raise ValueError("Invalid blend {}, expected N or auto".format(value))
+
+    if count < 1:
+        raise ValueError("Invalid blend {}, must be positive".format(value))
+
+    return count
+
+
+class FrameBlender(object):
+    """Averages groups of frames into one
+
+    The frames are summed up in a float32 accumulator, which is reused for
+    every group like the returned frame is, so a frame returned by blend()
+    or finish() is only valid until the next call. Frames can also be added
+    one at a time with add(), for when the group isn't known up front.
+    """
+
+    def __init__(self):
+        self.accumulator = None
+        self.buffer = None
+
+        # Frames added to the current group, and the first one of them
+        self.count = 0
+        self.first = None
+
+    def blend(self, frames):
+        """Average the frames, all of which have to be the same size.
+        Returns None if there are no frames."""
+
+        for frame in frames:
+            self.add(frame)
+
+        return self.finish()
+
+    def add(self, frame):
+        """Add a frame to the current group"""
+
+        # Frames might be reused buffers, so copy the first one right away
+        if self.count == 0:
+            self.first = frame
+            self.start(frame)
+        else:
+            numpy.add(self.accumulator, frame, out=self.accumulator)
+
+        self.count += 1
+
+    def finish(self):
+        """Average of the frames added since the last call, None if there
+        were none. A single frame is only valid until the next add()."""
+
+        count = self.count
+        first = self.first
+
+        self.count = 0
+        self.first = None
+
+        if count == 0:
+            return None
+
+        # A single frame is already its own average
+        if count == 1:
+            return first
+
+        numpy.multiply(self.accumulator, 1.0 / count, out=self.accumulator)
+        numpy.rint(self.accumulator, out=self.accumulator)
+        self.buffer[...] = self.accumulator
+
+        return self.buffer
+
+    def start(self, frame):
+        """Start a new group from the frame"""
+
+        if self.accumulator is None or self.accumulator.shape != frame.shape:
+            self.accumulator = numpy.empty(frame.shape, dtype=numpy.float32)
+            self.buffer = numpy.empty(frame.shape, dtype=frame.dtype)
+
+        self.accumulator[...] = frame
@@ -0,0 +1,511 @@
+# coding=utf-8
+#
+# Copyright 2013 Janne Enberg
+import ctypes
+import ctypes.util
+import datetime
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+import numpy
+
+from filehandler import FileHandler
+from filehandler import FileList
+from pipeline import BadFramePolicy
+from scanindex import timestampPattern
+import media
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+
+__doc__ = """Encoding new images into the timelapse as they arrive"""
+
+
+# Length of the video segments of each rotation, in seconds
+segmentPeriods = {
+    "hourly": 60 * 60,
+    "daily": 24 * 60 * 60
+}
+
+# How the period is shown in the segment filenames
+segmentFormats = {
+    "hourly": "%Y-%m-%d-%H",
+    "daily": "%Y-%m-%d"
+}
+
+# inotify events for files that have been completely written
+IN_CLOSE_WRITE = 0x08
+IN_MOVED_TO = 0x80
+
+# struct inotify_event, followed by the name
+inotifyEvent = struct.Struct("iIII")
+
+
+def file_key(filepath, sortKey, modified=None):
+    """Key to order the files by, like FileList.sort does"""
+
+    if sortKey == "modified":
+        if modified is None:
+            modified = os.path.getmtime(filepath)
+
+        return modified, filepath
+
+    if sortKey == "basename":
+        return os.path.basename(filepath), filepath
+
+    return filepath
+
+
+def get_watcher(dirPatterns, sortKey, interval):
+    """Get an InotifyWatcher, or a PollingWatcher where inotify isn't
+    available"""
+
+    try:
+        return InotifyWatcher(dirPatterns, sortKey, interval)
+    except (AttributeError, OSError) as e:
+        logging.getLogger("pytimelapse").warning(
+            "Can't use inotify ({error}), looking for new files every "
+            "{interval} seconds".format(**{
+                "error": e,
+                "interval": interval
+            })
+        )
+
+    return PollingWatcher(dirPatterns, sortKey, interval)
+
+
+class PollingWatcher(object):
+    """Finds new files by listing the directories every interval seconds
+
+    A file is only taken once it hasn't been modified for interval seconds,
+    and only files coming after the last one taken, in the sort order, are
+    new. So nothing needs to be remembered about each file.
+    """
+
+    def __init__(self, dirPatterns, sortKey, interval):
+        self.dirPatterns = dirPatterns
+        self.sortKey = sortKey
+        self.interval = interval
+
+        # Key of the last file taken
+        self.last = None
+
+    def close(self):
+        """Nothing to release"""
+        pass
+
+    def batches(self):
+        """Iterate lists of new files, an empty one when there were none"""
+
+        while True:
+            files = self.poll()
+
+            yield files
+
+            if not files:
+                time.sleep(self.interval)
+
+    def poll(self):
+        """List the new files that are done being written, in order"""
+
+        cutoff = time.time() - self.interval
+
+        found = []
+        waiting = None
+
+        for path, matchers in self.dirPatterns.items():
+            try:
+                entries = scandir(path)
+            except OSError:
+                continue
+
+            for entry in entries:
+                if not any(match(entry.name) for match in matchers):
+                    continue
+
+                filepath = os.path.join(path, entry.name)
+                modified = entry.stat().st_mtime
+                key = file_key(filepath, self.sortKey, modified)
+
+                if self.last is not None and key <= self.last:
+                    continue
+
+                if modified > cutoff:
+                    # Files after it have to wait, or they would be taken out
+                    # of order
+                    if waiting is None or key < waiting:
+                        waiting = key
+                    continue
+
+                found.append((key, filepath))
+
+        found.sort()
+
+        if waiting is not None:
+            found = [(key, path) for key, path in found if key < waiting]
+
+        if found:
+            self.last = found[-1][0]
+
+        return [filepath for key, filepath in found]
+
+
+class InotifyWatcher(object):
+    """Gets told about new files by the Linux kernel, so only the new files
+    are ever looked at
+
+    Files are taken when they are closed after writing or moved into the
+    directories, if they come after the last one taken in the sort order.
+    """
+
+    def __init__(self, dirPatterns, sortKey, interval):
+        self.sortKey = sortKey
+        self.interval = interval
+        self.last = None
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        # Directory and name matchers of each watch
+        self.watches = {}
+
+        for path, matchers in dirPatterns.items():
+            name = path
+            if not isinstance(name, bytes):
+                name = name.encode(sys.getfilesystemencoding())
+
+            watch = libc.inotify_add_watch(
+                self.fd, name, IN_CLOSE_WRITE | IN_MOVED_TO
+            )
+
+            if watch < 0:
+                error = ctypes.get_errno()
+                self.close()
+                raise OSError(error, "{}: {}".format(
+                    path, os.strerror(error)
+                ))
+
+            self.watches[watch] = (path, matchers)
+
+    def close(self):
+        """Stop watching"""
+        os.close(self.fd)
+
+    def batches(self):
+        """Iterate lists of new files, an empty one when there were none in
+        interval seconds"""
+
+        while True:
+            yield self.wait(self.interval)
+
+    def wait(self, timeout):
+        """List the new files written within timeout seconds, in order"""
+
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+
+        data = os.read(self.fd, 65536)
+        found = {}
+        offset = 0
+
+        while offset < len(data):
+            watch, mask, cookie, length = inotifyEvent.unpack_from(
+                data, offset
+            )
+            offset += inotifyEvent.size
+
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if watch not in self.watches:
+                continue
+
+            if not isinstance(name, str):
+                name = name.decode(sys.getfilesystemencoding())
+
+            path, matchers = self.watches[watch]
+
+            if not any(match(name) for match in matchers):
+                continue
+
+            filepath = os.path.join(path, name)
+
+            try:
+                key = file_key(filepath, self.sortKey)
+            except OSError:
+                # Already gone again
+                continue
+
+            if self.last is None or key > self.last:
+                found[key] = filepath
+
+        if found:
+            self.last = max(found)
+
+        return [found[key] for key in sorted(found)]
+
+
+class Watch(object):
+    """Encodes the new images into a video for each hour or day, as the
+    images arrive
+
+    The files are decoded and encoded one by one as they come in, and each
+    segment is closed, and so playable, as soon as its period is over.
+    """
+
+    def __init__(self, app, config):
+        self.logger = logging.getLogger("pytimelapse")
+        self.app = app
+        self.config = config
+        self.rotation = config["watch"]
+        self.interval = config.get("watchInterval") or 5
+
+        self.fileHandler = FileHandler()
+        self.tz = self.fileHandler.get_timezone(config)
+
+        self.imageHandler = media.ImageHandler()
+        self.policy = BadFramePolicy(
+            config.get("onBadFrame") or "abort",
+            self.imageHandler
+        )
+
+        self.stats = app.get_stats(config, "watch")
+
+        decode = self.imageHandler.read
+        if self.stats:
+            decode = self.stats.wrap("decode", decode)
+
+        self.decode = self.policy.wrap(decode)
+
+        self.frameSize = None
+        self.frameTransform = None
+
+        # Current segment
+        self.video = None
+        self.segment = None
+        self.period = None
+        self.frames = 0
+
+        # Files seen so far, for useNthFile
+        self.seen = 0
+
+    def run(self):
+        """Watch for new files until interrupted"""
+
+        config = self.config
+        sortKey = config["sortFiles"]
+
+        dirPatterns = self.fileHandler.dir_patterns(config["imageFiles"])
+
+        # Watch first, so files written while scanning aren't missed
+        watcher = get_watcher(dirPatterns, sortKey, self.interval)
+
+        try:
+            files = self.fileHandler.find_files(config)
+
+            # The files already there are done, unless told where to start
+            backlog = []
+            if config["startFile"]:
+                backlog = files
+
+            if files:
+                watcher.last = file_key(files[-1], sortKey)
+
+            self.logger.info(
+                "Watching {dirs} directories for new files, {count} to "
+                "catch up with first".format(**{
+                    "dirs": len(dirPatterns),
+                    "count": len(backlog)
+                })
+            )
+
+            if backlog:
+                self.process([backlog])
+
+            self.process(watcher.batches())
+        except KeyboardInterrupt:
+            self.logger.info("Stopped watching")
+        finally:
+            watcher.close()
+            self.close_segment()
+
+            if self.stats:
+                self.stats.close()
+
+        if self.policy.policy != "abort":
+            self.app.report_bad_frames(self.policy.bad, config)
+
+    def process(self, batches):
+        """Encode the files of each batch, an empty batch means nothing came
+        in for a while"""
+
+        for files in batches:
+            if files:
+                files = self.select(files)
+
+            for filename in files:
+                self.add(filename)
+
+            if not files:
+                self.check_idle()
+
+    def select(self, files):
+        """Leave out the files the config filters out"""
+
+        config = self.config
+
+        if config["onlyBetweenTimes"]:
+            files = self.fileHandler.filter_times(
+                FileList(files), config
+            ).paths
+
+        step = config["useNthFile"]
+        if step:
+            first = self.seen
+            self.seen += len(files)
+
+            files = [
+                filename for i, filename in enumerate(files, first)
+                if i % step == 0
+            ]
+
+        return files
+
+    def add(self, filename):
+        """Encode the file into the segment for its time"""
+
+        image = self.policy.handle(self.decode(filename))
+
+        if image is None:
+            return
+
+        period = self.get_period(self.get_time(filename))
+
+        if period != self.period:
+            self.close_segment()
+            self.open_segment(period, filename)
+
+        self.video.write_image(self.frameTransform.apply(image))
+        self.frames += 1
+
+        if self.stats:
+            self.stats.tick()
+
+    def check_idle(self):
+        """Close the segment if its period is over"""
+
+        if self.video is None:
+            return
+
+        # Give the last files of the period a moment to arrive
+        now = self.get_local_time(time.time() - self.interval)
+
+        if self.get_period(now) > self.period:
+            self.close_segment()
+
+    def get_time(self, filename):
+        """Local time of the image, from the timestamp in the filename or
+        otherwise when it was modified"""
+
+        match = timestampPattern.search(os.path.basename(filename))
+
+        if match:
+            timestamp = int(match.group(1))
+        else:
+            timestamp = os.path.getmtime(filename)
+
+        return self.get_local_time(timestamp)
+
+    def get_local_time(self, timestamp):
+        """Seconds since the epoch in the local time of the timestamps"""
+
+        return int(self.fileHandler.local_times(
+            numpy.array([int(timestamp)], dtype=numpy.int64),
+            self.tz
+        )[0])
+
+    def get_period(self, localTime):
+        """Start of the segment period the local time falls in"""
+        return localTime - localTime % segmentPeriods[self.rotation]
+
+    def get_segment_name(self, period):
+        """Filename for the segment of the period, next to outFile"""
+
+        base, extension = os.path.splitext(self.config["outFile"])
+
+        name = datetime.datetime.utcfromtimestamp(period).strftime(
+            segmentFormats[self.rotation]
+        )
+
+        filename = "{}.{}{}".format(base, name, extension)
+
+        # Don't overwrite the segment of an earlier run
+        number = 1
+        while os.path.exists(filename):
+            filename = "{}.{}.{}{}".format(base, name, number, extension)
+            number += 1
+
+        return filename
+
+    def open_segment(self, period, firstFile):
+        """Start a new segment for the period"""
+
+        config = self.config
+
+        # All segments are the size of the first frame, for joining them
+        if self.frameSize is None:
+            self.frameSize = self.app.get_frame_size(
+                self.imageHandler, firstFile, config
+            )
+
+            self.frameTransform = self.app.get_transform(
+                self.frameSize, config
+            )
+
+            if self.stats:
+                self.frameTransform.apply = self.stats.wrap(
+                    "transform", self.frameTransform.apply
+                )
+
+        self.period = period
+        self.segment = self.get_segment_name(period)
+        self.frames = 0
+
+        self.video = self.app.get_video(config, self.frameSize)
+
+        if self.stats:
+            self.video.write_image = self.stats.wrap(
+                "encode", self.video.write_image
+            )
+
+        self.video.open(self.segment)
+
+        self.logger.info("Writing {}".format(self.segment))
+
+    def close_segment(self):
+        """Finish the current segment, if any"""
+
+        if self.video is None:
+            return
+
+        self.video.close()
+        self.video = None
+        self.period = None
+
+        self.logger.info(
+            "Finished {segment} with {frames} frames".format(**{
+                "segment": self.segment,
+                "frames": self.frames
+            })
+        )